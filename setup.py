@@ -3,7 +3,7 @@ from setuptools import setup
 setup(
     name='sql-etudes-python',
     version='0.1.0',
-    packages=['sql-etudes-python', 'sql-etudes-python.manager', 'sql-etudes-python.entities', 'sql-etudes-python.data_analysis'],
+    packages=['sql-etudes-python', 'sql-etudes-python.manager', 'sql-etudes-python.entities', 'sql-etudes-python.data_analysis', 'sql-etudes-python.benchmark', 'sql-etudes-python.datagen', 'sql-etudes-python.migrations'],
     url='',
     license='',
     author='Jernej Vivod',
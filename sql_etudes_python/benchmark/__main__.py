@@ -0,0 +1,118 @@
+import argparse
+import datetime
+import fnmatch
+import json
+import platform
+import sys
+
+from sql_etudes_python.benchmark import cases
+from sql_etudes_python.benchmark import logger
+from sql_etudes_python.benchmark import provision
+from sql_etudes_python.benchmark import runner
+from sql_etudes_python.manager import get_config
+
+"""
+Benchmark suite running the benchmark cases (see cases.py in the same package) at several dataset scales and recording
+the measurements (see runner.py in the same package) to a JSON file. If a baseline (a JSON file produced by an earlier
+run) is given, the wall times are compared against it and the cases that got slower (or faster) by more than the
+threshold are reported.
+
+Example:
+python -m sql_etudes_python.benchmark --scales 0.1 0.5 1 --cases 'analysis*' --output bench.json --baseline baseline.json
+"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sql_etudes_python.benchmark', description='Run the benchmark suite.')
+    parser.add_argument('--dsn', default=None, help='database URL of the source database (configured database if not given)')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1.0], help='dataset scales (portions of the employees)')
+    parser.add_argument('--cases', nargs='+', default=['*'], help='shell-style patterns of the names of the cases to run')
+    parser.add_argument('--repeat', type=int, default=1, help='number of runs of each case (the minimum wall time is recorded)')
+    parser.add_argument('--recreate', action='store_true', help='recreate the scaled databases')
+    parser.add_argument('--output', default='benchmark.json', help='path of the output JSON file')
+    parser.add_argument('--baseline', default=None, help='path of a JSON file with baseline measurements')
+    parser.add_argument('--threshold', type=float, default=1.2, help='ratio of wall times reported as a regression or improvement')
+    parser.add_argument('--list', action='store_true', help='list the cases and exit')
+    args = parser.parse_args(argv)
+
+    case_names = [name for name in cases.get_cases().keys() if any(fnmatch.fnmatchcase(name, pattern) for pattern in args.cases)]
+    if args.list:
+        print('\n'.join(case_names))
+        return 0
+
+    dsn = args.dsn if args.dsn is not None else get_config()['dsn']
+    results = []
+    for scale in args.scales:
+        scaled_dsn = provision.provision_scaled_database(dsn, scale, recreate=args.recreate)
+        for case_name in case_names:
+            logger.info('Running {0} (scale {1})'.format(case_name, scale))
+            res = runner.run_case(case_name, scaled_dsn, repeat=args.repeat)
+            if 'error' in res:
+                logger.warning('{0} (scale {1}) failed: {2}'.format(case_name, scale, res['error']))
+            results.append(dict(scale=scale, case=case_name, **res))
+
+    document = {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(document, f, indent=2)
+    logger.info('Results written to {0}'.format(args.output))
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        print(format_comparison(compare(baseline['results'], results, args.threshold)))
+    return 0
+
+
+def compare(baseline_results, results, threshold):
+    """Compare measurements against baseline measurements.
+
+    :param baseline_results: list of baseline measurements
+    :param results: list of measurements
+    :param threshold: ratio of wall times above which a case is reported as a regression (or below the reciprocal of
+    which it is reported as an improvement)
+    :return: list of dictionaries with the scale, case, baseline and new wall times, their ratio and the status
+    """
+    scale_case_to_baseline = {(res['scale'], res['case']): res for res in baseline_results}
+    comparison = []
+    for res in results:
+        baseline_res = scale_case_to_baseline.get((res['scale'], res['case']))
+        if baseline_res is None or 'wall_time' not in baseline_res or 'wall_time' not in res:
+            status, ratio = ('error' if 'error' in res else 'new'), None
+        else:
+            ratio = res['wall_time'] / baseline_res['wall_time'] if baseline_res['wall_time'] > 0 else float('inf')
+            status = 'regression' if ratio > threshold else 'improvement' if ratio < 1 / threshold else 'unchanged'
+        comparison.append({
+            'scale': res['scale'],
+            'case': res['case'],
+            'baseline_wall_time': baseline_res.get('wall_time') if baseline_res is not None else None,
+            'wall_time': res.get('wall_time'),
+            'ratio': ratio,
+            'status': status,
+        })
+    return comparison
+
+
+def format_comparison(comparison):
+    lines = ['{0:>6}  {1:<70} {2:>10} {3:>10} {4:>7}  {5}'.format('scale', 'case', 'baseline', 'new', 'ratio', 'status')]
+    for c in comparison:
+        lines.append('{0:>6}  {1:<70} {2:>10} {3:>10} {4:>7}  {5}'.format(
+            c['scale'],
+            c['case'],
+            '{0:.3f}'.format(c['baseline_wall_time']) if c['baseline_wall_time'] is not None else '-',
+            '{0:.3f}'.format(c['wall_time']) if c['wall_time'] is not None else '-',
+            '{0:.2f}'.format(c['ratio']) if c['ratio'] is not None else '-',
+            c['status'].upper() if c['status'] in ('regression', 'error') else c['status']
+        ))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import collections
+import inspect
+import tempfile
+
+"""
+Registry of the benchmark cases. Each case consists of a prepare function that produces the input of the case (e.g. the
+ResContainer instance to visualize) and is not measured, and a run function that is called with this input and measured.
+
+The cases cover the analysis functions in the analysis.py, analysis_psycopg2.py and analysis_snapshot.py scripts, the
+query functions in the employee_manager.py and salary_manager.py scripts (called with sample arguments) and the
+visualization functions in the visualization.py script.
+"""
+
+Case = collections.namedtuple('Case', ['name', 'prepare', 'run'])
+
+# prefixes of the manager functions that do not query the database or can not be called with sample arguments
+_SKIPPED_MANAGER_FUNCTION_PREFIXES = ('select_', 'rows_to_', 'fetch_', '_')
+
+
+def get_cases():
+    """Get the benchmark cases.
+
+    :return: map of case names to Case instances
+    """
+    from sql_etudes_python.data_analysis import analysis, analysis_psycopg2, analysis_snapshot
+    from sql_etudes_python.manager import employee_manager, salary_manager
+
+    cases = [
+        _get_case('analysis.get_data_analysis1', analysis.get_data_analysis1),
+        _get_case('analysis.get_data_analysis2', analysis.get_data_analysis2),
+        _get_case('analysis.get_data_analysis3', analysis.get_data_analysis3),
+        _get_case('analysis.get_data_analysis3[per_year]', analysis.get_data_analysis3, mode='per_year'),
+        _get_case('analysis.get_data_analysis3[employee_year]', analysis.get_data_analysis3, mode='employee_year'),
+        _get_case('analysis.get_data_analysis5', analysis.get_data_analysis5),
+        _get_case('analysis_psycopg2.get_data_analysis1', analysis_psycopg2.get_data_analysis1),
+        _get_case('analysis_psycopg2.get_data_analysis4', analysis_psycopg2.get_data_analysis4),
+        _get_case('analysis_psycopg2.get_data_analysis4[sql]', analysis_psycopg2.get_data_analysis4, mode='sql'),
+        _get_case('analysis_psycopg2.get_data_analysis4[employee_year]', analysis_psycopg2.get_data_analysis4, mode='employee_year'),
+        _get_case('analysis_snapshot.get_data_analysis1', analysis_snapshot.get_data_analysis1),
+        _get_case('analysis_snapshot.get_data_analysis2', analysis_snapshot.get_data_analysis2),
+        _get_case('analysis_snapshot.get_data_analysis3', analysis_snapshot.get_data_analysis3),
+        _get_case('analysis_snapshot.get_data_analysis4', analysis_snapshot.get_data_analysis4),
+    ]
+    for module in (employee_manager, salary_manager):
+        cases += _get_manager_cases(module)
+    cases += _get_visualization_cases()
+    return collections.OrderedDict((case.name, case) for case in cases)
+
+
+def _get_case(name, func, **kwargs):
+    return Case(name, lambda: None, lambda _: func(**kwargs))
+
+
+def _get_manager_cases(module):
+    module_name = module.__name__.split('.')[-1]
+    cases = []
+    for func_name, func in inspect.getmembers(module, inspect.isfunction):
+        if func.__module__ != module.__name__ or func_name.startswith(_SKIPPED_MANAGER_FUNCTION_PREFIXES):
+            continue
+        params = inspect.signature(func).parameters
+        required_params = [p.name for p in params.values() if p.default is inspect.Parameter.empty]
+        if not all(p in _SAMPLE_ARG_GETTERS for p in required_params):
+            continue
+        # the functions supporting the lite mode are also measured with the compact rows
+        for suffix, extra_kwargs in [('', dict())] + ([('[lite]', {'lite': True})] if 'lite' in params else []):
+            cases.append(Case(
+                '{0}.{1}{2}'.format(module_name, func_name, suffix),
+                lambda required_params=required_params: {p: _SAMPLE_ARG_GETTERS[p]() for p in required_params},
+                lambda kwargs, func=func, extra_kwargs=extra_kwargs: _consume(func(**kwargs, **extra_kwargs))
+            ))
+    return cases
+
+
+def _get_visualization_cases():
+    from sql_etudes_python.data_analysis import analysis, analysis_psycopg2
+
+    analysis_funcs = {
+        1: analysis.get_data_analysis1,
+        2: analysis.get_data_analysis2,
+        3: analysis.get_data_analysis3,
+        4: analysis_psycopg2.get_data_analysis4,
+        5: analysis.get_data_analysis5,
+    }
+
+    def run(res_container, i):
+        # imported here so that the other cases can be listed and run without the plotting dependencies
+        from sql_etudes_python.data_analysis import visualization
+        with tempfile.TemporaryDirectory() as output_dir:
+            getattr(visualization, 'get_vis_analysis{0}'.format(i))(res_container, output_dir=output_dir)
+
+    return [Case('visualization.get_vis_analysis{0}'.format(i), analysis_funcs[i], lambda res_container, i=i: run(res_container, i))
+            for i in sorted(analysis_funcs.keys())]
+
+
+def _consume(res):
+    # consume the results of the streaming (iter_*) functions
+    if inspect.isgenerator(res):
+        return sum(1 for _ in res)
+    return res
+
+
+def _get_sample_title():
+    from sql_etudes_python.manager import title_manager
+    return title_manager.get_all_distinct_titles()[0]
+
+
+def _get_sample_dept():
+    from sql_etudes_python.manager import department_manager
+    return department_manager.get_all_departments()[0]
+
+
+def _get_sample_years():
+    from sql_etudes_python.manager import salary_manager
+    return salary_manager.get_distinct_years_salaries_asc()[:-1]
+
+
+_SAMPLE_ARG_GETTERS = {
+    'title': _get_sample_title,
+    'dept': _get_sample_dept,
+    'percentile': lambda: 0.9,
+    'percentiles': lambda: [0.9, 0.95, 0.99],
+    'years': _get_sample_years,
+}
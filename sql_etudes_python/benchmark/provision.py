@@ -0,0 +1,82 @@
+import psycopg2
+from sqlalchemy.engine import make_url
+
+from sql_etudes_python.benchmark import logger
+
+"""
+Provisioning of scaled copies of the employees database for the benchmarks. A database for scale s (0 < s < 1) is
+created as a copy of the source database (using it as a template) from which a deterministic pseudo-random portion of
+1 - s of the employees is deleted (the rows referencing them are deleted by the ON DELETE CASCADE foreign keys).
+The scaled databases are named <source database>_scale_<scale in per mille> and are reused by later runs.
+"""
+
+
+def get_scaled_dsn(dsn, scale):
+    """Get the database URL of the scaled copy of a database (the URL itself for scale 1).
+
+    :param dsn: database URL of the source database
+    :param scale: portion of the employees kept in the scaled database
+    :return: database URL
+    """
+    if scale == 1:
+        return dsn
+    url = make_url(dsn)
+    return url.set(database='{0}_scale_{1}'.format(url.database, int(round(scale * 1000)))).render_as_string(hide_password=False)
+
+
+def provision_scaled_database(dsn, scale, recreate=False):
+    """Create the scaled copy of a database if it does not exist yet.
+
+    :param dsn: database URL of the source database
+    :param scale: portion of the employees kept in the scaled database
+    :param recreate: if True, recreate the scaled database even if it exists
+    :return: database URL of the scaled database
+    """
+    if not 0 < scale <= 1:
+        raise ValueError('scale must be in (0, 1]')
+    scaled_dsn = get_scaled_dsn(dsn, scale)
+    if scale == 1:
+        return scaled_dsn
+
+    source_url, scaled_url = make_url(dsn), make_url(scaled_dsn)
+    # the database is populated under a temporary name and renamed when done, so that interrupted runs are not reused
+    tmp_url = scaled_url.set(database=scaled_url.database + '_tmp')
+    admin_conn = psycopg2.connect(_to_psycopg2_dsn(source_url.set(database='postgres')))
+    try:
+        admin_conn.autocommit = True
+        with admin_conn.cursor() as curs:
+            curs.execute('SELECT 1 FROM pg_database WHERE datname = %(name)s', {'name': scaled_url.database})
+            exists = curs.fetchone() is not None
+            if exists and not recreate:
+                return scaled_dsn
+
+            logger.info('Creating database {0} (scale {1})'.format(scaled_url.database, scale))
+            curs.execute('DROP DATABASE IF EXISTS "{0}"'.format(tmp_url.database))
+            # the source database must not have other open connections while it is used as a template
+            curs.execute('CREATE DATABASE "{0}" TEMPLATE "{1}"'.format(tmp_url.database, source_url.database))
+
+            conn = psycopg2.connect(_to_psycopg2_dsn(tmp_url))
+            try:
+                with conn.cursor() as tmp_curs:
+                    tmp_curs.execute('DELETE FROM employees.employees WHERE abs(hashtext(emp_no::text)) %% 10000 >= %(n)s',
+                                     {'n': int(round(scale * 10000))})
+                    # the current employees materialized view (see current_state.py in the manager package) is not updated by the deletion
+                    tmp_curs.execute("SELECT matviewname FROM pg_matviews WHERE schemaname = 'employees'")
+                    for (matview_name,) in tmp_curs.fetchall():
+                        tmp_curs.execute('REFRESH MATERIALIZED VIEW employees.{0}'.format(matview_name))
+                    conn.commit()
+                conn.autocommit = True
+                with conn.cursor() as tmp_curs:
+                    tmp_curs.execute('VACUUM ANALYZE')
+            finally:
+                conn.close()
+
+            curs.execute('DROP DATABASE IF EXISTS "{0}"'.format(scaled_url.database))
+            curs.execute('ALTER DATABASE "{0}" RENAME TO "{1}"'.format(tmp_url.database, scaled_url.database))
+    finally:
+        admin_conn.close()
+    return scaled_dsn
+
+
+def _to_psycopg2_dsn(url):
+    return url.set(drivername='postgresql').render_as_string(hide_password=False)
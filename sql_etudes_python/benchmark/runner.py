@@ -0,0 +1,141 @@
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import time
+import traceback
+
+"""
+Measurement of the benchmark cases (see cases.py in the same package). Each case is run in a fresh process (so that the
+peak resident set size, connection pools and caches are not shared between cases) in which the following is recorded:
+wall_time - minimum wall time of the runs of the case in seconds
+n_queries - number of queries executed by a run of the case
+n_rows - number of rows returned to the client by a run of the case
+peak_rss - peak resident set size of the process in bytes
+peak_rss_prepared - peak resident set size of the process before the case was run (after imports and preparation)
+
+The queries are counted using SQLAlchemy engine events (ORM and asyncio paths) and a counting cursor class set on the
+psycopg2 connections (raw connections). For the drivers other than psycopg2, the number of rows is the row count
+reported by the driver.
+"""
+
+
+def run_case(case_name, dsn, repeat=1):
+    """Run a benchmark case in a new process.
+
+    :param case_name: name of the case (see cases.get_cases)
+    :param dsn: database URL of the database against which to run the case
+    :param repeat: number of runs of the case
+    :return: dictionary of measurements (with an error key if the case failed)
+    """
+    env = {
+        'SQL_ETUDES_DSN': dsn,
+        # measure the computations rather than the caches
+        'SQL_ETUDES_RESULT_CACHE': '0',
+        'SQL_ETUDES_TABLE_CACHE': '0',
+        'MPLBACKEND': 'Agg',
+    }
+    ctx = multiprocessing.get_context('spawn')
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_run_case_in_process, args=(case_name, env, repeat, child_conn))
+    process.start()
+    child_conn.close()
+    try:
+        res = parent_conn.recv()
+    except EOFError:
+        res = {'error': 'process exited with code {0}'.format(process.exitcode)}
+    process.join()
+    return res
+
+
+def _run_case_in_process(case_name, env, repeat, conn):
+    os.environ.update(env)
+    try:
+        from sql_etudes_python.benchmark import cases
+        case = cases.get_cases()[case_name]
+        counters = _Counters()
+        _install_counters(counters)
+
+        prepared = case.prepare()
+        peak_rss_prepared = _get_peak_rss()
+        wall_times = []
+        for _ in range(repeat):
+            counters.reset()
+            start = time.perf_counter()
+            case.run(prepared)
+            wall_times.append(time.perf_counter() - start)
+
+        conn.send({
+            'wall_time': min(wall_times),
+            'n_queries': counters.n_queries,
+            'n_rows': counters.n_rows,
+            'peak_rss': _get_peak_rss(),
+            'peak_rss_prepared': peak_rss_prepared,
+        })
+    except Exception as e:
+        conn.send({'error': '{0}: {1}'.format(type(e).__name__, e), 'traceback': traceback.format_exc()})
+    finally:
+        conn.close()
+
+
+def _get_peak_rss():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class _Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.n_queries = 0
+        self.n_rows = 0
+
+    def reset(self):
+        with self._lock:
+            self.n_queries, self.n_rows = 0, 0
+
+    def add(self, n_queries, n_rows):
+        with self._lock:
+            self.n_queries += n_queries
+            self.n_rows += max(n_rows, 0)
+
+
+def _install_counters(counters):
+    import psycopg2.extensions
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from sqlalchemy.pool import Pool
+
+    class CountingCursor(psycopg2.extensions.cursor):
+        def execute(self, query, vars=None):
+            res = super().execute(query, vars)
+            # the rows of named (server-side) cursors are counted when the cursor is closed
+            counters.add(1, self.rowcount if self.name is None else 0)
+            return res
+
+        def executemany(self, query, vars_list):
+            res = super().executemany(query, vars_list)
+            counters.add(1, 0)
+            return res
+
+        def copy_expert(self, sql, file, size=8192):
+            res = super().copy_expert(sql, file, size)
+            counters.add(1, self.rowcount)
+            return res
+
+        def close(self):
+            if self.name is not None and not self.closed:
+                counters.add(0, self.rowcount)
+            super().close()
+
+    @event.listens_for(Pool, 'connect')
+    def connect(dbapi_connection, _):
+        if isinstance(dbapi_connection, psycopg2.extensions.connection):
+            dbapi_connection.cursor_factory = CountingCursor
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # queries executed with psycopg2 cursors are counted by CountingCursor
+        if not isinstance(cursor, CountingCursor):
+            counters.add(1, getattr(cursor, 'rowcount', 0) or 0)
@@ -1,13 +1,19 @@
+import functools
 import re
 
-import scipy.stats as stats
 from tqdm import tqdm
 
 from sql_etudes_python import constants
+from sql_etudes_python.data_analysis import correlation
 from sql_etudes_python.data_analysis import logger
+from sql_etudes_python.data_analysis import result_cache
+from sql_etudes_python.data_analysis.res_container import ArrayResContainer
+from sql_etudes_python.data_analysis.res_container import LabeledArray
 from sql_etudes_python.data_analysis.res_container import ResContainer
 from sql_etudes_python.manager import department_manager
 from sql_etudes_python.manager import employee_manager
+from sql_etudes_python.manager import employee_year_manager
+from sql_etudes_python.manager import executor
 from sql_etudes_python.manager import salary_manager
 from sql_etudes_python.manager import title_manager
 
@@ -21,7 +27,22 @@ analysis_psycopg2.py script located in the same package that uses the psycopg2 f
 Author: Jernej Vivod (vivod.jernej@gmail.com)
 """
 
-
+# dimensions and descriptions of the gender-based data (see get_gender_based_data) stacked by year in the 3. analysis
+GENDER_BASED_DATA_BY_YEAR = {
+    'portion_female_all': (['year'], 'portion of female employees in the company by year'),
+    'title_to_portion_female': (['year', 'title'], 'portion of female employees having the title by year and title'),
+    'portion_female_managers': (['year'], 'portion of female managers by year'),
+    'dept_to_portion_female': (['year', 'dept'], 'portion of female employees in the department by year and department'),
+    'salary_percentile_to_portion_female': (['year', 'percentile'], 'portion of female employees in the salary percentile by year and percentile'),
+    'title_to_salary_percentile_to_portion_female': (['year', 'title', 'percentile'],
+                                                     'portion of female employees having the title in the salary percentile by year, title and percentile'),
+    'salary_percentile_to_portion_female_managers': (['year', 'percentile'], 'portion of female managers in the salary percentile by year and percentile'),
+    'dept_to_salary_percentile_to_portion_female': (['year', 'dept', 'percentile'],
+                                                    'portion of female employees in the department in the salary percentile by year, department and percentile'),
+}
+
+
+@result_cache.cached
 def get_data_analysis1():
     """Task instructions: Rank the employee titles according to the average salary for each department and for the whole company.
     Present the results in a bar chart.
@@ -35,19 +56,16 @@ def get_data_analysis1():
     titles = title_manager.get_all_distinct_titles()
     departments = department_manager.get_all_departments()
 
-    # for each title compute the average salary for the whole company and for a specific department
-    title_to_average_salary_company = dict()
-    dept_to_title_to_average_salary = {dept.dept_name: dict() for dept in departments}
+    # compute the average salary for each title for the whole company and for each department in one aggregate query
     logger.info('Computing salary data for titles')
-    for title in tqdm(titles, colour='green', desc='Computing data for titles'):
-
-        # for department
-        for dept in departments:
-            salaries_title_dept = salary_manager.get_salaries_title_dept(title, dept)
-            dept_to_title_to_average_salary[dept.dept_name][title.title] = get_average_salary(salaries_title_dept)
+    title_to_average_salary_company_res, dept_to_title_to_average_salary_res = salary_manager.get_average_salaries_title_dept()
 
-        # for whole company
-        title_to_average_salary_company[title.title] = get_average_salary(salary_manager.get_salaries_title(title))
+    # titles without current salaries are marked with an average salary of -1.0
+    title_to_average_salary_company = {title.title: title_to_average_salary_company_res.get(title.title, -1.0) for title in titles}
+    dept_to_title_to_average_salary = {
+        dept.dept_name: {title.title: dept_to_title_to_average_salary_res.get(dept.dept_name, dict()).get(title.title, -1.0) for title in titles}
+        for dept in departments
+    }
 
     # add results to results container and return
     logger.info('Storing results in results container')
@@ -69,48 +87,89 @@ def get_data_analysis1():
 
 # The company actively pursues gender equality. Prepare an analysis based on salaries and gender distribution
 # by departments, managers, and titles. Present results in a chart (or several charts) of your choice.
-def get_data_analysis2():
+@result_cache.cached
+def get_data_analysis2(concurrency=None, jobs=None):
     """Task instructions: The company actively pursues gender equality. Prepare an analysis based on salaries and gender distribution
     by departments, managers, and titles. Present results in a chart (or several charts) of your choice.
 
+    :param concurrency: maximum number of queries executed concurrently using asyncio
+    :param jobs: number of threads executing the queries (the queries are executed one after another if both concurrency
+    and jobs are None)
     :return: ResContainer instance containing the obtained results
     """
     logger.info('Obtaining data for 2. analysis')
 
     # get results irrespective of year
-    data = get_gender_based_data(year=None)
+    data = get_gender_based_data(year=None, concurrency=concurrency, jobs=jobs)
     logger.info('Finished obtaining data for 2. analysis')
     return data
 
 
 # Same as analysis2 but prepare an analysis also on a yearly basis (the same charts by year).
-def get_data_analysis3():
+@result_cache.cached
+def get_data_analysis3(mode='single_pass', concurrency=None, jobs=None, years=None):
     """Task instructions: Prepare the same analysis but also on a yearly basis.
 
-    :return: ResContainer instance containing the obtained results
+    :param mode: 'single_pass' to compute the data for all years with queries grouped by year, 'per_year' to
+    compute the data separately for each year or 'employee_year' to compute the data for all years from the employee_year
+    fact table (see the employee_year_manager.py script in the manager package, which counts each employee once per year
+    with their highest salary and last department and title in the year)
+    :param concurrency: maximum number of queries executed concurrently using asyncio in the 'per_year' mode
+    :param jobs: number of threads executing the queries in the 'per_year' mode (the queries are executed one after
+    another if both concurrency and jobs are None)
+    :param years: if not None, compute the data only for these years (see incremental.py in the same package)
+    :return: ArrayResContainer instance containing the obtained results (see stack_gender_based_data)
     """
     logger.info('Obtaining data for 3. analysis')
 
-    # get list of relevant years
-    logger.info('Obtaining list of relevant years')
-    years = salary_manager.get_distinct_years_salaries_asc()
-
-    # get and return results for each relevant year
-    res_container = ResContainer()
-    for year in years[:-1]:
-        logger.info('Obtaining data for year {0}'.format(year))
-        res_container.add_res_with_desc(str(year), get_gender_based_data(year), 'gender-based data for year {0}'.format(year))
+    # get list of relevant years (the last year is not complete)
+    if years is None:
+        logger.info('Obtaining list of relevant years')
+        years = salary_manager.get_distinct_years_salaries_asc()[:-1]
+
+    # get results for each relevant year and stack them by year
+    if mode == 'single_pass':
+        year_to_res_container = get_gender_based_data_by_year(years)
+    elif mode == 'employee_year':
+        year_to_res_container = get_gender_based_data_by_year(years, employee_year_manager)
+    elif mode == 'per_year':
+        year_to_res_container = dict()
+        for year in years:
+            logger.info('Obtaining data for year {0}'.format(year))
+            year_to_res_container[year] = get_gender_based_data(year, concurrency, jobs)
+    else:
+        raise ValueError('Unknown mode {0}'.format(mode))
+    res_container = stack_gender_based_data(year_to_res_container)
 
     logger.info('Finished obtaining data for 3. analysis')
     return res_container
 
 
+def stack_gender_based_data(year_to_res_container):
+    """Stack the gender-based data for years (see get_gender_based_data) into labeled arrays with the year as the first
+    dimension (see GENDER_BASED_DATA_BY_YEAR for the dimensions of the results).
+
+    :param year_to_res_container: map of years to ResContainer instances containing the gender-based data for the years
+    :return: ArrayResContainer instance containing the stacked results (NaN for titles and departments without data in
+    a year)
+    """
+    res_container = ArrayResContainer()
+    for key, (dims, desc) in GENDER_BASED_DATA_BY_YEAR.items():
+        year_to_res = {year: res_container_year.get_res(key) for year, res_container_year in year_to_res_container.items()}
+        res_container.add_res_with_desc(key, LabeledArray.from_dict(year_to_res, dims), desc)
+    return res_container
+
+
 # Find the most successful department (with highest mean salaries) and chart its characteristics (distribution of titles, salaries, genders, ...).
 # Compare this chart with charts from other departments and hypothesize on reasons for success.
-def get_data_analysis5():
+@result_cache.cached
+def get_data_analysis5(jobs=None, n_resamples=10000, seed=0):
     """Task instructions: Find the most successful department (with highest mean salaries) and chart its characteristics (distribution of titles, salaries, genders, ...).
     Compare this chart with charts from other departments and hypothesize on reasons for success.
 
+    :param jobs: number of threads computing the data for the departments (computed one after another if None)
+    :param n_resamples: number of bootstrap samples and permutations used to assess the correlations
+    :param seed: seed of the random number generator used for the bootstrap samples and permutations
     :return: ResContainer instance containing the obtained results
     """
     logger.info('Obtaining data for 5. analysis')
@@ -118,10 +177,9 @@ def get_data_analysis5():
     # compute mean salaries (current) for departments
     logger.info('Obtaining list of departments')
     departments = department_manager.get_all_departments()
-    dept_no_to_mean_salary = dict()
     logger.info('Computing mean salary for all departments')
-    for dept in tqdm(departments, colour='green', desc='Computing mean salary for departments'):
-        dept_no_to_mean_salary[dept.dept_no] = salary_manager.get_mean_salary_dept(dept)
+    mean_salaries = executor.map_threads(salary_manager.get_mean_salary_dept, departments, jobs, 'Computing mean salary for departments')
+    dept_no_to_mean_salary = {dept.dept_no: mean_salary for dept, mean_salary in zip(departments, mean_salaries)}
 
     # Compute lists of characteristics (single value) for each department (for Pearson correlation computation)
     # portion of female employees for departments
@@ -135,144 +193,286 @@ def get_data_analysis5():
 
     titles = title_manager.get_all_distinct_titles()
     percentiles = [0.5, 0.75, 0.9, 0.95, 0.99]
-    logger.info('Computing data for statistical correlation analysis for departments')
-    for dept in tqdm(departments, colour='green', desc='computing data for correlation analysis for all departments'):
+
+    def get_characteristics_dept(dept):
         # initialize counter of senior employees
         num_senior = 0
-        employees_dept = employee_manager.get_employees_dept(dept)
-        dept_no_to_portion_number_female[dept.dept_no] = \
-            (get_portion_employees_for_gender(employees_dept, constants.FEMALE), get_number_employees_for_gender(employees_dept, constants.FEMALE))
+        gender_counts_dept = employee_manager.get_employees_dept_gender_counts(dept)
+        n_employees_dept = gender_counts_dept[0]
+        portion_number_female = (get_portion_for_gender(gender_counts_dept, constants.FEMALE), gender_counts_dept[1])
+        title_to_portion_number = dict()
         for title in titles:
-            employees_dept_title = employee_manager.get_employees_for_title_for_department(dept, title)
-            dept_no_to_title_to_portion_number[dept.dept_no][title.title] = (len(employees_dept_title) / len(employees_dept), len(employees_dept_title))
-            if title in constants.SENIOR_TITLES:
-                num_senior += len(employees_dept_title)
+            n_employees_dept_title = employee_manager.get_employees_for_title_for_department_gender_counts(dept, title)[0]
+            title_to_portion_number[title.title] = (n_employees_dept_title / n_employees_dept, n_employees_dept_title)
+            if title.title in constants.SENIOR_TITLES:
+                num_senior += n_employees_dept_title
 
-        dept_no_to_portion_number_senior[dept.dept_no] = (num_senior / len(employees_dept), num_senior)
+        portion_number_senior = (num_senior / n_employees_dept, num_senior)
 
+        salary_percentile_value = dict()
         for percentile in percentiles:
-            dept_no_to_salary_percentile_value[dept.dept_no][percentile] = salary_manager.get_percentile_value_dept(dept, percentile)
+            salary_percentile_value[percentile] = salary_manager.get_percentile_value_dept(dept, percentile)
 
-    # get sorted list of department numbers for aligning lists for computing statistics
-    dept_nos_sorted = sorted(map(lambda x: x.dept_no, departments))
-
-    logger.info('Computing correlation analysis and storing the results')
+        return portion_number_female, title_to_portion_number, portion_number_senior, salary_percentile_value
 
-    # Initialize results container
-    res_container = ResContainer()
+    logger.info('Computing data for statistical correlation analysis for departments')
+    characteristics = executor.map_threads(get_characteristics_dept, departments, jobs, 'computing data for correlation analysis for all departments')
+    for dept, (portion_number_female, title_to_portion_number, portion_number_senior, salary_percentile_value) in zip(departments, characteristics):
+        dept_no_to_portion_number_female[dept.dept_no] = portion_number_female
+        dept_no_to_title_to_portion_number[dept.dept_no] = title_to_portion_number
+        dept_no_to_portion_number_senior[dept.dept_no] = portion_number_senior
+        dept_no_to_salary_percentile_value[dept.dept_no] = salary_percentile_value
+
+    # get sorted list of department numbers for aligning the characteristics for computing statistics
+    dept_nos_sorted = sorted(map(lambda x: x.dept_no, departments))
 
-    # add mean salaries for departments to results container
-    res_container.add_res_with_desc('dept_no_to_mean_salary', dept_no_to_mean_salary, 'mapping of department numbers to mean salaries')
+    # matrix of characteristics (one row for each characteristic, one column for each department) with their names and
+    # descriptions
+    feature_names, feature_descs, features = [], [], []
 
-    # add computed statistics
-    # 1. portion female employees
-    p_corr_portion_female = p_corr([dept_no_to_portion_number_female[d][0] for d in dept_nos_sorted], [dept_no_to_mean_salary[d] for d in dept_nos_sorted])
-    res_container.add_res_with_desc('portion_female', p_corr_portion_female, 'pearsonr results for the portion of female employees')
+    def add_feature(name, desc, dept_no_to_value):
+        feature_names.append(name)
+        feature_descs.append(desc)
+        features.append([dept_no_to_value[d] for d in dept_nos_sorted])
 
-    # 1A. number female employees
-    p_corr_num_female = p_corr([dept_no_to_portion_number_female[d][1] for d in dept_nos_sorted], [dept_no_to_mean_salary[d] for d in dept_nos_sorted])
-    res_container.add_res_with_desc('number_female', p_corr_num_female, 'pearsonr results for the number of female employees')
+    # 1. portion/number female employees
+    add_feature('portion_female', 'the portion of female employees', {d: v[0] for d, v in dept_no_to_portion_number_female.items()})
+    add_feature('number_female', 'the number of female employees', {d: v[1] for d, v in dept_no_to_portion_number_female.items()})
 
     # 2., 2A., ... portion/number of title
     for title in titles:
-        p_corr_portion_title = p_corr([dept_no_to_title_to_portion_number[d][title.title][0] for d in dept_nos_sorted], [dept_no_to_mean_salary[d] for d in dept_nos_sorted])
-        p_corr_num_title = p_corr([dept_no_to_title_to_portion_number[d][title.title][1] for d in dept_nos_sorted], [dept_no_to_mean_salary[d] for d in dept_nos_sorted])
         title_snake_case = re.sub(r'(?<!^)(?=[A-Z])', '_', title.title.replace(' ', '')).lower()
-        res_container.add_res_with_desc('portion_{0}'.format(title_snake_case), p_corr_portion_title, 'pearsonr results for the portion of {0} titles'.format(title.title))
-        res_container.add_res_with_desc('number_{0}'.format(title_snake_case), p_corr_num_title, 'pearsonr results for the portion of {0} titles'.format(title.title))
-
-    # 3. portion senior titles
-    p_corr_portion_senior = p_corr([dept_no_to_portion_number_female[d][0] for d in dept_nos_sorted], [dept_no_to_mean_salary[d] for d in dept_nos_sorted])
-    res_container.add_res_with_desc('portion_senior', p_corr_portion_senior, 'pearsonr results for the portion of employees with senior titles')
+        add_feature('portion_{0}'.format(title_snake_case), 'the portion of {0} titles'.format(title.title),
+                    {d: v[title.title][0] for d, v in dept_no_to_title_to_portion_number.items()})
+        add_feature('number_{0}'.format(title_snake_case), 'the number of {0} titles'.format(title.title),
+                    {d: v[title.title][1] for d, v in dept_no_to_title_to_portion_number.items()})
 
-    # 3A. number senior titles
-    p_corr_portion_senior = p_corr([dept_no_to_portion_number_female[d][1] for d in dept_nos_sorted], [dept_no_to_mean_salary[d] for d in dept_nos_sorted])
-    res_container.add_res_with_desc('number_senior', p_corr_portion_senior, 'pearsonr results for the number of employees with senior titles')
+    # 3. portion/number senior titles
+    add_feature('portion_senior', 'the portion of employees with senior titles', {d: v[0] for d, v in dept_no_to_portion_number_senior.items()})
+    add_feature('number_senior', 'the number of employees with senior titles', {d: v[1] for d, v in dept_no_to_portion_number_senior.items()})
 
     # 4. percentile values
     for percentile in percentiles:
-        p_corr_percentile_value = p_corr([dept_no_to_salary_percentile_value[d][percentile] for d in dept_nos_sorted], [dept_no_to_mean_salary[d] for d in dept_nos_sorted])
-        res_container.add_res_with_desc('percentile_value_{0}'.format(int(percentile * 100)), p_corr_percentile_value, 'pearsonr results for the {0}th percentile value'.format(int(percentile * 100)))
+        add_feature('percentile_value_{0}'.format(int(percentile * 100)), 'the {0}th percentile value'.format(int(percentile * 100)),
+                    {d: v[percentile] for d, v in dept_no_to_salary_percentile_value.items()})
+
+    logger.info('Computing correlation analysis and storing the results')
+
+    # correlations of all characteristics with the mean salaries (see the correlation.py script in the same package)
+    correlations = correlation.get_correlations(feature_names, features, [dept_no_to_mean_salary[d] for d in dept_nos_sorted], n_resamples, seed=seed)
+
+    # Initialize results container
+    res_container = ResContainer()
+
+    # add mean salaries for departments to results container
+    res_container.add_res_with_desc('dept_no_to_mean_salary', dept_no_to_mean_salary, 'mapping of department numbers to mean salaries')
+
+    # add computed statistics
+    res_container.add_res_with_desc(
+        'correlations',
+        correlations,
+        'Pearson and Spearman correlations of the characteristics of departments with their mean salaries (coefficients, p-values, '
+        'bootstrap confidence intervals and permutation p-values)'
+    )
+    pearson = correlations.sel(method='pearson', statistic=['r', 'p_value'])
+    for name, desc in zip(feature_names, feature_descs):
+        res_container.add_res_with_desc(name, tuple(pearson.sel(feature=name).values.tolist()), 'pearsonr results for {0}'.format(desc))
 
     logger.info('Finished obtaining data for 5. analysis')
     return res_container
 
 
 def get_average_salary(salaries):
-    if salaries:
-        return sum(s.salary for s in salaries) / len(salaries)
-    else:
-        return -1.0
+    # consume the salaries incrementally (they can be given as a stream, see the iter_* functions in salary_manager.py)
+    total, n = 0, 0
+    for s in salaries:
+        total += s.salary
+        n += 1
+    return total / n if n > 0 else -1.0
+
+
+def get_gender_counts(employees):
+    """Count the employees (total, female, male) in a single pass over the employees (which can be given as a stream,
+    see the iter_* functions in employee_manager.py).
+
+    :param employees: iterable of Employee instances
+    :return: tuple (total, female, male)
+    """
+    total, female, male = 0, 0, 0
+    for e in employees:
+        total += 1
+        if e.gender == constants.FEMALE:
+            female += 1
+        elif e.gender == constants.MALE:
+            male += 1
+    return total, female, male
 
 
 def get_portion_employees_for_gender(employees, gender):
-    return get_number_employees_for_gender(employees, gender) / len(employees) \
-        if len(employees) > 0 \
-        else 0.0
+    return get_portion_for_gender(get_gender_counts(employees), gender)
 
 
 def get_number_employees_for_gender(employees, gender):
-    return len(list(filter(lambda e: e.gender == gender, employees)))
+    _, female, male = get_gender_counts(employees)
+    return female if gender == constants.FEMALE else male
+
 
+def get_portion_for_gender(gender_counts, gender):
+    total, female, male = gender_counts
+    return (female if gender == constants.FEMALE else male) / total \
+        if total > 0 \
+        else 0.0
 
-def p_corr(data1, data2):
-    return stats.pearsonr(data1, data2)
 
+@result_cache.cached
+def get_gender_based_data(year=None, concurrency=None, jobs=None):
+    """Compute the gender-based data for the whole company, titles, managers, departments and top percentiles of earners.
 
-def get_gender_based_data(year=None):
-    # compute portion of female employees in the whole company
-    logger.info('Obtaining portion of female employees')
-    all_employees = employee_manager.get_all_employees(year)
-    portion_female_all = get_portion_employees_for_gender(all_employees, constants.FEMALE)
+    :param year: year for which to compute the data (current data if None)
+    :param concurrency: if not None, execute the queries concurrently using asyncio with at most concurrency queries in
+    flight (see the executor.py script in the manager package)
+    :param jobs: if not None, execute the queries using a pool of jobs threads (the queries are executed one after another
+    if both concurrency and jobs are None)
+    :return: ResContainer instance containing the obtained results
+    """
+    if concurrency is not None and jobs is not None:
+        raise ValueError('Only one of concurrency and jobs can be given')
 
-    # compute portion of female employees for a specific title
-    title_to_portion_female = dict()
     titles = title_manager.get_all_distinct_titles()
-    logger.info('Obtaining portion of female employees for titles')
-    for title in tqdm(titles, colour='green', desc='Obtaining portions of female employees for all titles'):
-        employees_for_title = employee_manager.get_employees_for_title(title, year)
-        title_to_portion_female[title.title] = get_portion_employees_for_gender(employees_for_title, constants.FEMALE)
-
-    # compute portion of female employees that are department managers
-    logger.info('Obtaining portion of female managers')
-    employees_managers = employee_manager.get_employees_managers(year)
-    portion_female_managers = get_portion_employees_for_gender(employees_managers, constants.FEMALE)
-
-    # compute portion of females in a specific department
-    dept_to_portion_female = dict()
     departments = department_manager.get_all_departments()
-    logger.info('Obtaining portion of female employees for departments')
-    for dept in tqdm(departments, colour='green', desc='Obtaining portions of female employees for all departments'):
-        employees_dept = employee_manager.get_employees_dept(dept, year)
-        dept_to_portion_female[dept.dept_name] = get_portion_employees_for_gender(employees_dept, constants.FEMALE)
+    percentiles = [0.9, 0.95, 0.99]
+
+    # build the (independent) queries for the gender counts and the functions converting their results (the gender counts
+    # above the salary percentiles are obtained for all percentiles and all titles or departments in one query each)
+    statements = {
+        'all': (employee_manager.select_all_employees_gender_counts(year), employee_manager.rows_to_gender_counts),
+        'managers': (employee_manager.select_employees_managers_gender_counts(year), employee_manager.rows_to_gender_counts),
+        'all_percentiles': (employee_manager.select_employees_above_salary_percentiles_gender_counts(percentiles, year),
+                            functools.partial(employee_manager.rows_to_percentiles_gender_counts, percentiles=percentiles)),
+        'titles_percentiles': (employee_manager.select_employees_above_salary_percentiles_for_titles_gender_counts(percentiles, year),
+                               functools.partial(employee_manager.rows_to_percentiles_gender_counts, percentiles=percentiles, group_key='title')),
+        'managers_percentiles': (employee_manager.select_employees_above_salary_percentiles_for_managers_gender_counts(percentiles, year),
+                                 functools.partial(employee_manager.rows_to_percentiles_gender_counts, percentiles=percentiles)),
+        'depts_percentiles': (employee_manager.select_employees_above_salary_percentiles_for_depts_gender_counts(percentiles, year),
+                              functools.partial(employee_manager.rows_to_percentiles_gender_counts, percentiles=percentiles, group_key='dept_no')),
+    }
+    for title in titles:
+        statements['title', title.title] = (employee_manager.select_employees_for_title_gender_counts(title, year), employee_manager.rows_to_gender_counts)
+    for dept in departments:
+        statements['dept', dept.dept_name] = (employee_manager.select_employees_dept_gender_counts(dept, year), employee_manager.rows_to_gender_counts)
+
+    # compute gender counts
+    if concurrency is None:
+        logger.info('Obtaining gender counts for the company, titles, managers, departments and salary percentiles')
+        rows = executor.map_threads(employee_manager.fetch_all, [statement for statement, _ in statements.values()], jobs, 'Obtaining gender counts')
+    else:
+        logger.info('Obtaining gender counts for the company, titles, managers, departments and salary percentiles (concurrency {0})'.format(concurrency))
+        rows = executor.execute_all([statement for statement, _ in statements.values()], concurrency)
+    gender_counts = {k: to_gender_counts(rows_for_k) for (k, (_, to_gender_counts)), rows_for_k in zip(statements.items(), rows)}
+
+    # compute portions of female employees in the whole company, for titles, for managers and for departments
+    portion_female_all = get_portion_for_gender(gender_counts['all'], constants.FEMALE)
+    title_to_portion_female = {t.title: get_portion_for_gender(gender_counts['title', t.title], constants.FEMALE) for t in titles}
+    portion_female_managers = get_portion_for_gender(gender_counts['managers'], constants.FEMALE)
+    dept_to_portion_female = {d.dept_name: get_portion_for_gender(gender_counts['dept', d.dept_name], constants.FEMALE) for d in departments}
 
     # Compute portion of women/men in top percentiles of earners for departments, managers, titles.
-    percentiles = [0.9, 0.95, 0.99]
+    # (titles and departments without employees above the thresholds have no rows in the results)
+    no_gender_counts = {percentile: (0, 0, 0) for percentile in percentiles}
     salary_percentile_to_portion_female = dict()
     title_to_salary_percentile_to_portion_female = {t.title: dict() for t in titles}
     dept_to_salary_percentile_to_portion_female = {d.dept_name: dict() for d in departments}
     salary_percentile_to_portion_female_managers = dict()
-
-    logger.info('Obtaining portions of female employees for salary percentiles (company, title, managers, departments)')
-    for percentile in tqdm(percentiles, colour='green', desc='Obtaining portions of female employees for salary percentiles'):
-        employees_above_percentile = employee_manager.get_employees_above_salary_percentile(percentile, year)
-        salary_percentile_to_portion_female[percentile] = get_portion_employees_for_gender(employees_above_percentile, constants.FEMALE)
-
+    for percentile in percentiles:
+        salary_percentile_to_portion_female[percentile] = get_portion_for_gender(gender_counts['all_percentiles'][percentile], constants.FEMALE)
         for title in titles:
-            employees_above_percentile_for_title = employee_manager.get_employees_above_salary_percentile_for_title(percentile, title, year)
-            title_to_salary_percentile_to_portion_female[title.title][percentile] = get_portion_employees_for_gender(employees_above_percentile_for_title, constants.FEMALE)
-
-        employees_above_percentile_managers = employee_manager.get_employees_above_salary_percentile_for_managers(percentile, year)
-        salary_percentile_to_portion_female_managers[percentile] = get_portion_employees_for_gender(employees_above_percentile_managers, constants.FEMALE)
-
+            title_to_salary_percentile_to_portion_female[title.title][percentile] = \
+                get_portion_for_gender(gender_counts['titles_percentiles'].get(title.title, no_gender_counts)[percentile], constants.FEMALE)
+        salary_percentile_to_portion_female_managers[percentile] = get_portion_for_gender(gender_counts['managers_percentiles'][percentile], constants.FEMALE)
         for dept in departments:
-            employees_above_percentile_for_dept = employee_manager.get_employees_above_salary_percentile_for_dept(percentile, dept, year)
-            dept_to_salary_percentile_to_portion_female[dept.dept_name][percentile] = get_portion_employees_for_gender(employees_above_percentile_for_dept, constants.FEMALE)
+            dept_to_salary_percentile_to_portion_female[dept.dept_name][percentile] = \
+                get_portion_for_gender(gender_counts['depts_percentiles'].get(dept.dept_no, no_gender_counts)[percentile], constants.FEMALE)
 
     # Add results to results container and return.
 
     logger.info('Storing results in results container')
 
+    return get_gender_based_res_container(
+        portion_female_all,
+        title_to_portion_female,
+        portion_female_managers,
+        dept_to_portion_female,
+        salary_percentile_to_portion_female,
+        title_to_salary_percentile_to_portion_female,
+        salary_percentile_to_portion_female_managers,
+        dept_to_salary_percentile_to_portion_female
+    )
+
+
+def get_gender_based_data_by_year(years, manager=employee_manager):
+    """Compute the gender-based data for all given years in a single pass. Each metric is obtained with one query grouped by
+    year (and title or department) instead of one query per year.
+
+    :param years: list of years for which to compute the data
+    :param manager: module providing the *_by_year gender counts functions (employee_manager or employee_year_manager
+    from the manager package)
+    :return: map of years to ResContainer instances with the same layout as the ones returned by get_gender_based_data
+    """
+    logger.info('Obtaining distinct titles and departments')
+    titles = title_manager.get_all_distinct_titles()
+    departments = department_manager.get_all_departments()
+
+    logger.info('Obtaining portions of female employees (company, titles, managers, departments) for all years')
+    year_to_gender_counts_all = manager.get_all_employees_gender_counts_by_year(years)
+    year_to_title_to_gender_counts = manager.get_employees_for_titles_gender_counts_by_year(years)
+    year_to_gender_counts_managers = manager.get_employees_managers_gender_counts_by_year(years)
+    year_to_dept_no_to_gender_counts = manager.get_employees_depts_gender_counts_by_year(years)
+
+    percentiles = [0.9, 0.95, 0.99]
+    percentile_to_year_to_gender_counts = dict()
+    percentile_to_year_to_title_to_gender_counts = dict()
+    percentile_to_year_to_gender_counts_managers = dict()
+    percentile_to_year_to_dept_no_to_gender_counts = dict()
+    logger.info('Obtaining portions of female employees for salary percentiles (company, title, managers, departments) for all years')
+    for percentile in tqdm(percentiles, colour='green', desc='Obtaining portions of female employees for salary percentiles'):
+        percentile_to_year_to_gender_counts[percentile] = \
+            manager.get_employees_above_salary_percentile_gender_counts_by_year(percentile, years)
+        percentile_to_year_to_title_to_gender_counts[percentile] = \
+            manager.get_employees_above_salary_percentile_for_titles_gender_counts_by_year(percentile, years)
+        percentile_to_year_to_gender_counts_managers[percentile] = \
+            manager.get_employees_above_salary_percentile_for_managers_gender_counts_by_year(percentile, years)
+        percentile_to_year_to_dept_no_to_gender_counts[percentile] = \
+            manager.get_employees_above_salary_percentile_for_depts_gender_counts_by_year(percentile, years)
+
+    # assemble the results for each year
+    logger.info('Storing results in results containers')
+    no_employees = (0, 0, 0)
+    year_to_res_container = dict()
+    for year in years:
+        year_to_res_container[year] = get_gender_based_res_container(
+            get_portion_for_gender(year_to_gender_counts_all[year], constants.FEMALE),
+            {t.title: get_portion_for_gender(year_to_title_to_gender_counts[year].get(t.title, no_employees), constants.FEMALE) for t in titles},
+            get_portion_for_gender(year_to_gender_counts_managers[year], constants.FEMALE),
+            {d.dept_name: get_portion_for_gender(year_to_dept_no_to_gender_counts[year].get(d.dept_no, no_employees), constants.FEMALE) for d in departments},
+            {p: get_portion_for_gender(percentile_to_year_to_gender_counts[p][year], constants.FEMALE) for p in percentiles},
+            {t.title: {p: get_portion_for_gender(percentile_to_year_to_title_to_gender_counts[p][year].get(t.title, no_employees), constants.FEMALE)
+                       for p in percentiles} for t in titles},
+            {p: get_portion_for_gender(percentile_to_year_to_gender_counts_managers[p][year], constants.FEMALE) for p in percentiles},
+            {d.dept_name: {p: get_portion_for_gender(percentile_to_year_to_dept_no_to_gender_counts[p][year].get(d.dept_no, no_employees), constants.FEMALE)
+                           for p in percentiles} for d in departments}
+        )
+
+    return year_to_res_container
+
+
+def get_gender_based_res_container(portion_female_all,
+                                    title_to_portion_female,
+                                    portion_female_managers,
+                                    dept_to_portion_female,
+                                    salary_percentile_to_portion_female,
+                                    title_to_salary_percentile_to_portion_female,
+                                    salary_percentile_to_portion_female_managers,
+                                    dept_to_salary_percentile_to_portion_female):
     res_container = ResContainer()
     res_container.add_res_with_desc(
         key='portion_female_all',
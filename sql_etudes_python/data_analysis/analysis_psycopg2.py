@@ -1,9 +1,18 @@
+import functools
+
+import numpy as np
 from tqdm import tqdm
 
 from sql_etudes_python import constants
+from sql_etudes_python.data_analysis import interval_sweep
 from sql_etudes_python.data_analysis import logger
-from sql_etudes_python.data_analysis.res_container import ResContainer
-from sql_etudes_python.manager import connect, disconnect
+from sql_etudes_python.data_analysis import result_cache
+from sql_etudes_python.manager import current_state
+from sql_etudes_python.manager import department_manager
+from sql_etudes_python.manager import employee_year_manager
+from sql_etudes_python.manager import executor
+from sql_etudes_python.manager import pooled_connection
+from sql_etudes_python.manager import salary_manager
 
 """
 This script is used to obtain the data to perform the analyses required by the tasks using the psycopg2 framework
@@ -31,6 +40,19 @@ def get_data_analysis1():
         :param curs: psycopg2 cursor
         :return: results of query
         """
+        if current_state.is_enabled():
+            # the current salaries, titles and departments are read from the current employees materialized view
+            sql_query = \
+                """SELECT AVG(salary) as average_salary, title
+                FROM employees.current_employees
+                WHERE salary IS NOT NULL
+                AND title IS NOT NULL
+                {0}
+                GROUP BY title
+                ORDER BY average_salary DESC""".format("AND dept_no = %(dept_no)s" if dept_no is not None else "")
+            curs.execute(sql_query, {'dept_no': dept_no})
+            return curs.fetchall()
+
         # noinspection PyStringFormat
         sql_query = \
             """SELECT AVG(salaries.salary) as average_salary, titles.title
@@ -48,9 +70,8 @@ def get_data_analysis1():
         curs.execute(sql_query, {'dept_no': dept_no})
         return curs.fetchall()
 
-    # connect to database
-    conn = connect()
-    with conn:
+    # get connection to database from pool
+    with pooled_connection() as conn:
         with conn.cursor() as curs:
             # RESULTS FOR WHOLE COMPANY
             print('Rankings of the titles for the whole company:')
@@ -76,26 +97,44 @@ def get_data_analysis1():
                 for rank, res in enumerate(res_depts[dept_no]):
                     print('({0}) {1} - {2}'.format(rank, res[1], float(res[0])))
 
-    # disconnect from database
-    disconnect(conn)
     logger.info('Finished obtaining data for 1. analysis')
 
 
-def get_data_analysis4():
+@result_cache.cached
+def get_data_analysis4(mode='interval_sweep', concurrency=None, years=None, year_to_dept_nos=None):
     """Task instructions: Check if some employees earn more than their managers. Split the results by year, gender and
     department if such employees exist.
+
+    :param mode: 'interval_sweep' to bulk-load the intervals once and compute the results in-process (see the
+    interval_sweep.py script located in the same package), 'sql' to query the database for each year, department and gender
+    or 'employee_year' to compute the results with one query over the employee_year fact table (see the
+    employee_year_manager.py script in the manager package, which compares the highest salary of each employee in a year
+    with the lowest salary of the managers of the employee's last department in the year)
+    :param concurrency: maximum number of queries executed concurrently in the 'sql' mode (queries executed one after
+    another if None)
+    :param years: if not None, compute the results only for these years (see incremental.py in the same package)
+    :param year_to_dept_nos: if not None, map of years to the department numbers for which the results are computed in
+    the 'sql' mode (all departments if None)
+    :return: ArrayResContainer instance containing the obtained results (see get_res_container_from_counts in the
+    interval_sweep.py script located in the same package)
     """
 
     logger.info('Performing 4. analysis (psycopg2)')
 
-    def get_results(curs, year=None, dept_no=None, gender=None):
-        """Compute number of employees earning more than their managers (by year, department number and gender)
+    if mode == 'interval_sweep':
+        return _get_data_analysis4_interval_sweep(years)
+    elif mode == 'employee_year':
+        return _get_data_analysis4_employee_year(years)
+    elif mode != 'sql':
+        raise ValueError('Unknown mode {0}'.format(mode))
+
+    def get_query(year=None, dept_no=None, gender=None):
+        """Get query computing number of employees earning more than their managers (by year, department number and gender)
 
-        :param curs: psycopg2 cursor
         :param year: year for which to compute the results
         :param dept_no: department number for which to compute the results
         :param gender: gender for which to compute the results
-        :return: results of query
+        :return: SQL query and its parameters
         """
         filter_list = ["", "", ""]
         if year is not None:
@@ -130,59 +169,92 @@ def get_data_analysis4():
             {1} 
             {2}""".format(*filter_list)
 
-        curs.execute(sql_query, {'dept_no': dept_no, 'gender': gender})
+        return sql_query, {k: v for k, v in (('dept_no', dept_no), ('gender', gender)) if v is not None}
+
+    def get_results(curs, year=None, dept_no=None, gender=None):
+        """Compute number of employees earning more than their managers (by year, department number and gender)
+
+        :param curs: psycopg2 cursor
+        :param year: year for which to compute the results
+        :param dept_no: department number for which to compute the results
+        :param gender: gender for which to compute the results
+        :return: results of query
+        """
+        curs.execute(*get_query(year, dept_no, gender))
         return curs.fetchall()
 
-    res_container = ResContainer()
+    # get relevant years and all department numbers (shared with the other analyses, see shared_inputs.py in the manager package)
+    years = years if years is not None else salary_manager.get_distinct_years_salaries_asc()
+    dept_no_to_dept_name = {dept.dept_no: dept.dept_name for dept in sorted(department_manager.get_all_departments(), key=lambda d: d.dept_no)}
+    dept_no_to_index = {dept_no: j for j, dept_no in enumerate(dept_no_to_dept_name.keys())}
 
-    # connect to database
-    conn = connect()
-    with conn:
-        with conn.cursor() as curs:
-            # get relevant years
-            relevant_years_sql_query = \
-                """
-                WITH years as (SELECT EXTRACT(YEAR FROM salaries.from_date) as year FROM employees.salaries)
-                SELECT DISTINCT year FROM years
-                ORDER BY year
-                """
-            curs.execute(relevant_years_sql_query)
-            years = [int(year[0]) for year in curs.fetchall()]
+    # the counts for departments not in year_to_dept_nos are left at 0
+    counts_year = np.zeros(len(years), dtype=np.int64)
+    counts_year_dept = np.zeros((len(years), len(dept_no_to_dept_name)), dtype=np.int64)
+    counts_female_year = np.zeros(len(years), dtype=np.int64)
 
-            # get all department numbers
-            sql_query_departments = \
-                """SELECT DISTINCT d.dept_no, d.dept_name
-                   FROM employees.departments d
-                   ORDER BY d.dept_no"""
-            curs.execute(sql_query_departments)
-            dept_no_to_dept_name = dict(curs.fetchall())
+    # get connection to database from pool
+    with pooled_connection() as conn:
+        with conn.cursor() as curs:
+            if concurrency is not None:
+                logger.info('computing data segmented by years, departments and genders (concurrency {0})'.format(concurrency))
+                queries = dict()
+                for year in years:
+                    queries[year, None, None] = get_query(year=year)
+                    for dept_no in (year_to_dept_nos[year] if year_to_dept_nos is not None else dept_no_to_dept_name.keys()):
+                        queries[year, dept_no, None] = get_query(year=year, dept_no=dept_no)
+                    queries[year, None, constants.FEMALE] = get_query(year=year, gender=constants.FEMALE)
+                results = dict(zip(queries.keys(), executor.execute_all_sql(list(queries.values()), concurrency)))
 
-            res_container.add_res_with_desc('years', years, 'list of relevant years')
-            res_container.add_res_with_desc('dept_names', list(dept_no_to_dept_name.values()), 'list of department names')
+                def fetch(year=None, dept_no=None, gender=None):
+                    return results[year, dept_no, gender]
+            else:
+                fetch = functools.partial(get_results, curs)
 
-            logger.info('computing data segmented by years, departments and genders and storing results in results container')
-            for year in tqdm(years):
+            logger.info('computing data segmented by years, departments and genders')
+            for i, year in enumerate(tqdm(years)):
 
                 # compute number of employees earning more than their managers for year
-                res_container.add_res_with_desc(
-                    'n_employees_earn_more_than_managers_{0}'.format(year),
-                    get_results(curs, year=year)[0][0],
-                    'number of employees that earn more than their managers in year {0}'.format(year)
-                )
-                for dept_no in dept_no_to_dept_name.keys():
+                counts_year[i] = fetch(year=year)[0][0]
+                for dept_no in (year_to_dept_nos[year] if year_to_dept_nos is not None else dept_no_to_dept_name.keys()):
                     # compute number of employees earning more than their managers for year and for department
-                    res_container.add_res_with_desc(
-                        'n_employees_earn_more_than_managers_{0}_{1}'.format(year, dept_no_to_dept_name[dept_no]),
-                        get_results(curs, dept_no=dept_no, year=year)[0][0],
-                        'number of employees that earn more than their managers in year {0} in department {1}'.format(year, dept_no_to_dept_name[dept_no])
-                    )
+                    counts_year_dept[i, dept_no_to_index[dept_no]] = fetch(dept_no=dept_no, year=year)[0][0]
                 # compute number of female employees earning more than their managers for year
-                res_container.add_res_with_desc(
-                    'n_female_earn_more_than_managers_{0}'.format(year),
-                    get_results(curs, year=year, gender=constants.FEMALE)[0][0],
-                    'number of female employees that earn more than their managers in year {0}'.format(year)
-                )
+                counts_female_year[i] = fetch(year=year, gender=constants.FEMALE)[0][0]
+
+    logger.info('storing results in results container')
+    res_container = interval_sweep.get_res_container_from_counts(years, list(dept_no_to_dept_name.values()), counts_year, counts_year_dept, counts_female_year)
+
+    logger.info('Finished obtaining data for 4. analysis')
+    return res_container
+
+
+def _get_data_analysis4_interval_sweep(years=None):
+    # get connection to database from pool and load intervals
+    with pooled_connection() as conn:
+        with conn.cursor() as curs:
+            logger.info('loading salary, manager and department intervals')
+            intervals = interval_sweep.load_intervals(curs, years)
+
+    res_container = interval_sweep.get_res_container(intervals, years)
+    logger.info('Finished obtaining data for 4. analysis')
+    return res_container
+
+
+def _get_data_analysis4_employee_year(years=None):
+    years = years if years is not None else salary_manager.get_distinct_years_salaries_asc()
+    departments = sorted(department_manager.get_all_departments(), key=lambda d: d.dept_no)
+
+    logger.info('computing data segmented by years, departments and genders from the employee_year fact table')
+    year_to_count, year_to_dept_no_to_count, year_to_count_female = employee_year_manager.get_number_employees_earn_more_than_managers_by_year(years)
+
+    res_container = interval_sweep.get_res_container_from_counts(
+        years,
+        [dept.dept_name for dept in departments],
+        [year_to_count[year] for year in years],
+        [[year_to_dept_no_to_count[year].get(dept.dept_no, 0) for dept in departments] for year in years],
+        [year_to_count_female[year] for year in years]
+    )
 
-    disconnect(conn)
     logger.info('Finished obtaining data for 4. analysis')
     return res_container
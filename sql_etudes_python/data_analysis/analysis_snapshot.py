@@ -0,0 +1,199 @@
+import numpy as np
+
+from sql_etudes_python import constants
+from sql_etudes_python.data_analysis import analysis
+from sql_etudes_python.data_analysis import interval_sweep
+from sql_etudes_python.data_analysis import logger
+from sql_etudes_python.data_analysis.res_container import ResContainer
+from sql_etudes_python.manager import snapshot
+
+"""
+This script is used to obtain the data to perform the analyses required by the tasks using an in-memory columnar snapshot
+of the employees schema (see the snapshot.py script in the manager package) instead of querying the database for each
+result. The functions mirror the ones in the analysis.py and analysis_psycopg2.py scripts located in the same package and
+return ResContainer instances with the same layout. If no snapshot is given, the snapshot is loaded from the database.
+"""
+
+
+def get_data_analysis1(snap=None):
+    """Task instructions: Rank the employee titles according to the average salary for each department and for the whole company.
+    Present the results in a bar chart.
+
+    :param snap: Snapshot instance
+    :return: ResContainer instance containing the obtained results
+    """
+    logger.info('Obtaining data for 1. analysis (snapshot)')
+    snap = snap if snap is not None else snapshot.load_snapshot()
+
+    titles, dept_names = snap.categories['title'].tolist(), snap.departments['dept_name'].tolist()
+    n_titles, n_depts = len(titles), len(dept_names)
+
+    # join current salaries with current titles for the whole company
+    salaries_mask, titles_mask = snapshot.period_mask(snap.salaries), snapshot.period_mask(snap.titles)
+    salaries_idx, titles_idx = np.flatnonzero(salaries_mask), np.flatnonzero(titles_mask)
+    s, t = snapshot.join(snap.salaries['emp_idx'][salaries_idx], snap.titles['emp_idx'][titles_idx])
+    salary, title = snap.salaries['salary'][salaries_idx[s]], snap.titles['title'][titles_idx[t]].astype(np.int64)
+    average_salary_company = snapshot.group_mean(title, salary, n_titles)
+
+    # join with current departments for the departments
+    dept_emp_idx = np.flatnonzero(snapshot.period_mask(snap.dept_emp))
+    st, d = snapshot.join(snap.salaries['emp_idx'][salaries_idx[s]], snap.dept_emp['emp_idx'][dept_emp_idx])
+    dept = snap.dept_emp['dept_no'][dept_emp_idx[d]].astype(np.int64)
+    average_salary_dept = snapshot.group_mean(dept * n_titles + title[st], salary[st], n_depts * n_titles).reshape(n_depts, n_titles)
+
+    # titles without current salaries are marked with an average salary of -1.0
+    title_to_average_salary_company = {titles[i]: _nan_to_missing(average_salary_company[i]) for i in range(n_titles)}
+    dept_to_title_to_average_salary = {
+        dept_names[j]: {titles[i]: _nan_to_missing(average_salary_dept[j, i]) for i in range(n_titles)}
+        for j in range(n_depts)
+    }
+
+    res_container = ResContainer()
+    res_container.add_res_with_desc(
+        key='title_to_average_salary_company',
+        res=title_to_average_salary_company,
+        desc='map of titles to the average salary for the title for the whole company'
+    )
+    res_container.add_res_with_desc(
+        key='dept_to_title_to_average_salary',
+        res=dept_to_title_to_average_salary,
+        desc='map of titles to the average salary for a specific department'
+    )
+
+    logger.info('Finished obtaining data for 1. analysis')
+    return res_container
+
+
+def get_data_analysis2(snap=None):
+    """Task instructions: The company actively pursues gender equality. Prepare an analysis based on salaries and gender distribution
+    by departments, managers, and titles. Present results in a chart (or several charts) of your choice.
+
+    :param snap: Snapshot instance
+    :return: ResContainer instance containing the obtained results
+    """
+    logger.info('Obtaining data for 2. analysis (snapshot)')
+    snap = snap if snap is not None else snapshot.load_snapshot()
+
+    data = get_gender_based_data(snap, year=None)
+    logger.info('Finished obtaining data for 2. analysis')
+    return data
+
+
+def get_data_analysis3(snap=None):
+    """Task instructions: Prepare the same analysis but also on a yearly basis.
+
+    :param snap: Snapshot instance
+    :return: ArrayResContainer instance containing the obtained results
+    """
+    logger.info('Obtaining data for 3. analysis (snapshot)')
+    snap = snap if snap is not None else snapshot.load_snapshot()
+
+    years = np.unique(snapshot.years_of(snap.salaries['from_date'])).tolist()
+    res_container = analysis.stack_gender_based_data({year: get_gender_based_data(snap, year) for year in years[:-1]})
+
+    logger.info('Finished obtaining data for 3. analysis')
+    return res_container
+
+
+def get_data_analysis4(snap=None):
+    """Task instructions: Check if some employees earn more than their managers. Split the results by year, gender and
+    department if such employees exist.
+
+    :param snap: Snapshot instance
+    :return: ArrayResContainer instance containing the obtained results
+    """
+    logger.info('Obtaining data for 4. analysis (snapshot)')
+    snap = snap if snap is not None else snapshot.load_snapshot()
+
+    res_container = interval_sweep.get_res_container(interval_sweep.get_intervals_from_snapshot(snap))
+    logger.info('Finished obtaining data for 4. analysis')
+    return res_container
+
+
+def get_gender_based_data(snap, year=None):
+    """Compute the gender-based data (see analysis.get_gender_based_data) from a snapshot.
+
+    :param snap: Snapshot instance
+    :param year: year for which to compute the data (current data if None)
+    :return: ResContainer instance containing the obtained results
+    """
+    is_female = snap.is_female()
+    titles, dept_names = snap.categories['title'].tolist(), snap.departments['dept_name'].tolist()
+    n_titles, n_depts = len(titles), len(dept_names)
+    salaries, titles_table, dept_emp, dept_manager = snap.salaries, snap.titles, snap.dept_emp, snap.dept_manager
+
+    salaries_mask = snapshot.period_mask(salaries, year)
+    titles_mask = snapshot.period_mask(titles_table, year)
+    dept_emp_mask = snapshot.period_mask(dept_emp, year)
+    dept_manager_mask = snapshot.period_mask(dept_manager, year)
+
+    # highest salary of each employee (over all time)
+    max_salary = snapshot.group_max(salaries['emp_idx'], salaries['salary'], len(is_female))
+
+    # portions of female employees in the company, for titles, for managers and for departments
+    portion_female_all = analysis.get_portion_for_gender(
+        snapshot.gender_counts(salaries['emp_idx'][salaries_mask], is_female), constants.FEMALE)
+    title_gender_counts = snapshot.group_gender_counts(
+        titles_table['title'][titles_mask], titles_table['emp_idx'][titles_mask], is_female, n_titles)
+    title_to_portion_female = {titles[i]: analysis.get_portion_for_gender(title_gender_counts[i], constants.FEMALE) for i in range(n_titles)}
+    portion_female_managers = analysis.get_portion_for_gender(
+        snapshot.gender_counts(dept_manager['emp_idx'][dept_manager_mask], is_female), constants.FEMALE)
+    dept_gender_counts = snapshot.group_gender_counts(
+        dept_emp['dept_no'][dept_emp_mask], dept_emp['emp_idx'][dept_emp_mask], is_female, n_depts)
+    dept_to_portion_female = {dept_names[j]: analysis.get_portion_for_gender(dept_gender_counts[j], constants.FEMALE) for j in range(n_depts)}
+
+    # salaries of the employees having a title, being managers or working in a department (over all time)
+    _, s = snapshot.join(titles_table['emp_idx'][titles_mask], salaries['emp_idx'])
+    salaries_titles = salaries['salary'][s]
+    _, s = snapshot.join(dept_manager['emp_idx'][dept_manager_mask], salaries['emp_idx'])
+    salaries_managers = salaries['salary'][s]
+    de, s = snapshot.join(dept_emp['emp_idx'][dept_emp_mask], salaries['emp_idx'])
+    salaries_depts, salaries_depts_codes = salaries['salary'][s], dept_emp['dept_no'][dept_emp_mask][de].astype(np.int64)
+
+    # portions of female employees in top percentiles of earners for the company, titles, managers and departments
+    percentiles = [0.9, 0.95, 0.99]
+    salary_percentile_to_portion_female = dict()
+    title_to_salary_percentile_to_portion_female = {t: dict() for t in titles}
+    salary_percentile_to_portion_female_managers = dict()
+    dept_to_salary_percentile_to_portion_female = {d: dict() for d in dept_names}
+    for percentile in percentiles:
+        percentile_val = _none_to_nan(snapshot.percentile(salaries['salary'][salaries_mask], percentile, method='disc'))
+        above = salaries_mask & (salaries['salary'] > percentile_val)
+        salary_percentile_to_portion_female[percentile] = analysis.get_portion_for_gender(
+            snapshot.gender_counts(salaries['emp_idx'][above], is_female), constants.FEMALE)
+
+        percentile_val = _none_to_nan(snapshot.percentile(salaries_titles, percentile))
+        above = titles_mask & (max_salary[titles_table['emp_idx']] > percentile_val)
+        gender_counts = snapshot.group_gender_counts(titles_table['title'][above], titles_table['emp_idx'][above], is_female, n_titles)
+        for i in range(n_titles):
+            title_to_salary_percentile_to_portion_female[titles[i]][percentile] = analysis.get_portion_for_gender(gender_counts[i], constants.FEMALE)
+
+        percentile_val = _none_to_nan(snapshot.percentile(salaries_managers, percentile))
+        above = dept_manager_mask & (max_salary[dept_manager['emp_idx']] > percentile_val)
+        salary_percentile_to_portion_female_managers[percentile] = analysis.get_portion_for_gender(
+            snapshot.gender_counts(dept_manager['emp_idx'][above], is_female), constants.FEMALE)
+
+        percentile_vals = np.array([_none_to_nan(v) for v in snapshot.group_percentile(salaries_depts_codes, salaries_depts, percentile, n_depts)])
+        above = dept_emp_mask & (max_salary[dept_emp['emp_idx']] > percentile_vals[dept_emp['dept_no']])
+        gender_counts = snapshot.group_gender_counts(dept_emp['dept_no'][above], dept_emp['emp_idx'][above], is_female, n_depts)
+        for j in range(n_depts):
+            dept_to_salary_percentile_to_portion_female[dept_names[j]][percentile] = analysis.get_portion_for_gender(gender_counts[j], constants.FEMALE)
+
+    return analysis.get_gender_based_res_container(
+        portion_female_all,
+        title_to_portion_female,
+        portion_female_managers,
+        dept_to_portion_female,
+        salary_percentile_to_portion_female,
+        title_to_salary_percentile_to_portion_female,
+        salary_percentile_to_portion_female_managers,
+        dept_to_salary_percentile_to_portion_female
+    )
+
+
+def _nan_to_missing(val):
+    return -1.0 if np.isnan(val) else float(val)
+
+
+def _none_to_nan(val):
+    return np.nan if val is None else val
@@ -0,0 +1,141 @@
+import warnings
+
+import numpy as np
+import scipy.stats as stats
+
+from sql_etudes_python.data_analysis.res_container import LabeledArray
+
+"""
+Vectorized correlation analysis of a matrix of features (one row for each feature, one column for each sample, e.g. the
+characteristics of the departments) against a target (e.g. the mean salaries of the departments). The Pearson and
+Spearman correlation coefficients of all features are computed with a single matrix product of the features and the
+target, centered and scaled to unit norm.
+
+As the number of samples is small (9 departments), the analytic p-values (based on the t-distribution, as computed by
+scipy.stats.pearsonr) are complemented by bootstrap confidence intervals (percentiles of the coefficients computed on
+samples drawn with replacement) and permutation p-values (the portion of random permutations of the target for which
+the absolute value of the coefficient is at least as large as the observed one). The resamples are processed in batches
+as stacked arrays.
+"""
+
+METHODS = ['pearson', 'spearman']
+STATISTICS = ['r', 'p_value', 'ci_low', 'ci_high', 'permutation_p_value']
+
+# number of resamples processed at once
+_BATCH_SIZE = 1000
+
+
+def get_correlations(feature_names, features, target, n_resamples=10000, confidence_level=0.95, seed=None):
+    """Compute the Pearson and Spearman correlations of features with a target along with their analytic p-values,
+    bootstrap confidence intervals and permutation p-values.
+
+    :param feature_names: names of the features
+    :param features: NumPy array with a row of values for each feature
+    :param target: NumPy array of the values of the target
+    :param n_resamples: number of bootstrap samples and of permutations
+    :param confidence_level: confidence level of the bootstrap confidence intervals
+    :param seed: seed of the random number generator (the results are not reproducible if None)
+    :return: LabeledArray instance with dimensions feature, method (see METHODS) and statistic (see STATISTICS)
+    """
+    features = np.asarray(features, dtype=float)
+    target = np.asarray(target, dtype=float)
+    rng = np.random.default_rng(seed)
+
+    values = np.empty((len(feature_names), len(METHODS), len(STATISTICS)))
+    for i, method in enumerate(METHODS):
+        rank = method == 'spearman'
+        x, y = (rankdata(features), rankdata(target)) if rank else (features, target)
+        r = correlate(x, y)
+        ci_low, ci_high = bootstrap_ci(features, target, n_resamples, confidence_level, rank, rng)
+        values[:, i, :] = np.column_stack([r, get_p_values(r, len(target)), ci_low, ci_high, permutation_p_values(x, y, n_resamples, rng)])
+    return LabeledArray(values, ['feature', 'method', 'statistic'], {'feature': feature_names, 'method': METHODS, 'statistic': STATISTICS})
+
+
+def correlate(x, y):
+    """Compute the Pearson correlation coefficients of x and y along the last axis.
+
+    :param x: NumPy array (e.g. a matrix with a row for each feature)
+    :param y: NumPy array broadcastable with x
+    :return: NumPy array of coefficients (NaN where x or y is constant)
+    """
+    return np.clip((_normalize(x) * _normalize(y)).sum(axis=-1), -1.0, 1.0)
+
+
+def rankdata(a):
+    """Rank the values along the last axis (the Spearman coefficients are the Pearson coefficients of the ranks)."""
+    return stats.rankdata(a, axis=-1)
+
+
+def get_p_values(r, n):
+    """Compute the two-sided p-values of correlation coefficients for n samples (using the t-distribution).
+
+    :param r: NumPy array of correlation coefficients
+    :param n: number of samples
+    :return: NumPy array of p-values
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.abs(r) * np.sqrt((n - 2) / (1.0 - r ** 2))
+    return 2 * stats.t.sf(t, n - 2)
+
+
+def bootstrap_ci(features, target, n_resamples, confidence_level=0.95, rank=False, rng=None):
+    """Compute percentile bootstrap confidence intervals of the correlation coefficients of features with a target.
+
+    :param features: NumPy array with a row of values for each feature
+    :param target: NumPy array of the values of the target
+    :param n_resamples: number of bootstrap samples
+    :param confidence_level: confidence level of the intervals
+    :param rank: if True, compute the intervals of the Spearman coefficients (the samples are ranked) instead of the
+    Pearson coefficients
+    :param rng: NumPy random number generator
+    :return: NumPy arrays of the lower and upper bounds of the intervals (the samples in which the features or the
+    target are constant are ignored)
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    n = len(target)
+    r = np.empty((len(features), n_resamples))
+    for start in range(0, n_resamples, _BATCH_SIZE):
+        # indices of the samples drawn for each resample in the batch
+        indices = rng.integers(0, n, size=(min(_BATCH_SIZE, n_resamples - start), n))
+        x, y = features[:, indices], target[indices]
+        if rank:
+            x, y = rankdata(x), rankdata(y)
+        r[:, start:start + len(indices)] = correlate(x, y)
+
+    alpha = 1.0 - confidence_level
+    with warnings.catch_warnings():
+        # the coefficients of constant features are NaN in all samples
+        warnings.simplefilter('ignore', RuntimeWarning)
+        ci_low, ci_high = np.nanpercentile(r, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=1)
+    return ci_low, ci_high
+
+
+def permutation_p_values(features, target, n_resamples, rng=None):
+    """Compute the two-sided permutation p-values of the correlation coefficients of features with a target.
+
+    :param features: NumPy array with a row of values for each feature
+    :param target: NumPy array of the values of the target
+    :param n_resamples: number of random permutations of the target
+    :param rng: NumPy random number generator
+    :return: NumPy array of p-values (NaN for constant features)
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+
+    # permuting the target does not change its mean and norm, so the coefficients for a batch of permutations are the
+    # product of the normalized features and the matrix of the permuted normalized target
+    x, y = _normalize(features), _normalize(target)
+    abs_r = np.abs(x @ y)
+    n_as_extreme = np.zeros(len(features))
+    for start in range(0, n_resamples, _BATCH_SIZE):
+        permuted = rng.permuted(np.tile(y, (min(_BATCH_SIZE, n_resamples - start), 1)), axis=1)
+        n_as_extreme += (np.abs(x @ permuted.T) >= abs_r[:, np.newaxis] - 1e-12).sum(axis=1)
+
+    # the observed coefficient is counted as one of the permutations
+    return np.where(np.isnan(abs_r), np.nan, (n_as_extreme + 1) / (n_resamples + 1))
+
+
+def _normalize(a):
+    # center and scale to unit norm along the last axis (the correlation coefficient of normalized vectors is their dot product)
+    centered = a - a.mean(axis=-1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return centered / np.linalg.norm(centered, axis=-1, keepdims=True)
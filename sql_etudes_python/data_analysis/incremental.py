@@ -0,0 +1,269 @@
+import hashlib
+import json
+import os
+import uuid
+
+from sql_etudes_python.data_analysis import analysis
+from sql_etudes_python.data_analysis import analysis_psycopg2
+from sql_etudes_python.data_analysis import logger
+from sql_etudes_python.data_analysis import result_cache
+from sql_etudes_python.data_analysis.res_container import ArrayResContainer
+from sql_etudes_python.data_analysis.res_container import concat
+from sql_etudes_python.manager import department_manager
+from sql_etudes_python.manager import get_config
+from sql_etudes_python.manager import pooled_connection
+from sql_etudes_python.manager import salary_manager
+
+"""
+Incremental recomputation of the yearly analyses (3. and 4.). The results are stored together with watermarks of their
+inputs: for each year, the number of rows, the latest from_date and a checksum of the rows of the salaries and titles
+tables overlapping the year (the same for each year and department for the dept_emp and dept_manager tables) and a
+checksum of the departments table. The checksums of the rows include the genders of their employees, so a change of an
+employee's gender changes the watermarks of the years in which the employee has rows (and adding an employee without
+rows changes none). When the analyses are run again, only the years whose watermarks changed (and the years not stored
+yet) are recomputed and merged into the stored ArrayResContainer instances. In the 'sql' mode of the 4. analysis, only
+the departments whose watermarks changed are recomputed for years in which only the dept_emp and dept_manager tables
+changed. All years are recomputed if the departments table changed.
+
+In the 3. analysis, the salary percentiles for titles, managers and departments in a year are computed over all salaries of
+the employees having a title, managing a department or working in a department in the year, so a change of a salary
+marks all years spanned by the employee's titles, departments and managed departments as changed.
+
+The checksums do not include the to_date columns, as closing an interval (setting the to_date of the current row when
+a new row is added) does not change the results for the years that the interval still overlaps. The watermarks are
+computed before the results, so that changes made while the results are computed are detected by the next run. In the
+'employee_year' mode, the employee_year fact table (see employee_year_manager.py in the manager package) must be
+refreshed before the analyses are run.
+
+The results are stored in the incremental subdirectory of the cache directory (see result_cache.py in the same package)
+and are kept separately for each database and each mode of the analyses (the concurrency and the number of jobs do not
+change the results). The changed years are recomputed without using the result cache.
+"""
+
+FORMAT_VERSION = 3
+
+# tables with watermarks for each year and the columns included in the checksums
+_YEAR_TABLE_COLUMNS = {
+    'salaries': 'salary',
+    'titles': 'title',
+}
+
+# tables with watermarks for each year and department and the columns included in the checksums
+_YEAR_DEPT_TABLE_COLUMNS = {
+    'dept_emp': 'dept_no',
+    'dept_manager': 'dept_no',
+}
+
+# tables with a single checksum and the columns included in the checksums
+_TABLE_COLUMNS = {
+    'departments': 'dept_name',
+}
+
+ANALYSIS3_TABLES = ['departments', 'salaries', 'titles', 'dept_emp', 'dept_manager']
+ANALYSIS4_TABLES = ['departments', 'salaries', 'dept_emp', 'dept_manager']
+
+
+def get_cache_dir():
+    return os.path.join(os.environ.get('SQL_ETUDES_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'sql_etudes_python')), 'incremental')
+
+
+def get_data_analysis3(mode='single_pass', concurrency=None, jobs=None):
+    """Compute the results of the 3. analysis (see get_data_analysis3 in analysis.py), recomputing only the years whose
+    inputs changed since the last run.
+
+    :param mode: mode of the analysis (see get_data_analysis3 in analysis.py)
+    :param concurrency: maximum number of queries executed concurrently using asyncio in the 'per_year' mode
+    :param jobs: number of threads executing the queries in the 'per_year' mode
+    :return: ArrayResContainer instance containing the obtained results
+    """
+    arguments = {'mode': mode}
+    path = _get_state_path('analysis3', arguments)
+    stored_watermarks, stored_res_container = _load_state(path)
+
+    watermarks = get_watermarks(ANALYSIS3_TABLES, salaries_over_employee_spans=True)
+    years = salary_manager.get_distinct_years_salaries_asc()[:-1]
+    stored_years = set(stored_res_container.get_res('portion_female_all').coords['year']) if stored_res_container is not None else set()
+    year_to_dept_nos = _get_years_to_recompute(stored_watermarks, watermarks, years, stored_years)
+
+    logger.info('Recomputing {0} of {1} years for 3. analysis'.format(len(year_to_dept_nos), len(years)))
+    res_container_new = None
+    if year_to_dept_nos:
+        # the changed years are recomputed (the result cache may not detect all changes detected by the watermarks)
+        with result_cache.disabled():
+            res_container_new = analysis.get_data_analysis3(mode, concurrency, jobs, years=sorted(year_to_dept_nos.keys()))
+    res_container = _merge_by_year(years, res_container_new, stored_res_container)
+
+    _store_state(path, watermarks, res_container)
+    return res_container
+
+
+def get_data_analysis4(mode='interval_sweep', concurrency=None):
+    """Compute the results of the 4. analysis (see get_data_analysis4 in analysis_psycopg2.py), recomputing only the
+    years (and in the 'sql' mode the departments) whose inputs changed since the last run.
+
+    :param mode: mode of the analysis (see get_data_analysis4 in analysis_psycopg2.py)
+    :param concurrency: maximum number of queries executed concurrently in the 'sql' mode
+    :return: ArrayResContainer instance containing the obtained results
+    """
+    arguments = {'mode': mode}
+    path = _get_state_path('analysis4', arguments)
+    stored_watermarks, stored_res_container = _load_state(path)
+
+    watermarks = get_watermarks(ANALYSIS4_TABLES)
+    years = salary_manager.get_distinct_years_salaries_asc()
+    stored_years = set(stored_res_container.get_res('n_employees_earn_more_than_managers').coords['year']) if stored_res_container is not None else set()
+    year_to_dept_nos = _get_years_to_recompute(stored_watermarks, watermarks, years, stored_years)
+
+    logger.info('Recomputing {0} of {1} years for 4. analysis'.format(len(year_to_dept_nos), len(years)))
+    res_container_new = None
+    if year_to_dept_nos:
+        if mode == 'sql':
+            all_dept_nos = sorted(dept.dept_no for dept in department_manager.get_all_departments())
+            year_to_dept_nos = {year: sorted(dept_nos) if dept_nos is not None else all_dept_nos for year, dept_nos in year_to_dept_nos.items()}
+        with result_cache.disabled():
+            res_container_new = analysis_psycopg2.get_data_analysis4(mode, concurrency, years=sorted(year_to_dept_nos.keys()),
+                                                                     year_to_dept_nos=year_to_dept_nos if mode == 'sql' else None)
+    res_container = _merge_by_year(years, res_container_new, stored_res_container)
+
+    # in the 'sql' mode, the counts for the departments that were not recomputed are taken from the stored results
+    if mode == 'sql' and res_container_new is not None and stored_res_container is not None:
+        dept_no_to_dept_name = {dept.dept_no: dept.dept_name for dept in department_manager.get_all_departments()}
+        _merge_by_dept(res_container, stored_res_container, year_to_dept_nos, stored_years, dept_no_to_dept_name)
+
+    _store_state(path, watermarks, res_container)
+    return res_container
+
+
+def get_watermarks(table_names, salaries_over_employee_spans=False):
+    """Compute the watermarks of the inputs of the yearly analyses (see module description).
+
+    :param table_names: names of the tables of the employees schema for which to compute the watermarks
+    :param salaries_over_employee_spans: if True, include the salaries in the watermarks of all years spanned by the
+    employee's titles, departments and managed departments
+    :return: map of table names to checksums (tables with a single checksum) or to maps of years (or (year, department
+    number) pairs) to (number of rows, latest from_date, checksum) triplets
+    """
+    watermarks = dict()
+    with pooled_connection() as conn:
+        with conn.cursor() as curs:
+            for table_name in table_names:
+                if table_name in _TABLE_COLUMNS:
+                    curs.execute('SELECT count(*), coalesce(sum(hashtext(concat_ws(\',\', dept_no, {0}))::bigint), 0) FROM employees.{1}'.format(
+                        _TABLE_COLUMNS[table_name], table_name))
+                    n_rows, checksum = curs.fetchone()
+                    watermarks[table_name] = (n_rows, int(checksum))
+                    continue
+
+                # the intervals are expanded into the years they overlap up to the last year in which salaries start (the
+                # salaries are also expanded into the years spanned by the employee's titles, departments and managed
+                # departments if requested) and the genders of the employees are included in the checksums
+                by_dept = table_name in _YEAR_DEPT_TABLE_COLUMNS
+                column = _YEAR_DEPT_TABLE_COLUMNS[table_name] if by_dept else _YEAR_TABLE_COLUMNS[table_name]
+                over_spans = salaries_over_employee_spans and table_name == 'salaries'
+                curs.execute(
+                    """WITH spans AS (SELECT emp_no, min(from_date) AS from_date, max(to_date) AS to_date
+                                      FROM (SELECT emp_no, from_date, to_date FROM employees.titles
+                                            UNION ALL SELECT emp_no, from_date, to_date FROM employees.dept_emp
+                                            UNION ALL SELECT emp_no, from_date, to_date FROM employees.dept_manager) intervals
+                                      WHERE %(over_spans)s
+                                      GROUP BY emp_no)
+                    SELECT years.year{0}, count(*), max(t.from_date), sum(hashtext(concat_ws(',', t.emp_no, t.from_date, t.{1}, e.gender))::bigint)
+                    FROM employees.{2} t
+                    JOIN employees.employees e ON e.emp_no = t.emp_no
+                    LEFT JOIN spans ON spans.emp_no = t.emp_no
+                    CROSS JOIN (SELECT max(EXTRACT(YEAR FROM from_date))::int AS last_year FROM employees.salaries) bounds
+                    CROSS JOIN LATERAL generate_series(EXTRACT(YEAR FROM least(t.from_date, spans.from_date))::int,
+                                                       least(EXTRACT(YEAR FROM greatest(t.to_date, spans.to_date))::int, bounds.last_year)) AS years(year)
+                    GROUP BY years.year{0}""".format(', t.dept_no' if by_dept else '', column, table_name), {'over_spans': over_spans})
+                if by_dept:
+                    watermarks[table_name] = {(year, dept_no): (n_rows, max_from_date.isoformat(), int(checksum))
+                                              for year, dept_no, n_rows, max_from_date, checksum in curs.fetchall()}
+                else:
+                    watermarks[table_name] = {year: (n_rows, max_from_date.isoformat(), int(checksum))
+                                              for year, n_rows, max_from_date, checksum in curs.fetchall()}
+    return watermarks
+
+
+def clear():
+    """Remove all stored results."""
+    cache_dir = get_cache_dir()
+    if os.path.isdir(cache_dir):
+        for file_name in os.listdir(cache_dir):
+            os.remove(os.path.join(cache_dir, file_name))
+
+
+def _merge_by_year(years, res_container_new, stored_res_container):
+    # the results for the recomputed years replace the stored results for these years
+    res_container = ArrayResContainer()
+    for key, res, desc in (res_container_new if res_container_new is not None else stored_res_container).items():
+        arrays = []
+        new_years = set(res.coords['year']) if res_container_new is not None else set()
+        if stored_res_container is not None:
+            stored_res = stored_res_container.get_res(key)
+            arrays.append(stored_res.sel(year=[year for year in stored_res.coords['year'] if year in years and year not in new_years]))
+        if res_container_new is not None:
+            arrays.append(res)
+        res_container.add_res_with_desc(key, concat(arrays, 'year').sel(year=years), desc)
+    return res_container
+
+
+def _merge_by_dept(res_container, stored_res_container, year_to_dept_nos, stored_years, dept_no_to_dept_name):
+    # the stored counts replace the counts of the departments that were not recomputed in the stored years
+    counts = res_container.get_res('n_employees_earn_more_than_managers_by_dept')
+    stored_counts = stored_res_container.get_res('n_employees_earn_more_than_managers_by_dept')
+    for year, dept_nos in year_to_dept_nos.items():
+        if year in stored_years:
+            recomputed_dept_names = {dept_no_to_dept_name[dept_no] for dept_no in dept_nos}
+            for dept_name in counts.coords['dept']:
+                if dept_name not in recomputed_dept_names:
+                    counts.values[counts.index('year', year), counts.index('dept', dept_name)] = stored_counts.sel(year=year, dept=dept_name)
+
+
+def _get_years_to_recompute(stored_watermarks, watermarks, years, stored_years):
+    # map of the years to recompute to the departments to recompute (None for all departments)
+    if stored_watermarks is None or any(stored_watermarks.get(t) != watermarks[t] for t in _TABLE_COLUMNS if t in watermarks):
+        return {year: None for year in years}
+
+    year_to_dept_nos = {year: None for year in years if year not in stored_years}
+    for table_name, table_watermarks in watermarks.items():
+        if table_name in _TABLE_COLUMNS:
+            continue
+        stored_table_watermarks = stored_watermarks.get(table_name, dict())
+        for key in table_watermarks.keys() | stored_table_watermarks.keys():
+            if table_watermarks.get(key) == stored_table_watermarks.get(key):
+                continue
+            if table_name in _YEAR_DEPT_TABLE_COLUMNS:
+                year, dept_no = key
+                if year in years and year_to_dept_nos.get(year, set()) is not None:
+                    year_to_dept_nos.setdefault(year, set()).add(dept_no)
+            elif key in years:
+                year_to_dept_nos[key] = None
+    return year_to_dept_nos
+
+
+def _get_state_path(name, arguments):
+    # the results are stored separately for each database
+    key_data = json.dumps([FORMAT_VERSION, name, arguments, get_config()['dsn']], sort_keys=True)
+    return os.path.join(get_cache_dir(), '{0}.json'.format(hashlib.sha1(key_data.encode()).hexdigest()))
+
+
+def _load_state(path):
+    try:
+        with open(path, 'r') as f:
+            document = json.load(f)
+        if document.get('version') != FORMAT_VERSION:
+            return None, None
+        return result_cache.decode(document['watermarks']), result_cache.decode(document['res'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, None
+
+
+def _store_state(path, watermarks, res_container):
+    document = json.dumps({'version': FORMAT_VERSION,
+                           'watermarks': result_cache.encode(watermarks),
+                           'res': result_cache.encode(res_container)}, allow_nan=False)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = os.path.join(os.path.dirname(path), '.tmp-{0}'.format(uuid.uuid4().hex))
+    with open(tmp_path, 'w') as f:
+        f.write(document)
+    os.replace(tmp_path, path)
@@ -0,0 +1,246 @@
+import numpy as np
+
+from sql_etudes_python import constants
+from sql_etudes_python.data_analysis import logger
+from sql_etudes_python.data_analysis.res_container import ArrayResContainer
+from sql_etudes_python.manager import snapshot
+
+"""
+This script implements an in-process engine for finding the employees that earn more than their managers (4. task).
+Instead of evaluating a self-join of the salaries, dept_manager and dept_emp tables for each year, department and
+gender, the intervals of these tables are bulk-loaded once as NumPy arrays using a psycopg2 cursor. The intervals are
+then expanded into the years they overlap and the results for all years, departments and genders are computed using
+a few sorted (vectorized) passes over these arrays.
+"""
+
+# sentinel for missing salaries (no salary is larger than this value)
+_NO_SALARY = np.iinfo(np.int64).max
+
+
+def load_intervals(curs, years=None):
+    """Bulk-load the intervals needed to find the employees that earn more than their managers.
+
+    :param curs: psycopg2 cursor
+    :param years: if not None, only load the intervals overlapping the range of these years (the results can then only
+    be computed for these years)
+    :return: dictionary mapping interval names to NumPy arrays (dates are represented by their years and department
+    numbers by their index in the list of department numbers)
+    """
+    curs.execute('SELECT d.dept_no, d.dept_name FROM employees.departments d ORDER BY d.dept_no')
+    dept_no_to_dept_name = dict(curs.fetchall())
+    dept_index = curs.mogrify('array_position(%s::text[], dept_no::text) - 1', (list(dept_no_to_dept_name.keys()),)).decode()
+    if years is None:
+        year_filter = ''
+    elif len(years) == 0:
+        # no intervals are needed to compute the results for no years
+        year_filter = 'WHERE false'
+    else:
+        year_filter = curs.mogrify('WHERE from_date <= make_date(%s, 12, 31) AND to_date >= make_date(%s, 1, 1)', (max(years), min(years))).decode()
+
+    salaries = snapshot.fetch_int_columns(
+        curs,
+        """SELECT emp_no, salary, EXTRACT(YEAR FROM from_date)::int, EXTRACT(YEAR FROM to_date)::int
+        FROM employees.salaries {0}""".format(year_filter), 4)
+    dept_emp = snapshot.fetch_int_columns(
+        curs,
+        """SELECT emp_no, {0}, EXTRACT(YEAR FROM from_date)::int, EXTRACT(YEAR FROM to_date)::int
+        FROM employees.dept_emp {1}""".format(dept_index, year_filter), 4)
+    dept_manager = snapshot.fetch_int_columns(
+        curs,
+        """SELECT emp_no, {0}, EXTRACT(YEAR FROM from_date)::int, EXTRACT(YEAR FROM to_date)::int
+        FROM employees.dept_manager {1}""".format(dept_index, year_filter), 4)
+    employees = snapshot.fetch_int_columns(
+        curs,
+        """SELECT emp_no, (gender = '{0}')::int
+        FROM employees.employees
+        ORDER BY emp_no""".format(constants.FEMALE), 2)
+
+    return {
+        'dept_nos': np.array(list(dept_no_to_dept_name.keys())),
+        'dept_names': np.array(list(dept_no_to_dept_name.values())),
+        'emp_nos': employees[0],
+        'emp_is_female': employees[1].astype(bool),
+        'sal_emp_no': salaries[0],
+        'sal_salary': salaries[1],
+        'sal_from_year': salaries[2],
+        'sal_to_year': salaries[3],
+        'de_emp_no': dept_emp[0],
+        'de_dept': dept_emp[1],
+        'de_from_year': dept_emp[2],
+        'de_to_year': dept_emp[3],
+        'dm_emp_no': dept_manager[0],
+        'dm_dept': dept_manager[1],
+        'dm_from_year': dept_manager[2],
+        'dm_to_year': dept_manager[3],
+    }
+
+
+def get_intervals_from_snapshot(snap):
+    """Get the intervals needed to find the employees that earn more than their managers from a snapshot of the
+    employees schema (see snapshot.py in the manager package).
+
+    :param snap: Snapshot instance
+    :return: dictionary mapping interval names to NumPy arrays (same layout as the one returned by load_intervals)
+    """
+    intervals = {
+        'dept_nos': snap.categories['dept_no'],
+        'dept_names': snap.departments['dept_name'],
+        'emp_nos': snap.employees['emp_no'].astype(np.int64),
+        'emp_is_female': snap.is_female(),
+    }
+    for prefix, table in (('sal', snap.salaries), ('de', snap.dept_emp), ('dm', snap.dept_manager)):
+        intervals[prefix + '_emp_no'] = table['emp_no'].astype(np.int64)
+        intervals[prefix + '_from_year'] = snapshot.years_of(table['from_date']).astype(np.int64)
+        intervals[prefix + '_to_year'] = snapshot.years_of(table['to_date']).astype(np.int64)
+    intervals['sal_salary'] = snap.salaries['salary'].astype(np.int64)
+    intervals['de_dept'] = snap.dept_emp['dept_no'].astype(np.int64)
+    intervals['dm_dept'] = snap.dept_manager['dept_no'].astype(np.int64)
+    return intervals
+
+
+def get_relevant_years(intervals):
+    """Get the sorted list of years in which salaries start (the years for which the results are computed).
+
+    :param intervals: intervals returned by load_intervals
+    :return: list of years
+    """
+    return np.unique(intervals['sal_from_year']).tolist()
+
+
+def count_employees_earn_more_than_managers(intervals, years):
+    """Count the distinct employees that earn more than a manager of their department in the same year.
+
+    An employee earns more than a manager in a year if the employee works in the manager's department in that year and
+    has a salary in that year that is higher than a salary of the manager (a different employee) in that year.
+
+    :param intervals: intervals returned by load_intervals
+    :param years: sorted list of years for which to compute the results
+    :return: tuple of arrays containing the counts for each year, the counts for each department (rows) and year
+    (columns) and the counts of female employees for each year
+    """
+    n_emps, n_depts = len(intervals['emp_nos']), len(intervals['dept_nos'])
+    if len(years) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros((n_depts, 0), dtype=np.int64), np.zeros(0, dtype=np.int64)
+    first_year, n_years = years[0], years[-1] - years[0] + 1
+
+    # lowest and highest salary of each employee in each year (dense arrays indexed by employee index and year)
+    sal_row, sal_year = _expand_years(intervals['sal_from_year'], intervals['sal_to_year'], first_year, n_years)
+    sal_emp = np.searchsorted(intervals['emp_nos'], intervals['sal_emp_no'])[sal_row]
+    min_salary, max_salary = _get_min_max_by_key(sal_emp * n_years + sal_year, intervals['sal_salary'][sal_row], n_emps * n_years)
+
+    # lowest and second-lowest salary of the managers of each department in each year
+    dm_row, dm_year = _expand_years(intervals['dm_from_year'], intervals['dm_to_year'], first_year, n_years)
+    dm_emp = np.searchsorted(intervals['emp_nos'], intervals['dm_emp_no'])[dm_row]
+    dm_key = intervals['dm_dept'][dm_row] * n_years + dm_year
+    dm_salary = min_salary[dm_emp * n_years + dm_year]
+    lowest_manager, lowest_salary, second_lowest_salary = _get_two_lowest_by_key(dm_key, dm_salary, dm_emp, n_depts * n_years)
+
+    # employees in departments in years with a salary exceeding the lowest salary of a manager (other than themselves)
+    de_row, de_year = _expand_years(intervals['de_from_year'], intervals['de_to_year'], first_year, n_years)
+    de_emp = np.searchsorted(intervals['emp_nos'], intervals['de_emp_no'])[de_row]
+    de_dept = intervals['de_dept'][de_row]
+    de_key = de_dept * n_years + de_year
+    manager_salary = np.where(lowest_manager[de_key] == de_emp, second_lowest_salary[de_key], lowest_salary[de_key])
+    earns_more = max_salary[de_emp * n_years + de_year] > manager_salary
+
+    # an employee can work in a department only once so the counts for departments do not need deduplication
+    counts_dept_year = np.bincount(de_key[earns_more], minlength=n_depts * n_years).reshape(n_depts, n_years)
+
+    # an employee can work in several departments in a year so the counts for years are computed over distinct employees
+    emp_year = np.unique(de_emp[earns_more] * n_years + de_year[earns_more])
+    emp, year = np.divmod(emp_year, n_years)
+    counts_year = np.bincount(year, minlength=n_years)
+    counts_female_year = np.bincount(year[intervals['emp_is_female'][emp]], minlength=n_years)
+
+    year_idx = np.asarray(years) - first_year
+    return counts_year[year_idx], counts_dept_year[:, year_idx], counts_female_year[year_idx]
+
+
+def get_res_container(intervals, years=None):
+    """Compute the numbers of employees that earn more than their managers by year, department and gender and store
+    them in an ArrayResContainer instance (see get_res_container_from_counts).
+
+    :param intervals: intervals returned by load_intervals or get_intervals_from_snapshot
+    :param years: sorted list of years for which to compute the results (the relevant years of the intervals if None)
+    :return: ArrayResContainer instance containing the obtained results
+    """
+    years = years if years is not None else get_relevant_years(intervals)
+
+    logger.info('computing data segmented by years, departments and genders')
+    counts_year, counts_dept_year, counts_female_year = count_employees_earn_more_than_managers(intervals, years)
+    return get_res_container_from_counts(years, intervals['dept_names'].tolist(), counts_year, counts_dept_year.T, counts_female_year)
+
+
+def get_res_container_from_counts(years, dept_names, counts_year, counts_year_dept, counts_female_year):
+    """Store the numbers of employees that earn more than their managers in an ArrayResContainer instance (with the
+    keys used by the 4. analysis in all modes).
+
+    :param years: list of years
+    :param dept_names: list of department names
+    :param counts_year: array of the numbers of employees for the years
+    :param counts_year_dept: array of the numbers of employees for the years (rows) and departments (columns)
+    :param counts_female_year: array of the numbers of female employees for the years
+    :return: ArrayResContainer instance containing the results
+    """
+    res_container = ArrayResContainer()
+    res_container.add_array_with_desc(
+        'n_employees_earn_more_than_managers',
+        np.asarray(counts_year, dtype=np.int64), ['year'], {'year': years},
+        'number of employees that earn more than their managers by year'
+    )
+    res_container.add_array_with_desc(
+        'n_employees_earn_more_than_managers_by_dept',
+        np.asarray(counts_year_dept, dtype=np.int64).reshape(len(years), len(dept_names)), ['year', 'dept'], {'year': years, 'dept': dept_names},
+        'number of employees that earn more than their managers by year and department'
+    )
+    res_container.add_array_with_desc(
+        'n_female_earn_more_than_managers',
+        np.asarray(counts_female_year, dtype=np.int64), ['year'], {'year': years},
+        'number of female employees that earn more than their managers by year'
+    )
+    return res_container
+
+
+def _expand_years(from_year, to_year, first_year, n_years):
+    """Expand intervals given by their first and last year into (interval index, year index) pairs for the years
+    they overlap (limited to n_years years starting with first_year).
+    """
+    lo = np.maximum(from_year, first_year)
+    n = np.maximum(np.minimum(to_year, first_year + n_years - 1) - lo + 1, 0)
+    row = np.repeat(np.arange(len(n)), n)
+    offset = np.arange(len(row)) - np.repeat(np.cumsum(n) - n, n)
+    return row, lo[row] - first_year + offset
+
+
+def _get_min_max_by_key(key, value, size):
+    """Get the lowest and highest value for each key in [0, size) (_NO_SALARY and -1 for missing keys)."""
+    min_value = np.full(size, _NO_SALARY, dtype=np.int64)
+    max_value = np.full(size, -1, dtype=np.int64)
+    if len(key) == 0:
+        return min_value, max_value
+
+    order = np.lexsort((value, key))
+    key, value = key[order], value[order]
+    first = np.r_[True, key[1:] != key[:-1]]
+    last = np.r_[key[1:] != key[:-1], True]
+    min_value[key[first]] = value[first]
+    max_value[key[last]] = value[last]
+    return min_value, max_value
+
+
+def _get_two_lowest_by_key(key, value, label, size):
+    """Get the label of the lowest value, the lowest value and the second-lowest value for each key in [0, size)."""
+    lowest_label = np.full(size, -1, dtype=np.int64)
+    lowest_value = np.full(size, _NO_SALARY, dtype=np.int64)
+    second_lowest_value = np.full(size, _NO_SALARY, dtype=np.int64)
+    if len(key) == 0:
+        return lowest_label, lowest_value, second_lowest_value
+
+    order = np.lexsort((value, key))
+    key, value, label = key[order], value[order], label[order]
+    first = np.r_[True, key[1:] != key[:-1]]
+    second = np.r_[False, first[:-1] & ~first[1:]]
+    lowest_label[key[first]] = label[first]
+    lowest_value[key[first]] = value[first]
+    second_lowest_value[key[second]] = value[second]
+    return lowest_label, lowest_value, second_lowest_value
@@ -0,0 +1,95 @@
+import collections
+import concurrent.futures
+import contextvars
+import time
+
+from sql_etudes_python.data_analysis import logger
+from sql_etudes_python.manager import instrumentation
+from sql_etudes_python.manager import shared_inputs
+
+"""
+Pipeline running the analyses and visualizations as a directed acyclic graph of nodes. Each node has a name, a function
+and the names of the nodes it depends on. The function is called with a map of the names of the dependencies to their
+results as soon as all dependencies are done, so the nodes that do not depend on each other run concurrently in a pool
+of threads (e.g. the visualizations of an analysis are rendered while the other analyses are still running).
+
+The nodes run in a scope of shared inputs (see shared_inputs.py in the manager package), so the inputs used by several
+analyses (the titles, departments, years and the data fingerprint of the result cache) are fetched once. Data nodes
+fetching the shared inputs are added as dependencies of the analyses using them, so that they are fetched before the
+analyses start rather than by the first analysis needing them. The queries of each node are attributed to the node in
+the per-query instrumentation (see instrumentation.py in the manager package).
+
+Example:
+nodes = [
+    pipeline.Node('titles', lambda inputs: title_manager.get_all_distinct_titles(), []),
+    pipeline.Node('departments', lambda inputs: department_manager.get_all_departments(), []),
+    pipeline.Node('analysis2', lambda inputs: analysis.get_data_analysis2(), ['titles', 'departments']),
+]
+results = pipeline.run(nodes)
+"""
+
+# function called with the map of the names of the dependencies to their results and names of the dependencies
+Node = collections.namedtuple('Node', ['name', 'func', 'deps'])
+
+
+def run(nodes, workers=None):
+    """Run the nodes of a pipeline, each node as soon as its dependencies are done.
+
+    :param nodes: list of Node instances
+    :param workers: maximum number of nodes running at the same time (see ThreadPoolExecutor if None)
+    :return: map of the names of the nodes to their results
+    """
+    name_to_node = {node.name: node for node in nodes}
+    if len(name_to_node) != len(nodes):
+        raise ValueError('The names of the nodes must be unique')
+    for node in nodes:
+        unknown_deps = [dep for dep in node.deps if dep not in name_to_node]
+        if unknown_deps:
+            raise ValueError('Node {0} depends on unknown nodes {1}'.format(node.name, ', '.join(unknown_deps)))
+    check_acyclic(nodes)
+
+    results = dict()
+    with shared_inputs.scope():
+        # the nodes run in copies of the context of the calling thread (the scope of the shared inputs)
+        context = contextvars.copy_context()
+        name_to_pending_deps = {node.name: set(node.deps) for node in nodes}
+        future_to_name = dict()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            while name_to_pending_deps or future_to_name:
+                for name in [name for name, pending_deps in name_to_pending_deps.items() if not pending_deps]:
+                    del name_to_pending_deps[name]
+                    node = name_to_node[name]
+                    inputs = {dep: results[dep] for dep in node.deps}
+                    future_to_name[pool.submit(context.copy().run, _run_node, node, inputs)] = name
+
+                done, _ = concurrent.futures.wait(future_to_name.keys(), return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    name = future_to_name.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except BaseException:
+                        # the nodes that have not started yet are not run
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        raise
+                    for pending_deps in name_to_pending_deps.values():
+                        pending_deps.discard(name)
+    return results
+
+
+def check_acyclic(nodes):
+    """Check that the dependencies of the nodes do not contain cycles (raises ValueError if they do)."""
+    name_to_deps = {node.name: set(node.deps) for node in nodes}
+    done = set()
+    while len(done) < len(name_to_deps):
+        ready = [name for name, deps in name_to_deps.items() if name not in done and deps <= done]
+        if not ready:
+            raise ValueError('The dependencies of nodes {0} form a cycle'.format(', '.join(sorted(set(name_to_deps) - done))))
+        done.update(ready)
+
+
+def _run_node(node, inputs):
+    start = time.perf_counter()
+    with instrumentation.stage(node.name):
+        res = node.func(inputs)
+    logger.info('Finished {0} in {1:.3f}s'.format(node.name, time.perf_counter() - start))
+    return res
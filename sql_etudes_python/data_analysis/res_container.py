@@ -1,3 +1,9 @@
+import io
+import json
+
+import numpy as np
+
+
 class ResContainer:
     """Class used to store analysis results by key.
 
@@ -42,8 +48,284 @@ class ResContainer:
         """
         return set(self._results.keys())
 
+    def items(self):
+        """Get the results contained in this ResContainer instance
+
+        :return: list of (key, result, description) triplets in the order in which the results were added
+        """
+        return [(k, v['res'], v['desc']) for k, v in self._results.items()]
+
     def __str__(self):
         res = ''
         for k, v in self._results.items():
             res += '{0} - {1}\n'.format(k, v['desc'])
         return res
+
+
+class LabeledArray:
+    """Class used to store results indexed by several dimensions (e.g. years, departments and salary percentiles).
+
+    The results are stored in a NumPy array with one axis for each named dimension and a list of labels for each
+    dimension. Selections of single labels and of ranges of labels return views of the stored array.
+    """
+
+    def __init__(self, values, dims, coords):
+        """
+        :param values: NumPy array (or sequence convertible to a NumPy array) of the results
+        :param dims: names of the dimensions (one for each axis of the array)
+        :param coords: map of the names of the dimensions to the lists of labels along the dimensions
+        """
+        self.values = np.asarray(values)
+        self.dims = tuple(dims)
+        if self.values.ndim != len(self.dims):
+            raise ValueError('Array with {0} axes can not have dimensions {1}'.format(self.values.ndim, ', '.join(self.dims)))
+        self.coords = {dim: list(coords[dim]) for dim in self.dims}
+        for dim, size in zip(self.dims, self.values.shape):
+            if len(self.coords[dim]) != size:
+                raise ValueError('Dimension {0} has {1} labels but size {2}'.format(dim, len(self.coords[dim]), size))
+        self._dim_to_label_to_index = dict()
+
+    @classmethod
+    def from_dict(cls, label_to_value, dims, fill_value=np.nan):
+        """Create a LabeledArray instance from nested maps of labels to values (one level for each dimension).
+
+        :param label_to_value: map of the labels along the first dimension to the values (maps of the labels along the
+        next dimension to the values if there are several dimensions)
+        :param dims: names of the dimensions
+        :param fill_value: value for the combinations of labels not in the maps
+        :return: LabeledArray instance with the labels along each dimension sorted
+        """
+        cells = []
+
+        def collect(value, labels):
+            if len(labels) == len(dims):
+                cells.append((labels, value))
+            else:
+                for label, v in value.items():
+                    collect(v, labels + (label,))
+
+        collect(label_to_value, ())
+        coords = {dim: sorted({labels[axis] for labels, _ in cells}) for axis, dim in enumerate(dims)}
+        shape = tuple(len(coords[dim]) for dim in dims)
+        cell_values = np.array([value for _, value in cells])
+        if len(cells) == np.prod(shape, dtype=int):
+            values = np.empty(shape, dtype=cell_values.dtype)
+        else:
+            values = np.full(shape, fill_value, dtype=np.result_type(cell_values, fill_value))
+        if cells:
+            label_to_index = [{label: i for i, label in enumerate(coords[dim])} for dim in dims]
+            positions = np.array([[label_to_index[axis][label] for axis, label in enumerate(labels)] for labels, _ in cells])
+            values[tuple(positions.T)] = cell_values
+        return cls(values, dims, coords)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def index(self, dim, label):
+        """Get the position of a label along a dimension.
+
+        :param dim: name of the dimension
+        :param label: label along the dimension
+        :return: position of the label
+        """
+        return self._get_label_to_index(dim)[label]
+
+    def isel(self, **dim_to_positions):
+        """Select results by positions along dimensions.
+
+        :param dim_to_positions: map of the names of the dimensions to positions (removing the dimension), slices or
+        lists of positions (the dimensions not given are not changed)
+        :return: LabeledArray instance containing the selected results (a view of the results unless lists of positions
+        are given) or the result if all dimensions are removed
+        """
+        self._check_dims(dim_to_positions)
+        indexer, dims = [], []
+        for dim in self.dims:
+            positions = dim_to_positions.get(dim, slice(None))
+            if isinstance(positions, (int, np.integer)):
+                indexer.append(positions)
+            else:
+                indexer.append(positions if isinstance(positions, slice) else slice(None))
+                dims.append(dim)
+        values = self.values[tuple(indexer)]
+        if not dims:
+            return values.item()
+
+        coords = dict()
+        for axis, dim in enumerate(dims):
+            positions = dim_to_positions.get(dim, slice(None))
+            if isinstance(positions, slice):
+                coords[dim] = self.coords[dim][positions]
+            else:
+                values = np.take(values, positions, axis=axis)
+                coords[dim] = [self.coords[dim][p] for p in positions]
+        return LabeledArray(values, dims, coords)
+
+    def sel(self, **dim_to_labels):
+        """Select results by labels along dimensions.
+
+        :param dim_to_labels: map of the names of the dimensions to labels (removing the dimension), slices of labels
+        (including both ends) or lists of labels (the dimensions not given are not changed)
+        :return: LabeledArray instance containing the selected results (a view of the results unless lists of labels are
+        given) or the result if all dimensions are removed
+        """
+        self._check_dims(dim_to_labels)
+        dim_to_positions = dict()
+        for dim, labels in dim_to_labels.items():
+            if isinstance(labels, slice):
+                start = self.index(dim, labels.start) if labels.start is not None else None
+                stop = self.index(dim, labels.stop) + 1 if labels.stop is not None else None
+                dim_to_positions[dim] = slice(start, stop)
+            elif isinstance(labels, (list, tuple, np.ndarray)):
+                dim_to_positions[dim] = [self.index(dim, label) for label in labels]
+            else:
+                dim_to_positions[dim] = self.index(dim, labels)
+        return self.isel(**dim_to_positions)
+
+    def reindex(self, fill_value=np.nan, **dim_to_labels):
+        """Get the results for the given labels along dimensions.
+
+        :param fill_value: value for the labels that are not in this LabeledArray instance
+        :param dim_to_labels: map of the names of the dimensions to the lists of labels (the dimensions not given are
+        not changed)
+        :return: LabeledArray instance with the given labels (this instance if the labels are not changed)
+        """
+        self._check_dims(dim_to_labels)
+        coords = {dim: list(dim_to_labels.get(dim, self.coords[dim])) for dim in self.dims}
+        if coords == self.coords:
+            return self
+
+        positions, new_positions = [], []
+        for dim in self.dims:
+            label_to_index = self._get_label_to_index(dim)
+            pairs = [(label_to_index[label], i) for i, label in enumerate(coords[dim]) if label in label_to_index]
+            positions.append([p for p, _ in pairs])
+            new_positions.append([i for _, i in pairs])
+        values = np.full([len(coords[dim]) for dim in self.dims], fill_value, dtype=np.result_type(self.values, fill_value))
+        if all(positions):
+            values[np.ix_(*new_positions)] = self.values[np.ix_(*positions)]
+        return LabeledArray(values, self.dims, coords)
+
+    def transpose(self, *dims):
+        """Get the results with the dimensions in the given order (a view of the results).
+
+        :param dims: names of all dimensions in the new order
+        :return: LabeledArray instance with the dimensions in the given order
+        """
+        if sorted(dims) != sorted(self.dims):
+            raise ValueError('Dimensions {0} do not match dimensions {1}'.format(', '.join(dims), ', '.join(self.dims)))
+        return LabeledArray(self.values.transpose([self.dims.index(dim) for dim in dims]), dims, self.coords)
+
+    def to_pandas(self):
+        """Export the results to pandas without copying them (if the array is contiguous).
+
+        :return: Series indexed by the labels for one dimension, DataFrame with the labels along the first dimension as
+        the index and the labels along the second dimension as the columns for two dimensions and Series with a
+        MultiIndex for more dimensions
+        """
+        import pandas as pd
+
+        if len(self.dims) == 1:
+            return pd.Series(self.values, index=pd.Index(self.coords[self.dims[0]], name=self.dims[0]), copy=False)
+        if len(self.dims) == 2:
+            return pd.DataFrame(self.values,
+                                index=pd.Index(self.coords[self.dims[0]], name=self.dims[0]),
+                                columns=pd.Index(self.coords[self.dims[1]], name=self.dims[1]),
+                                copy=False)
+        index = pd.MultiIndex.from_product([self.coords[dim] for dim in self.dims], names=self.dims)
+        return pd.Series(self.values.reshape(-1), index=index, copy=False)
+
+    def _check_dims(self, dim_to_value):
+        unknown_dims = [dim for dim in dim_to_value if dim not in self.dims]
+        if unknown_dims:
+            raise KeyError('Unknown dimensions {0}'.format(', '.join(unknown_dims)))
+
+    def _get_label_to_index(self, dim):
+        label_to_index = self._dim_to_label_to_index.get(dim)
+        if label_to_index is None:
+            label_to_index = self._dim_to_label_to_index[dim] = {label: i for i, label in enumerate(self.coords[dim])}
+        return label_to_index
+
+    def __repr__(self):
+        return 'LabeledArray({0})'.format(', '.join('{0}: {1}'.format(dim, size) for dim, size in zip(self.dims, self.shape)))
+
+
+def concat(arrays, dim):
+    """Concatenate LabeledArray instances along a dimension.
+
+    :param arrays: list of LabeledArray instances with the same dimensions
+    :param dim: name of the dimension along which to concatenate the arrays
+    :return: LabeledArray instance (the labels along the other dimensions are the sorted union of the labels of the
+    arrays if they differ, with NaN for the missing results)
+    """
+    dims = arrays[0].dims
+    coords = dict()
+    for d in dims:
+        if d == dim:
+            coords[d] = [label for array in arrays for label in array.coords[d]]
+        elif all(array.coords[d] == arrays[0].coords[d] for array in arrays):
+            coords[d] = arrays[0].coords[d]
+        else:
+            coords[d] = sorted(set().union(*(array.coords[d] for array in arrays)))
+    arrays = [array.transpose(*dims).reindex(**{d: coords[d] for d in dims if d != dim}) for array in arrays]
+    return LabeledArray(np.concatenate([array.values for array in arrays], axis=dims.index(dim)), dims, coords)
+
+
+class ArrayResContainer(ResContainer):
+    """ResContainer storing results indexed by several dimensions (LabeledArray instances) by key.
+
+    The results can be serialized in a compact binary format (NumPy arrays in a compressed archive).
+    """
+
+    def add_res_with_desc(self, key, res, desc):
+        """Add result for a key with a description
+
+        :param key: key for which to store the results
+        :param res: LabeledArray instance
+        :param desc: the description of the result
+        """
+        if not isinstance(res, LabeledArray):
+            raise TypeError('ArrayResContainer stores LabeledArray instances, not {0}'.format(type(res).__name__))
+        super().add_res_with_desc(key, res, desc)
+
+    def add_array_with_desc(self, key, values, dims, coords, desc):
+        """Add result given by an array and the labels along its dimensions for a key with a description
+
+        :param key: key for which to store the results
+        :param values: NumPy array of the results
+        :param dims: names of the dimensions
+        :param coords: map of the names of the dimensions to the lists of labels along the dimensions
+        :param desc: the description of the result
+        """
+        self.add_res_with_desc(key, LabeledArray(values, dims, coords), desc)
+
+    def to_bytes(self):
+        """Serialize the results in a compact binary format.
+
+        :return: bytes that can be loaded with from_bytes
+        """
+        arrays = dict()
+        header = []
+        for i, (key, res, desc) in enumerate(self.items()):
+            header.append([key, desc, list(res.dims)])
+            arrays['{0}/values'.format(i)] = res.values
+            for j, dim in enumerate(res.dims):
+                arrays['{0}/coords/{1}'.format(i, j)] = np.asarray(res.coords[dim])
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, header=np.array(json.dumps(header)), **arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Load results serialized with to_bytes.
+
+        :param data: bytes returned by to_bytes
+        :return: ArrayResContainer instance
+        """
+        res_container = cls()
+        with np.load(io.BytesIO(data), allow_pickle=False) as archive:
+            for i, (key, desc, dims) in enumerate(json.loads(archive['header'].item())):
+                coords = {dim: archive['{0}/coords/{1}'.format(i, j)].tolist() for j, dim in enumerate(dims)}
+                res_container.add_array_with_desc(key, archive['{0}/values'.format(i)], dims, coords, desc)
+        return res_container
@@ -0,0 +1,261 @@
+import contextlib
+import contextvars
+import functools
+import hashlib
+import inspect
+import json
+import math
+import os
+import time
+import uuid
+
+import numpy as np
+
+from sql_etudes_python.data_analysis import logger
+from sql_etudes_python.data_analysis.res_container import ArrayResContainer
+from sql_etudes_python.data_analysis.res_container import LabeledArray
+from sql_etudes_python.data_analysis.res_container import ResContainer
+from sql_etudes_python.manager import current_state
+from sql_etudes_python.manager import pooled_connection
+from sql_etudes_python.manager import shared_inputs
+from sql_etudes_python.manager import snapshot
+from sql_etudes_python.manager import table_cache
+
+"""
+Persistent cache of the ResContainer instances returned by the analysis functions. The functions decorated with cached
+return the stored results if they were called with the same parameters and the data in the database has not changed
+since the results were stored (checked using a fingerprint of the contents of the tables and materialized views of the
+employees schema, see get_data_fingerprint). The parameters only controlling how the results are computed (see
+EXECUTION_ARGUMENTS) are not part of the cache key. The cache is disabled by default and the stored results can be
+removed with clear (e.g. after changes the fingerprint can not detect).
+
+The results are stored as JSON documents in a versioned format in which the types that JSON can not represent (tuples,
+dictionaries with non-string keys, non-finite floats, NumPy arrays, labeled arrays and nested ResContainer instances)
+are tagged. Entries are evicted when they are older than the maximum age or when the cache exceeds its maximum size
+(least recently used entries first).
+
+The cache is configured with the following environment variables:
+SQL_ETUDES_RESULT_CACHE - set to 1 to enable the cache
+SQL_ETUDES_CACHE_DIR - base cache directory (the results are stored in its results subdirectory)
+SQL_ETUDES_RESULT_CACHE_MAX_BYTES - maximum size of the cache in bytes (default 256 MB)
+SQL_ETUDES_RESULT_CACHE_MAX_AGE - maximum age of the entries in seconds (default 30 days)
+"""
+
+FORMAT_VERSION = 2
+
+# arguments of the analysis functions that do not change the results (left out of the cache keys)
+EXECUTION_ARGUMENTS = {'concurrency', 'jobs'}
+
+# data fingerprint computed by the outermost cached call and reused by nested cached calls
+_data_fingerprint = contextvars.ContextVar('data_fingerprint', default=None)
+
+# set within disabled (the results are computed and not stored)
+_disabled = contextvars.ContextVar('result_cache_disabled', default=False)
+
+
+def is_enabled():
+    return os.environ.get('SQL_ETUDES_RESULT_CACHE', '0') == '1' and not _disabled.get()
+
+
+@contextlib.contextmanager
+def disabled():
+    """Context manager within which the functions decorated with cached compute their results without using the cache
+    (also in the threads running in copies of the context, e.g. the ones started by map_threads in executor.py in the
+    manager package).
+    """
+    token = _disabled.set(True)
+    try:
+        yield
+    finally:
+        _disabled.reset(token)
+
+
+def get_cache_dir():
+    return os.path.join(os.environ.get('SQL_ETUDES_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'sql_etudes_python')), 'results')
+
+
+def get_max_bytes():
+    return int(os.environ.get('SQL_ETUDES_RESULT_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+
+def get_max_age():
+    return float(os.environ.get('SQL_ETUDES_RESULT_CACHE_MAX_AGE', 30 * 24 * 60 * 60))
+
+
+def cached(func):
+    """Decorator for analysis functions returning ResContainer instances that caches their results.
+
+    The cache key consists of the function, its arguments (which must be representable in JSON) except the ones in
+    EXECUTION_ARGUMENTS and the data fingerprint.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not is_enabled():
+            return func(*args, **kwargs)
+
+        bound_args = signature.bind(*args, **kwargs)
+        bound_args.apply_defaults()
+
+        fingerprint = _data_fingerprint.get()
+        token = None
+        if fingerprint is None:
+            fingerprint = get_data_fingerprint()
+            token = _data_fingerprint.set(fingerprint)
+        try:
+            arguments = {name: value for name, value in bound_args.arguments.items() if name not in EXECUTION_ARGUMENTS}
+            key = get_key('{0}.{1}'.format(func.__module__, func.__qualname__), arguments, fingerprint)
+            res_container = load(key)
+            if res_container is not None:
+                logger.info('Using cached results for {0}'.format(func.__name__))
+                return res_container
+            res_container = func(*args, **kwargs)
+            store(key, res_container)
+            return res_container
+        finally:
+            if token is not None:
+                _data_fingerprint.reset(token)
+
+    return wrapper
+
+
+@shared_inputs.shared
+def get_data_fingerprint():
+    """Get the fingerprint of the data in the database (including the contents of the materialized views, which are not
+    updated when the tables change, and whether the current state queries are answered from a view).
+    """
+    use_view = current_state.is_enabled()
+    view_names = [name for name in current_state.get_view_names() if current_state.is_view_populated(name)]
+    with pooled_connection() as conn:
+        with conn.cursor() as curs:
+            fingerprint = '-'.join([snapshot.get_data_fingerprint(curs), 'view' if use_view else 'tables'] +
+                                   [table_cache.get_table_fingerprint(curs, name) for name in view_names])
+    return fingerprint
+
+
+def get_key(func_name, arguments, fingerprint):
+    """Get the cache key for a function, its arguments and the data fingerprint."""
+    key_data = json.dumps([FORMAT_VERSION, func_name, encode(dict(arguments)), fingerprint], sort_keys=True)
+    return hashlib.sha1(key_data.encode()).hexdigest()
+
+
+def load(key):
+    """Load the ResContainer instance stored for a key (None if there is no valid entry for the key)."""
+    path = _get_entry_path(key)
+    try:
+        if time.time() - os.path.getmtime(path) > get_max_age():
+            os.remove(path)
+            return None
+        with open(path, 'r') as f:
+            document = json.load(f)
+        if document.get('version') != FORMAT_VERSION:
+            return None
+        # mark the entry as recently used
+        os.utime(path)
+        return decode(document['res'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def store(key, res_container):
+    """Store a ResContainer instance for a key (atomically) and evict entries if needed."""
+    try:
+        document = json.dumps({'version': FORMAT_VERSION, 'res': encode(res_container)}, allow_nan=False)
+    except (TypeError, ValueError) as e:
+        logger.warning('Results can not be cached: {0}'.format(e))
+        return
+
+    cache_dir = get_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = os.path.join(cache_dir, '.tmp-{0}'.format(uuid.uuid4().hex))
+    with open(tmp_path, 'w') as f:
+        f.write(document)
+    os.replace(tmp_path, _get_entry_path(key))
+    evict()
+
+
+def evict():
+    """Remove the entries older than the maximum age and the least recently used entries exceeding the maximum size."""
+    cache_dir = get_cache_dir()
+    entries = []
+    for file_name in os.listdir(cache_dir):
+        if file_name.endswith('.json'):
+            path = os.path.join(cache_dir, file_name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    now, max_age, max_bytes = time.time(), get_max_age(), get_max_bytes()
+    total_size = 0
+    for mtime, size, path in sorted(entries, reverse=True):
+        total_size += size
+        if now - mtime > max_age or total_size > max_bytes:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def clear():
+    """Remove all cached results."""
+    cache_dir = get_cache_dir()
+    if os.path.isdir(cache_dir):
+        for file_name in os.listdir(cache_dir):
+            os.remove(os.path.join(cache_dir, file_name))
+
+
+def encode(value):
+    """Encode a value as a JSON-compatible value (see module description)."""
+    if isinstance(value, ArrayResContainer):
+        return {'__type__': 'ArrayResContainer', 'items': [[k, encode(res), desc] for k, res, desc in value.items()]}
+    if isinstance(value, LabeledArray):
+        return {'__type__': 'LabeledArray', 'values': encode(value.values), 'dims': list(value.dims), 'coords': [encode(value.coords[dim]) for dim in value.dims]}
+    if isinstance(value, ResContainer):
+        return {'__type__': 'ResContainer', 'items': [[k, encode(res), desc] for k, res, desc in value.items()]}
+    if isinstance(value, np.ndarray):
+        return {'__type__': 'ndarray', 'dtype': value.dtype.str, 'shape': list(value.shape), 'data': encode(value.ravel().tolist())}
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or isinstance(value, (bool, int, str)):
+        return value
+    if isinstance(value, float):
+        return value if math.isfinite(value) else {'__type__': 'float', 'value': repr(value)}
+    if isinstance(value, list):
+        return [encode(v) for v in value]
+    if isinstance(value, tuple):
+        return {'__type__': 'tuple', 'items': [encode(v) for v in value]}
+    if isinstance(value, dict):
+        return {'__type__': 'dict', 'items': [[encode(k), encode(v)] for k, v in value.items()]}
+    raise TypeError('values of type {0} are not supported'.format(type(value).__name__))
+
+
+def decode(value):
+    """Decode a value encoded with encode."""
+    if isinstance(value, list):
+        return [decode(v) for v in value]
+    if not isinstance(value, dict):
+        return value
+    value_type = value['__type__']
+    if value_type in ('ResContainer', 'ArrayResContainer'):
+        res_container = ArrayResContainer() if value_type == 'ArrayResContainer' else ResContainer()
+        for k, res, desc in value['items']:
+            res_container.add_res_with_desc(k, decode(res), desc)
+        return res_container
+    if value_type == 'LabeledArray':
+        return LabeledArray(decode(value['values']), value['dims'], {dim: decode(labels) for dim, labels in zip(value['dims'], value['coords'])})
+    if value_type == 'ndarray':
+        return np.array(decode(value['data']), dtype=np.dtype(value['dtype'])).reshape(value['shape'])
+    if value_type == 'float':
+        return float(value['value'])
+    if value_type == 'tuple':
+        return tuple(decode(v) for v in value['items'])
+    if value_type == 'dict':
+        return {decode(k): decode(v) for k, v in value['items']}
+    raise ValueError('Unknown type {0}'.format(value_type))
+
+
+def _get_entry_path(key):
+    return os.path.join(get_cache_dir(), '{0}.json'.format(key))
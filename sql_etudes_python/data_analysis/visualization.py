@@ -1,6 +1,10 @@
+import collections
+import concurrent.futures
 import os
+import uuid
 import warnings
 
+import matplotlib
 import matplotlib.pyplot as plt
 import pandas as pd
 
@@ -12,59 +16,81 @@ with a ResContainer instance containing the key-value-description triplets repre
 using either the analsys.py or analysis_psycopg2.py scripts. The functions produce plots and LaTeX tables
 that are saved to the ./results directory. The functions are called from the main.py script in the root package.
 
+Each plot or table is produced by a render job (see RenderJob) containing the slice of the results it needs. The jobs
+do not depend on global pyplot state, so the jobs of all analyses can be run in parallel in a pool of processes using the
+render_all function. The outputs are written atomically (to a temporary file that is then renamed).
+
 Author: Jernej Vivod (vivod.jernej@gmail.com)
 """
 
+# render function (called with the output path and the keyword arguments), keyword arguments and output file name
+RenderJob = collections.namedtuple('RenderJob', ['render', 'kwargs', 'file_name'])
+
 
-def get_vis_analysis1(res_container):
+def get_vis_analysis1(res_container, output_dir=None):
     """Task instructions: Rank the employee titles according to the average salary for each department
     and for the whole company. Present the results in a bar chart.
 
     :param res_container: ResContainer instance containing the results to plot
+    :param output_dir: directory in which to save the results (the results directory in this package if None)
     """
     logger.info('Obtaining visualizations for 1. task')
+    run_render_jobs(get_render_jobs_analysis1(res_container), output_dir)
+
+
+def get_render_jobs_analysis1(res_container):
+    return [
+        # plot ranking of titles by average salary
+        RenderJob(_render_salary_rankings,
+                  {'title_to_average_salary_company': res_container.get_res('title_to_average_salary_company')},
+                  'salary_rankings.svg'),
+        # get table of rankings of titles based on average salary by department
+        RenderJob(_render_latex_table_analysis1,
+                  {'dept_to_title_to_average_salary': res_container.get_res('dept_to_title_to_average_salary')},
+                  'latex_table_analysis1.tex')
+    ]
 
-    # path to results directory
-    res_dir_path = os.path.join(os.path.dirname(__file__), 'results/')
 
-    # plot ranking of titles by average salary
-    title_to_average_salary_company = res_container.get_res('title_to_average_salary_company')
+def _render_salary_rankings(save_path, title_to_average_salary_company):
+    plt.figure()
     plt.bar(*list(zip(*sorted(map(lambda x: (x[0].replace(' ', '\n'), x[1]), title_to_average_salary_company.items()), key=lambda x: x[1], reverse=True))), color='lightskyblue')
     plt.ylim([min(title_to_average_salary_company.values()) - 5000, max(title_to_average_salary_company.values()) + 5000])
     plt.ylabel('Average Salary')
-    plt.savefig(os.path.join(res_dir_path, 'salary_rankings.svg'))
+    plt.savefig(save_path)
+
 
-    # get table of rankings of titles based on average salary by department
-    data_df = pd.DataFrame(res_container.get_res('dept_to_title_to_average_salary'))
+def _render_latex_table_analysis1(save_path, dept_to_title_to_average_salary):
+    data_df = pd.DataFrame(dept_to_title_to_average_salary)
     for (col_name, col_data) in data_df.iteritems():
         title_to_rank = {k: idx + 1 for (idx, (k, v)) in enumerate(sorted(data_df[col_name].items(), key=lambda x: x[1], reverse=True)) if v != -1}
         for k in col_data.keys():
             col_data[k] = '{:.1f}'.format(col_data[k]) + ' ({0})'.format(title_to_rank[k]) if k in title_to_rank else '-'
 
-    with open(os.path.join(res_dir_path, 'latex_table_analysis1.tex'), 'w') as f:
+    with open(save_path, 'w') as f:
         latex_output_str = data_df.style.to_latex(hrules=True, column_format='l|' + 'l' * data_df.shape[1])
         f.write(latex_output_str.replace('\\\\', '\\\\ \\hline', 1))
 
 
-def get_vis_analysis2(res_container):
+def get_vis_analysis2(res_container, output_dir=None):
     """Task instructions: The company actively pursues gender equality. Prepare an analysis based on salaries and gender distribution
     by departments, managers, and titles. Present results in a chart (or several charts) of your choice.
 
     :param res_container: ResContainer instance containing the results to plot
+    :param output_dir: directory in which to save the results (the results directory in this package if None)
     """
-    warnings.simplefilter(action='ignore', category=FutureWarning)
     logger.info('Obtaining visualizations for 2. task')
+    run_render_jobs(get_render_jobs_analysis2(res_container), output_dir)
+
+
+def get_render_jobs_analysis2(res_container):
+    warnings.simplefilter(action='ignore', category=FutureWarning)
 
     def append_port_val_to_df(dataframe, val, name):
         """Append value val and 1-val to dataframe (with predefined column names) for specified index name
         """
         return dataframe.append(pd.Series({'Portion female employees': val, 'Portion male employees': 1 - val}, name=name))
 
-    # path to results directory
-    res_dir_path = os.path.join(os.path.dirname(__file__), 'results/')
-
-    # plot gender-based stats as a stacked horizontal bar plot
-    plt.rcParams.update({'font.size': 7})
+    # gender-based stats plotted as a stacked horizontal bar plot
     df = pd.DataFrame()
     df = append_port_val_to_df(df, res_container.get_res('portion_female_all'), 'All\nemployees')
     df = append_port_val_to_df(df, res_container.get_res('portion_female_managers'), 'Managers')
@@ -74,85 +100,96 @@ def get_vis_analysis2(res_container):
     for k, v in res_container.get_res('title_to_portion_female').items():
         df = append_port_val_to_df(df, v, '{0}'.format(k.replace(' ', '\n')))
 
-    get_annotated_stacked_port_barh_plot(df, os.path.join(res_dir_path, 'female_employee_portions.svg'))
-
-    # plot gender ratios for departments
-    df = pd.DataFrame()
+    # gender ratios for departments
+    df_depts = pd.DataFrame()
     for k, v in res_container.get_res('dept_to_portion_female').items():
-        df = append_port_val_to_df(df, v, '{0}'.format(k).replace(' ', '\n'))
+        df_depts = append_port_val_to_df(df_depts, v, '{0}'.format(k).replace(' ', '\n'))
 
-    get_annotated_stacked_port_barh_plot(df, os.path.join(res_dir_path, 'female_employee_portions2.svg'))
+    return [
+        RenderJob(_render_annotated_stacked_port_barh_plot, {'df': df, 'font_size': 7}, 'female_employee_portions.svg'),
+        RenderJob(_render_annotated_stacked_port_barh_plot, {'df': df_depts, 'font_size': 7}, 'female_employee_portions2.svg')
+    ]
 
 
-def get_vis_analysis3(res_container):
+def get_vis_analysis3(res_container, output_dir=None):
     """Task instructions: Prepare the same analysis but also on a yearly basis.
 
-    :param res_container: ResContainer instance containing the results to plot
+    :param res_container: ArrayResContainer instance containing the results to plot
+    :param output_dir: directory in which to save the results (the results directory in this package if None)
     """
     logger.info('Obtaining visualizations for 3. task')
+    run_render_jobs(get_render_jobs_analysis3(res_container), output_dir)
 
-    # path to results directory
-    res_dir_path = os.path.join(os.path.dirname(__file__), 'results/')
-
-    # TODO remove from final code
-    import pickle as pkl
-    with open('datadata.pkl', 'rb') as f:
-        res_container = pkl.load(f)
-
-    # get concatenated data for years
-    keys_for_concat = {k: [] for k in res_container.get_res(next(iter(res_container.keys()))).keys()}
-
-    # get dictionary mapping data key values to lists of this data for all years (ascending)
-    years = sorted(list(res_container.keys()))
-    for year in sorted(res_container.keys()):
-        for k in res_container.get_res(year).keys():
-            keys_for_concat[k].append(res_container.get_res(year).get_res(k))
-
-    # plot gender ratios (portion female) for various data
-    plt.plot(years, keys_for_concat['portion_female_all'], label='Portion female employees')
-    plt.plot(years, [d['Senior Engineer'] for d in keys_for_concat['title_to_portion_female']], label='Portion female senior engineers')
-    plt.plot(years, [d['Senior Staff'] for d in keys_for_concat['title_to_portion_female']], label='Portion female senior staff')
-    plt.plot(years, [d['Manager'] for d in keys_for_concat['title_to_portion_female']], label='Portion female managers')
-    plt.plot(years, [d[0.99] for d in keys_for_concat['salary_percentile_to_portion_female']], label='Portion female employees\nin 99th salary percentile')
+
+def get_render_jobs_analysis3(res_container):
+    # the results are stacked by year (the first dimension of the labeled arrays)
+    years = res_container.get_res('portion_female_all').coords['year']
+    title_to_portion_female = res_container.get_res('title_to_portion_female')
+
+    # gender ratios (portion female) for various data
+    label_to_values = {
+        'Portion female employees': res_container.get_res('portion_female_all').values,
+        'Portion female senior engineers': title_to_portion_female.sel(title='Senior Engineer').values,
+        'Portion female senior staff': title_to_portion_female.sel(title='Senior Staff').values,
+        'Portion female managers': title_to_portion_female.sel(title='Manager').values,
+        'Portion female employees\nin 99th salary percentile': res_container.get_res('salary_percentile_to_portion_female').sel(percentile=0.99).values,
+    }
+    return [RenderJob(_render_female_employee_portions_by_year, {'years': years, 'label_to_values': label_to_values}, 'female_employee_portions_by_year.svg')]
+
+
+def _render_female_employee_portions_by_year(save_path, years, label_to_values):
+    plt.figure()
+    for label, values in label_to_values.items():
+        plt.plot(years, values, label=label)
     plt.ylabel('Portion female employees')
     plt.xticks(years, rotation='60')
     plt.legend(loc='upper right')
-    plt.savefig(os.path.join(res_dir_path, 'female_employee_portions_by_year.svg'))
+    plt.savefig(save_path)
 
 
-def get_vis_analysis4(res_container):
+def get_vis_analysis4(res_container, output_dir=None):
     """Check if some employees earn more than their managers. Split the results by year, gender and
     department if such employees exist.
 
-    :param res_container: ResContainer instance containing the results to plot
+    :param res_container: ArrayResContainer instance containing the results to plot
+    :param output_dir: directory in which to save the results (the results directory in this package if None)
     """
+    run_render_jobs(get_render_jobs_analysis4(res_container), output_dir)
 
-    # path to results directory
-    res_dir_path = os.path.join(os.path.dirname(__file__), 'results/')
 
-    # draw plot of number of employees that earn more than their managers wrt. year
-    years = res_container.get_res('years')
+def get_render_jobs_analysis4(res_container):
+    # number of employees that earn more than their managers wrt. year
+    n_employees_earn_more_than_managers = res_container.get_res('n_employees_earn_more_than_managers')
+    years = n_employees_earn_more_than_managers.coords['year']
 
-    # get y-axis values
-    n_employees_earn_more_than_managers_for_year = []
-    for year in years:
-        n_employees_earn_more_than_managers_for_year.append(res_container.get_res('n_employees_earn_more_than_managers_{0}'.format(year)))
+    # heatmap of employees that earn more than their managers wrt. year and department
+    n_employees_earn_more_than_managers_by_dept = res_container.get_res('n_employees_earn_more_than_managers_by_dept').transpose('dept', 'year')
+    dept_names = n_employees_earn_more_than_managers_by_dept.coords['dept']
 
-    # get and save bar plot
+    # ratios of female employees that earn more than their managers wrt. year
+    portion_female = res_container.get_res('n_female_earn_more_than_managers').values / n_employees_earn_more_than_managers.values
+    df = pd.DataFrame({'Portion\nfemale employees': portion_female, 'Portion\nmale employees': 1 - portion_female}, index=years)
+
+    return [
+        RenderJob(_render_employees_earn_more_than_managers_by_year,
+                  {'years': years, 'n_employees_earn_more_than_managers_for_year': n_employees_earn_more_than_managers.values},
+                  'employees_earn_more_than_managers_by_year.svg'),
+        RenderJob(_render_employees_earn_more_than_managers_by_year_by_dept,
+                  {'years': years, 'dept_names': dept_names, 'heatmap_data': n_employees_earn_more_than_managers_by_dept.values},
+                  'employees_earn_more_than_managers_by_year_by_dept.svg'),
+        RenderJob(_render_annotated_stacked_port_barh_plot, {'df': df}, 'female_employee_portions_earn_more_than_managers.svg')
+    ]
+
+
+def _render_employees_earn_more_than_managers_by_year(save_path, years, n_employees_earn_more_than_managers_for_year):
+    plt.figure()
     plt.bar(years, n_employees_earn_more_than_managers_for_year, color='skyblue')
     plt.xticks(years, rotation='65')
     plt.ylabel('Number of employees earning more than their managers')
-    plt.savefig(os.path.join(res_dir_path, 'employees_earn_more_than_managers_by_year.svg'))
-    plt.clf()
+    plt.savefig(save_path)
 
-    # draw heatmap of employees that earn more than their managers wrt. year and department
-    dept_names = res_container.get_res('dept_names')
-    heatmap_data = [[0 for _ in range(len(years))] for _ in range(len(dept_names))]
-    for i, year in enumerate(years):
-        for j, dept_name in enumerate(dept_names):
-            heatmap_data[j][i] = res_container.get_res('n_employees_earn_more_than_managers_{0}_{1}'.format(year, dept_name))
 
-    # draw heatmap
+def _render_employees_earn_more_than_managers_by_year_by_dept(save_path, years, dept_names, heatmap_data):
     fig, ax = plt.subplots()
     ax.imshow(heatmap_data)
     ax.set_xticks(range(len(years)), labels=years)
@@ -160,27 +197,21 @@ def get_vis_analysis4(res_container):
     plt.setp(ax.get_xticklabels(), rotation=45, ha="right",
              rotation_mode="anchor")
     fig.tight_layout()
-    plt.savefig(os.path.join(res_dir_path, 'employees_earn_more_than_managers_by_year_by_dept.svg'))
-    plt.clf()
+    fig.savefig(save_path)
 
-    # draw stacked horizontal bar plot for ratios of female employees that earn more than their managers wrt. year
-    df = pd.DataFrame({k: [p, 1 - p] for k in years
-                       for p in
-                       [res_container.get_res('n_female_earn_more_than_managers_{0}'.format(k)) /
-                        res_container.get_res('n_employees_earn_more_than_managers_{0}'.format(k))]}).T
 
-    df.columns = ['Portion\nfemale employees', 'Portion\nmale employees']
-    get_annotated_stacked_port_barh_plot(df, os.path.join(res_dir_path, 'female_employee_portions_earn_more_than_managers.svg'))
-
-
-def get_vis_analysis5(res_container):
+def get_vis_analysis5(res_container, output_dir=None):
     """Task instructions: Find the most successful department (with highest mean salaries) and chart its characteristics (distribution of titles, salaries, genders, ...).
     Compare this chart with charts from other departments and hypothesize on reasons for success.
 
     :param res_container: ResContainer instance containing the results to plot
+    :param output_dir: directory in which to save the results (the results directory in this package if None)
     """
     logger.info('Obtaining visualizations for 5. task')
+    run_render_jobs(get_render_jobs_analysis5(res_container), output_dir)
+
 
+def get_render_jobs_analysis5(res_container):
     # mapping of keys of the results container to the names of rows in the output table
     res_container_key_to_row_name = {
         'portion_female': 'Portion female employees',
@@ -189,19 +220,106 @@ def get_vis_analysis5(res_container):
         'number_senior_engineer': 'Number of senior engineers',
         'portion_senior': 'Portion senior employees'
     }
+    row_name_to_res = {res_container_key_to_row_name[k]: tuple(res_container.get_res(k)) for k in res_container_key_to_row_name.keys()}
+    return [RenderJob(_render_latex_table_analysis5, {'row_name_to_res': row_name_to_res}, 'latex_table_analysis5.tex')]
 
-    # path to results directory
-    res_dir_path = os.path.join(os.path.dirname(__file__), 'results/')
 
+def _render_latex_table_analysis5(save_path, row_name_to_res):
     # get table for the computed stats
-    data_df = pd.DataFrame([pd.Series(res_container.get_res(k), name=res_container_key_to_row_name[k]) for k in res_container_key_to_row_name.keys()])
+    data_df = pd.DataFrame([pd.Series(res, name=row_name) for row_name, res in row_name_to_res.items()])
     sort_col = 'corr. coefficient'
     data_df.columns = [sort_col, 'p-value']
-    with open(os.path.join(res_dir_path, 'latex_table_analysis5.tex'), 'w') as f:
+    with open(save_path, 'w') as f:
         latex_output_str = data_df.sort_values(by=[sort_col]).style.to_latex(hrules=True, column_format='l|' + 'l' * data_df.shape[1])
         f.write(latex_output_str.replace('\\\\', '\\\\ \\hline', 1))
 
 
+def render_all(analysis_to_res_container, output_dir=None, processes=None):
+    """Produce the visualizations for several analyses, running the render jobs in a pool of processes.
+
+    :param analysis_to_res_container: map of analysis numbers (1-5) to ResContainer instances containing the results to plot
+    :param output_dir: directory in which to save the results (the results directory in this package if None)
+    :param processes: number of processes (number of CPUs if None, jobs run in the calling process if 1)
+    :return: list of paths of the produced files
+    """
+    jobs = [job for analysis in sorted(analysis_to_res_container.keys()) for job in get_render_jobs(analysis, analysis_to_res_container[analysis])]
+
+    if processes == 1:
+        return run_render_jobs(jobs, output_dir)
+
+    logger.info('Rendering {0} visualizations in a pool of processes'.format(len(jobs)))
+    with get_render_pool(processes) as pool:
+        return list(pool.map(run_render_job, jobs, [output_dir] * len(jobs)))
+
+
+def get_render_jobs(analysis, res_container):
+    """Get the render jobs of an analysis.
+
+    :param analysis: number of the analysis (1-5)
+    :param res_container: ResContainer instance containing the results of the analysis
+    :return: list of RenderJob instances
+    """
+    analysis_to_get_render_jobs = {
+        1: get_render_jobs_analysis1,
+        2: get_render_jobs_analysis2,
+        3: get_render_jobs_analysis3,
+        4: get_render_jobs_analysis4,
+        5: get_render_jobs_analysis5,
+    }
+    return analysis_to_get_render_jobs[analysis](res_container)
+
+
+def get_render_pool(processes=None):
+    """Get a pool of processes running render jobs (see run_render_job).
+
+    :param processes: number of processes (number of CPUs if None)
+    :return: ProcessPoolExecutor instance
+    """
+    return concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=_init_render_process)
+
+
+def run_render_jobs(jobs, output_dir=None):
+    """Run render jobs one after another in the calling process.
+
+    :param jobs: list of RenderJob instances
+    :param output_dir: directory in which to save the results (the results directory in this package if None)
+    :return: list of paths of the produced files
+    """
+    return [run_render_job(job, output_dir) for job in jobs]
+
+
+def run_render_job(job, output_dir=None):
+    """Run a render job, writing its output atomically.
+
+    :param job: RenderJob instance
+    :param output_dir: directory in which to save the result (the results directory in this package if None)
+    :return: path of the produced file
+    """
+    output_dir = output_dir if output_dir is not None else os.path.join(os.path.dirname(__file__), 'results')
+    os.makedirs(output_dir, exist_ok=True)
+    save_path = os.path.join(output_dir, job.file_name)
+
+    # the temporary file keeps the extension so that the output format is inferred from it
+    tmp_path = os.path.join(output_dir, '.tmp-{0}-{1}'.format(uuid.uuid4().hex, job.file_name))
+    try:
+        job.render(tmp_path, **job.kwargs)
+        os.replace(tmp_path, save_path)
+    finally:
+        plt.close('all')
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return save_path
+
+
+def _init_render_process():
+    matplotlib.use('Agg')
+
+
+def _render_annotated_stacked_port_barh_plot(save_path, df, font_size=None):
+    with plt.rc_context({'font.size': font_size} if font_size is not None else {}):
+        get_annotated_stacked_port_barh_plot(df, save_path)
+
+
 def get_annotated_stacked_port_barh_plot(df, save_path):
     """
     Get horizontal stacked bar plot for portions
@@ -0,0 +1,7 @@
+import logging
+
+# module logger
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
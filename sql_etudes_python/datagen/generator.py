@@ -0,0 +1,270 @@
+import datetime
+
+import numpy as np
+
+"""
+Generator of synthetic data for the employees schema that is statistically similar to the employees sample database
+(see db-init/build-scripts/employees.sql). The data is generated in chunks of employees, each chunk from its own seeded
+random generator, so that the chunks can be generated (and loaded) in parallel and the result does not depend on the
+number of processes.
+
+The intervals of each employee are temporally consistent: the department, title and salary intervals partition the
+employment of the employee (from the hire date to the date the employee left the company or to 9999-01-01 for current
+employees), the departments and titles change at most a few times and the salaries are updated yearly. The department
+managers (which are chosen from the employees of the first chunk) work in the departments they manage for the whole time
+they manage them.
+
+The distributions are described by a parameters dictionary (see DEFAULT_PARAMETERS) that can also be fitted to an
+existing database with fit_parameters.
+"""
+
+# dates are represented as numbers of days since 1970-01-01
+END_DATE = (datetime.date(2002, 8, 1) - datetime.date(1970, 1, 1)).days
+CURRENT_DATE = (datetime.date(9999, 1, 1) - datetime.date(1970, 1, 1)).days
+FIRST_HIRE_DATE = (datetime.date(1985, 1, 1) - datetime.date(1970, 1, 1)).days
+
+DEPARTMENTS = [
+    ('d001', 'Marketing'),
+    ('d002', 'Finance'),
+    ('d003', 'Human Resources'),
+    ('d004', 'Production'),
+    ('d005', 'Development'),
+    ('d006', 'Quality Management'),
+    ('d007', 'Sales'),
+    ('d008', 'Research'),
+    ('d009', 'Customer Service'),
+]
+
+TITLES = ['Staff', 'Senior Staff', 'Engineer', 'Senior Engineer', 'Assistant Engineer', 'Technique Leader', 'Manager']
+
+# title an employee is promoted to from a title
+PROMOTIONS = {'Staff': 'Senior Staff', 'Engineer': 'Senior Engineer', 'Assistant Engineer': 'Engineer'}
+
+# number of employees in the employees sample database
+SAMPLE_N_EMPLOYEES = 300024
+
+# parameters approximating the employees sample database
+DEFAULT_PARAMETERS = {
+    'portion_female': 0.4,
+    # relative sizes of the departments (in the order of DEPARTMENTS)
+    'dept_weights': [20211, 17346, 17786, 73485, 85707, 20117, 52245, 21126, 23580],
+    # relative numbers of employees hired in the years from 1985 on
+    'hire_year_weights': [35316, 36150, 33501, 31436, 28394, 25610, 22568, 20402, 17772, 14835, 12115, 9574, 6669, 4155, 1514, 13],
+    # relative numbers of employees starting with the titles (in the order of TITLES)
+    'start_title_weights': [0.30, 0.10, 0.35, 0.15, 0.05, 0.05, 0.0],
+    'portion_promoted': 0.5,
+    'mean_years_to_promotion': 7.0,
+    'portion_left': 0.1,
+    'portion_changed_dept': 0.1,
+    'start_salary_mean': 52000.0,
+    'start_salary_std': 9000.0,
+    'min_salary': 38623,
+    'raise_mean': 0.03,
+    'raise_std': 0.015,
+}
+
+
+def get_n_employees(scale):
+    """Get the number of employees for a scale relative to the employees sample database."""
+    return int(round(SAMPLE_N_EMPLOYEES * scale))
+
+
+def generate_chunk(chunk_index, chunk_size, n_employees, seed=0, parameters=None):
+    """Generate the rows of the employees, dept_emp, titles and salaries tables for a chunk of employees.
+
+    :param chunk_index: index of the chunk
+    :param chunk_size: number of employees in each chunk
+    :param n_employees: total number of employees
+    :param seed: seed of the random generators
+    :param parameters: parameters dictionary (DEFAULT_PARAMETERS if None)
+    :return: map of table names to maps of column names to NumPy arrays (dates as numbers of days since 1970-01-01)
+    """
+    p = parameters if parameters is not None else DEFAULT_PARAMETERS
+    rng = np.random.default_rng([seed, 0, chunk_index])
+    first = chunk_index * chunk_size
+    n = max(min(chunk_size, n_employees - first), 0)
+    emp_no = np.arange(10001 + first, 10001 + first + n, dtype=np.int64)
+
+    # employees
+    hire_year = 1985 + rng.choice(len(p['hire_year_weights']), size=n, p=_normalize(p['hire_year_weights']))
+    hire_date = _to_days(hire_year) + rng.integers(0, 365, size=n)
+    hire_date = np.minimum(hire_date, END_DATE - 1)
+    birth_date = _to_days(np.full(n, 1952)) + rng.integers(0, 13 * 365, size=n)
+    gender = np.where(rng.random(n) < p['portion_female'], 'F', 'M')
+    first_name_idx, last_name_idx = rng.integers(0, len(_FIRST_NAMES), size=n), rng.integers(0, len(_LAST_NAMES), size=n)
+
+    # the employees that left the company leave between their hire date and the end of the data
+    left = rng.random(n) < p['portion_left']
+    leave_date = hire_date + 1 + (rng.random(n) * (END_DATE - hire_date - 1)).astype(np.int64)
+    end_date = np.where(left, leave_date, CURRENT_DATE)
+    last_date = np.minimum(end_date, END_DATE)
+
+    # departments (at most one change)
+    dept = rng.choice(len(DEPARTMENTS), size=n, p=_normalize(p['dept_weights']))
+    changed_dept = (rng.random(n) < p['portion_changed_dept']) & (last_date - hire_date > 2)
+    change_date = hire_date + 1 + (rng.random(n) * (last_date - hire_date - 2)).astype(np.int64)
+    other_dept = (dept + rng.integers(1, len(DEPARTMENTS), size=n)) % len(DEPARTMENTS)
+    dept_emp = _concat_intervals([
+        (emp_no, dept, hire_date, np.where(changed_dept, change_date, end_date), np.ones(n, dtype=bool)),
+        (emp_no, other_dept, change_date, end_date, changed_dept),
+    ])
+
+    # titles (at most one promotion)
+    title = rng.choice(len(TITLES), size=n, p=_normalize(p['start_title_weights']))
+    promotion_title = np.array([TITLES.index(PROMOTIONS.get(t, t)) for t in TITLES])[title]
+    promotion_date = hire_date + (rng.exponential(p['mean_years_to_promotion'], size=n) * 365).astype(np.int64)
+    promoted = (rng.random(n) < p['portion_promoted']) & (promotion_title != title) & (promotion_date > hire_date) & (promotion_date < last_date)
+    titles = _concat_intervals([
+        (emp_no, title, hire_date, np.where(promoted, promotion_date, end_date), np.ones(n, dtype=bool)),
+        (emp_no, promotion_title, promotion_date, end_date, promoted),
+    ])
+
+    # salaries (updated yearly, the last salary lasts until the employee left or is current)
+    n_salaries = np.maximum((last_date - hire_date + 364) // 365, 1)
+    salary_emp_idx = np.repeat(np.arange(n), n_salaries)
+    period = np.arange(len(salary_emp_idx)) - np.repeat(np.cumsum(n_salaries) - n_salaries, n_salaries)
+    log_raise = np.log1p(np.maximum(rng.normal(p['raise_mean'], p['raise_std'], size=len(salary_emp_idx)), 0.0))
+    log_raise[period == 0] = 0.0
+    cum_log_raise = np.cumsum(log_raise)
+    cum_log_raise -= np.repeat(cum_log_raise[np.cumsum(n_salaries) - n_salaries], n_salaries)
+    start_salary = np.maximum(rng.normal(p['start_salary_mean'], p['start_salary_std'], size=n), p['min_salary'])
+    salary_from = hire_date[salary_emp_idx] + period * 365
+    is_last = period == n_salaries[salary_emp_idx] - 1
+    salaries = {
+        'emp_no': emp_no[salary_emp_idx],
+        'salary': (start_salary[salary_emp_idx] * np.exp(cum_log_raise)).astype(np.int64),
+        'from_date': salary_from,
+        'to_date': np.where(is_last, end_date[salary_emp_idx], salary_from + 365),
+    }
+
+    return {
+        'employees': {
+            'emp_no': emp_no,
+            'birth_date': birth_date,
+            'first_name': np.array(_FIRST_NAMES)[first_name_idx],
+            'last_name': np.array(_LAST_NAMES)[last_name_idx],
+            'gender': gender,
+            'hire_date': hire_date,
+        },
+        'dept_emp': {
+            'emp_no': dept_emp['emp_no'],
+            'dept_no': np.array([d for d, _ in DEPARTMENTS])[dept_emp['value']],
+            'from_date': dept_emp['from_date'],
+            'to_date': dept_emp['to_date'],
+        },
+        'titles': {
+            'emp_no': titles['emp_no'],
+            'title': np.array(TITLES)[titles['value']],
+            'from_date': titles['from_date'],
+            'to_date': titles['to_date'],
+        },
+        'salaries': salaries,
+    }
+
+
+def generate_dept_manager(chunk, seed=0):
+    """Generate the rows of the dept_manager table choosing the managers from the employees of a chunk.
+
+    Each department gets 2-4 managers with consecutive intervals (the last one is current). A manager is chosen among the
+    employees working in the department for the whole interval (the first manager of a department is chosen among the
+    employees that started working in it in 1985 and manages it from then on). If there is no such employee (e.g. for
+    very small chunks), the department has no further managers.
+
+    :param chunk: chunk as returned by generate_chunk
+    :param seed: seed of the random generator
+    :return: map of column names to NumPy arrays
+    """
+    rng = np.random.default_rng([seed, 1, 0])
+    dept_emp = chunk['dept_emp']
+    rows = []
+    for dept_no, _ in DEPARTMENTS:
+        n_managers = rng.integers(2, 5)
+        boundaries = [FIRST_HIRE_DATE] + sorted(rng.integers(FIRST_HIRE_DATE + 365, END_DATE - 365, size=n_managers - 1).tolist()) + [CURRENT_DATE]
+        dept_rows = []
+        for from_date, to_date in zip(boundaries[:-1], boundaries[1:]):
+            latest_start = from_date if dept_rows else from_date + 365
+            chosen = {r[1] for r in dept_rows}
+            candidates = [(e, f) for e, d, f, t in zip(dept_emp['emp_no'], dept_emp['dept_no'], dept_emp['from_date'], dept_emp['to_date'])
+                          if d == dept_no and f <= latest_start and t >= to_date and e not in chosen]
+            if not candidates:
+                break
+            emp_no, start = candidates[rng.integers(len(candidates))]
+            dept_rows.append([dept_no, int(emp_no), max(from_date, int(start)), to_date])
+        rows += dept_rows
+    return {
+        'dept_no': np.array([r[0] for r in rows]),
+        'emp_no': np.array([r[1] for r in rows], dtype=np.int64),
+        'from_date': np.array([r[2] for r in rows], dtype=np.int64),
+        'to_date': np.array([r[3] for r in rows], dtype=np.int64),
+    }
+
+
+def fit_parameters(curs):
+    """Fit the parameters of the generator to the data in a database.
+
+    :param curs: psycopg2 cursor
+    :return: parameters dictionary
+    """
+    parameters = dict(DEFAULT_PARAMETERS)
+
+    curs.execute("SELECT avg((gender = 'F')::int) FROM employees.employees")
+    parameters['portion_female'] = float(curs.fetchone()[0])
+
+    curs.execute('SELECT dept_no, count(DISTINCT emp_no) FROM employees.dept_emp GROUP BY dept_no')
+    dept_no_to_count = dict(curs.fetchall())
+    parameters['dept_weights'] = [float(dept_no_to_count.get(dept_no, 0)) for dept_no, _ in DEPARTMENTS]
+
+    curs.execute('SELECT EXTRACT(YEAR FROM hire_date)::int, count(*) FROM employees.employees GROUP BY 1')
+    year_to_count = dict(curs.fetchall())
+    parameters['hire_year_weights'] = [float(year_to_count.get(1985 + i, 0)) for i in range(len(DEFAULT_PARAMETERS['hire_year_weights']))]
+
+    curs.execute("""SELECT DISTINCT ON (emp_no) emp_no, title FROM employees.titles ORDER BY emp_no, from_date""")
+    title_to_count = dict()
+    for _, title in curs.fetchall():
+        title_to_count[title] = title_to_count.get(title, 0) + 1
+    # managers are chosen separately
+    parameters['start_title_weights'] = [float(title_to_count.get(t, 0)) if t != 'Manager' else 0.0 for t in TITLES]
+
+    curs.execute("SELECT avg((max_to_date <> '9999-01-01')::int) FROM (SELECT max(to_date) AS max_to_date FROM employees.dept_emp GROUP BY emp_no) t")
+    parameters['portion_left'] = float(curs.fetchone()[0])
+    curs.execute('SELECT avg((n > 1)::int) FROM (SELECT count(*) AS n FROM employees.dept_emp GROUP BY emp_no) t')
+    parameters['portion_changed_dept'] = float(curs.fetchone()[0])
+    curs.execute('SELECT avg((n > 1)::int) FROM (SELECT count(*) AS n FROM employees.titles GROUP BY emp_no) t')
+    parameters['portion_promoted'] = float(curs.fetchone()[0])
+
+    curs.execute("""SELECT avg(salary), stddev_pop(salary), min(salary)
+                    FROM (SELECT DISTINCT ON (emp_no) salary FROM employees.salaries ORDER BY emp_no, from_date) t""")
+    mean, std, min_salary = curs.fetchone()
+    parameters['start_salary_mean'], parameters['start_salary_std'], parameters['min_salary'] = float(mean), float(std or 0.0), int(min_salary)
+
+    curs.execute("""SELECT avg(r), stddev_pop(r) FROM (
+                        SELECT salary::float / lag(salary) OVER (PARTITION BY emp_no ORDER BY from_date) - 1 AS r
+                        FROM employees.salaries) t
+                    WHERE r IS NOT NULL""")
+    raise_mean, raise_std = curs.fetchone()
+    if raise_mean is not None:
+        parameters['raise_mean'], parameters['raise_std'] = float(raise_mean), float(raise_std or 0.0)
+    return parameters
+
+
+def _normalize(weights):
+    weights = np.asarray(weights, dtype=np.float64)
+    return weights / weights.sum()
+
+
+def _to_days(years):
+    # numbers of days from 1970-01-01 to the first days of the years
+    return (np.asarray(years) - 1970).astype('datetime64[Y]').astype('datetime64[D]').astype(np.int64)
+
+
+def _concat_intervals(parts):
+    # concatenate the (emp_no, value, from_date, to_date) intervals selected by the masks and order them by employee and start
+    emp_no, value, from_date, to_date = [np.concatenate([part[i][part[4]] for part in parts]) for i in range(4)]
+    order = np.lexsort((from_date, emp_no))
+    return {'emp_no': emp_no[order], 'value': value[order], 'from_date': from_date[order], 'to_date': to_date[order]}
+
+
+_FIRST_NAMES = ['Georgi', 'Bezalel', 'Parto', 'Chirstian', 'Kyoichi', 'Anneke', 'Tzvetan', 'Saniya', 'Sumant', 'Duangkaew',
+                'Mary', 'Patricio', 'Eberhardt', 'Berni', 'Guoxiang', 'Kazuhito', 'Cristinel', 'Kazuhide', 'Lillian', 'Mayuko']
+_LAST_NAMES = ['Facello', 'Simmel', 'Bamford', 'Koblick', 'Maliniak', 'Preusig', 'Zielinski', 'Kalloufi', 'Peac', 'Piveteau',
+               'Sluis', 'Bridgland', 'Terkki', 'Genin', 'Nooteboom', 'Cappelletti', 'Bouloucos', 'Peha', 'Haddadi', 'Warwick']
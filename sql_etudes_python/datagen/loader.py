@@ -0,0 +1,246 @@
+import concurrent.futures
+import io
+import os
+
+import psycopg2
+from sqlalchemy.engine import make_url
+
+from sql_etudes_python.datagen import generator
+from sql_etudes_python.datagen import logger
+
+"""
+Bulk loader of the synthetic data (see generator.py in the same package) into a new database. The tables are created
+without constraints and indexes, the chunks of employees are generated and streamed into the tables with COPY FROM STDIN
+in parallel processes (each with its own connection) and the primary keys, indexes and foreign keys are built after the
+data is loaded (in parallel connections, one per table). The database is populated under a temporary name and renamed
+when done, so that interrupted loads are not mistaken for complete databases.
+"""
+
+# number of rows streamed per read of the COPY input
+_COPY_BATCH_SIZE = 10000
+
+# number of characters sent to the server per message during COPY
+_COPY_READ_SIZE = 1 << 20
+
+_DATE_COLUMNS = {'birth_date', 'hire_date', 'from_date', 'to_date'}
+
+# schema of db-init/build-scripts/employees.sql without the constraints and indexes
+_CREATE_TABLES = """
+CREATE SCHEMA employees;
+SET SCHEMA 'employees';
+
+CREATE TYPE gender AS ENUM('M', 'F');
+
+CREATE TABLE employees (
+    emp_no      INT             NOT NULL,
+    birth_date  DATE            NOT NULL,
+    first_name  VARCHAR(14)     NOT NULL,
+    last_name   VARCHAR(16)     NOT NULL,
+    gender      gender          NULL,
+    hire_date   DATE            NOT NULL
+);
+
+CREATE TABLE departments (
+    dept_no     CHAR(4)         NOT NULL,
+    dept_name   VARCHAR(40)     NOT NULL
+);
+
+CREATE TABLE dept_manager (
+   dept_no      CHAR(4)         NOT NULL,
+   emp_no       INT             NOT NULL,
+   from_date    DATE            NOT NULL,
+   to_date      DATE            NOT NULL
+);
+
+CREATE TABLE dept_emp (
+    emp_no      INT             NOT NULL,
+    dept_no     CHAR(4)         NOT NULL,
+    from_date   DATE            NOT NULL,
+    to_date     DATE            NOT NULL
+);
+
+CREATE TABLE titles (
+    emp_no      INT             NOT NULL,
+    title       VARCHAR(50)     NOT NULL,
+    from_date   DATE            NOT NULL,
+    to_date     DATE
+);
+
+CREATE TABLE salaries (
+    emp_no      INT             NOT NULL,
+    salary      INT             NOT NULL,
+    from_date   DATE            NOT NULL,
+    to_date     DATE            NOT NULL
+);
+"""
+
+# primary keys and indexes (one list of statements per table, the lists are executed in parallel)
+_CREATE_INDEXES = [
+    ['ALTER TABLE employees.employees ADD PRIMARY KEY (emp_no)'],
+    ['ALTER TABLE employees.departments ADD PRIMARY KEY (dept_no)',
+     'ALTER TABLE employees.departments ADD UNIQUE (dept_name)'],
+    ['ALTER TABLE employees.dept_manager ADD PRIMARY KEY (emp_no, dept_no)',
+     'CREATE INDEX dept_manager_dept_no_idx ON employees.dept_manager(dept_no)'],
+    ['ALTER TABLE employees.dept_emp ADD PRIMARY KEY (emp_no, dept_no)',
+     'CREATE INDEX dept_emp_dept_no_idx ON employees.dept_emp(dept_no)'],
+    ['ALTER TABLE employees.titles ADD PRIMARY KEY (emp_no, title, from_date)'],
+    ['ALTER TABLE employees.salaries ADD PRIMARY KEY (emp_no, from_date)'],
+]
+
+# foreign keys (added after all the primary keys exist, one list of statements per table)
+_CREATE_FOREIGN_KEYS = [
+    ['ALTER TABLE employees.dept_manager ADD FOREIGN KEY (emp_no) REFERENCES employees.employees (emp_no) ON DELETE CASCADE',
+     'ALTER TABLE employees.dept_manager ADD FOREIGN KEY (dept_no) REFERENCES employees.departments (dept_no) ON DELETE CASCADE'],
+    ['ALTER TABLE employees.dept_emp ADD FOREIGN KEY (emp_no) REFERENCES employees.employees (emp_no) ON DELETE CASCADE',
+     'ALTER TABLE employees.dept_emp ADD FOREIGN KEY (dept_no) REFERENCES employees.departments (dept_no) ON DELETE CASCADE'],
+    ['ALTER TABLE employees.titles ADD FOREIGN KEY (emp_no) REFERENCES employees.employees (emp_no) ON DELETE CASCADE'],
+    ['ALTER TABLE employees.salaries ADD FOREIGN KEY (emp_no) REFERENCES employees.employees (emp_no) ON DELETE CASCADE'],
+]
+
+# columns of the tables in the order in which they are copied
+_TABLE_COLUMNS = {
+    'employees': ['emp_no', 'birth_date', 'first_name', 'last_name', 'gender', 'hire_date'],
+    'dept_emp': ['emp_no', 'dept_no', 'from_date', 'to_date'],
+    'dept_manager': ['emp_no', 'dept_no', 'from_date', 'to_date'],
+    'titles': ['emp_no', 'title', 'from_date', 'to_date'],
+    'salaries': ['emp_no', 'salary', 'from_date', 'to_date'],
+}
+
+
+def load(dsn, n_employees, seed=0, parameters=None, chunk_size=50000, processes=None, recreate=False):
+    """Create a database and populate it with synthetic data.
+
+    :param dsn: database URL of the database to create
+    :param n_employees: number of employees
+    :param seed: seed of the random generators
+    :param parameters: parameters dictionary of the generator (generator.DEFAULT_PARAMETERS if None)
+    :param chunk_size: number of employees generated and copied at a time
+    :param processes: number of processes generating and copying the chunks (number of CPUs if None)
+    :param recreate: if True, recreate the database if it exists
+    :return: True if the database was created, False if it existed
+    """
+    url = make_url(dsn)
+    tmp_url = url.set(database=url.database + '_tmp')
+    admin_conn = psycopg2.connect(_to_psycopg2_dsn(url.set(database='postgres')))
+    try:
+        admin_conn.autocommit = True
+        with admin_conn.cursor() as curs:
+            curs.execute('SELECT 1 FROM pg_database WHERE datname = %(name)s', {'name': url.database})
+            if curs.fetchone() is not None and not recreate:
+                return False
+            curs.execute('DROP DATABASE IF EXISTS "{0}"'.format(tmp_url.database))
+            curs.execute('CREATE DATABASE "{0}"'.format(tmp_url.database))
+
+        tmp_dsn = _to_psycopg2_dsn(tmp_url)
+        _load(tmp_dsn, n_employees, seed, parameters, chunk_size, processes)
+
+        with admin_conn.cursor() as curs:
+            curs.execute('DROP DATABASE IF EXISTS "{0}"'.format(url.database))
+            curs.execute('ALTER DATABASE "{0}" RENAME TO "{1}"'.format(tmp_url.database, url.database))
+    finally:
+        admin_conn.close()
+    return True
+
+
+def _load(dsn, n_employees, seed, parameters, chunk_size, processes):
+    with psycopg2.connect(dsn) as conn:
+        with conn.cursor() as curs:
+            curs.execute(_CREATE_TABLES)
+            curs.executemany('INSERT INTO employees.departments (dept_no, dept_name) VALUES (%s, %s)', generator.DEPARTMENTS)
+    conn.close()
+
+    n_chunks = (n_employees + chunk_size - 1) // chunk_size
+    logger.info('Loading {0} employees in {1} chunks'.format(n_employees, n_chunks))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes or os.cpu_count()) as executor:
+        futures = [executor.submit(_load_chunk, dsn, i, chunk_size, n_employees, seed, parameters) for i in range(n_chunks)]
+        for future in concurrent.futures.as_completed(futures):
+            chunk_index, table_to_n_rows = future.result()
+            logger.info('Loaded chunk {0}/{1} ({2})'.format(
+                chunk_index + 1, n_chunks, ', '.join('{0}: {1}'.format(t, n) for t, n in table_to_n_rows.items())))
+
+    # the managers are chosen among the employees of the first chunk
+    first_chunk = generator.generate_chunk(0, chunk_size, n_employees, seed, parameters)
+    with psycopg2.connect(dsn) as conn:
+        with conn.cursor() as curs:
+            _copy(curs, 'dept_manager', generator.generate_dept_manager(first_chunk, seed))
+    conn.close()
+
+    logger.info('Building the primary keys and indexes')
+    _execute_parallel(dsn, _CREATE_INDEXES)
+    logger.info('Building the foreign keys')
+    _execute_parallel(dsn, _CREATE_FOREIGN_KEYS)
+    _execute_parallel(dsn, [['ANALYZE']])
+
+
+def _load_chunk(dsn, chunk_index, chunk_size, n_employees, seed, parameters):
+    chunk = generator.generate_chunk(chunk_index, chunk_size, n_employees, seed, parameters)
+    table_to_n_rows = dict()
+    with psycopg2.connect(dsn) as conn:
+        with conn.cursor() as curs:
+            for table_name, columns in chunk.items():
+                table_to_n_rows[table_name] = _copy(curs, table_name, columns)
+    conn.close()
+    return chunk_index, table_to_n_rows
+
+
+def _copy(curs, table_name, columns):
+    column_names = _TABLE_COLUMNS[table_name]
+    curs.copy_expert('COPY employees.{0} ({1}) FROM STDIN'.format(table_name, ', '.join(column_names)),
+                     _IteratorFile(_iter_copy_lines([(c, columns[c]) for c in column_names])), size=_COPY_READ_SIZE)
+    return curs.rowcount
+
+
+def _iter_copy_lines(columns):
+    # lines of the text COPY format, formatted in batches (dates are converted from numbers of days since 1970-01-01)
+    n_rows = len(columns[0][1])
+    for start in range(0, n_rows, _COPY_BATCH_SIZE):
+        batch = [_format_column(name, a[start:start + _COPY_BATCH_SIZE]) for name, a in columns]
+        yield ''.join('\t'.join(row) + '\n' for row in zip(*batch))
+
+
+def _format_column(name, values):
+    if name in _DATE_COLUMNS:
+        values = values.astype('datetime64[D]')
+    return values.astype(str).tolist()
+
+
+class _IteratorFile(io.TextIOBase):
+    """File-like object reading from an iterator of strings (used as the input of COPY FROM STDIN)."""
+
+    def __init__(self, it):
+        self._it = it
+        self._buffer = ''
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._it)
+            except StopIteration:
+                break
+        if size < 0:
+            res, self._buffer = self._buffer, ''
+        else:
+            res, self._buffer = self._buffer[:size], self._buffer[size:]
+        return res
+
+
+def _execute_parallel(dsn, statement_lists):
+    def execute(statements):
+        conn = psycopg2.connect(dsn)
+        try:
+            conn.autocommit = True
+            with conn.cursor() as curs:
+                for statement in statements:
+                    curs.execute(statement)
+        finally:
+            conn.close()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(statement_lists)) as executor:
+        list(executor.map(execute, statement_lists))
+
+
+def _to_psycopg2_dsn(url):
+    return url.set(drivername='postgresql').render_as_string(hide_password=False)
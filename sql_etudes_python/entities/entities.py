@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, ForeignKey
+from sqlalchemy import Column, Integer, String, Date, ForeignKey, Boolean
 from sqlalchemy.orm import declarative_base, relationship
 
 # base classes ###
@@ -70,3 +70,31 @@ class Title(Base, TableSchema):
     title = Column(String)
     from_date = Column(Date)
     to_date = Column(Date)
+
+
+# current_employees (materialized view with one row per current employee, see the current_state.py script in the manager package)
+class CurrentEmployee(Base, TableSchema):
+    __tablename__ = 'current_employees'
+    emp_no = Column(Integer, ForeignKey('employees.employees.emp_no'), primary_key=True)
+    employee = relationship('Employee')
+    gender = Column(String)
+    dept_no = Column(String, ForeignKey('employees.departments.dept_no'))
+    dept = relationship('Department')
+    title = Column(String)
+    salary = Column(Integer)
+    is_manager = Column(Boolean)
+
+
+# employee_year (materialized view with one row per employee and year, see the employee_year_manager.py script in the manager package)
+class EmployeeYear(Base, TableSchema):
+    __tablename__ = 'employee_year'
+    emp_no = Column(Integer, ForeignKey('employees.employees.emp_no'), primary_key=True)
+    employee = relationship('Employee')
+    year = Column(Integer, primary_key=True)
+    gender = Column(String)
+    dept_no = Column(String, ForeignKey('employees.departments.dept_no'))
+    dept = relationship('Department')
+    title = Column(String)
+    salary = Column(Integer)
+    is_manager = Column(Boolean)
+    manager_salary = Column(Integer)
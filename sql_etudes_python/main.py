@@ -1,30 +1,340 @@
-from sql_etudes_python.data_analysis import analysis, visualization
+import argparse
+import contextlib
+import cProfile
+import os
+import pstats
+import sys
+
+from sql_etudes_python.data_analysis import analysis
 from sql_etudes_python.data_analysis import analysis_psycopg2
+from sql_etudes_python.data_analysis import analysis_snapshot
+from sql_etudes_python.data_analysis import incremental
+from sql_etudes_python.data_analysis import logger
+from sql_etudes_python.data_analysis import pipeline
+from sql_etudes_python.data_analysis import result_cache
+from sql_etudes_python.manager import configure
+from sql_etudes_python.manager import current_state
+from sql_etudes_python.manager import department_manager
+from sql_etudes_python.manager import instrumentation
+from sql_etudes_python.manager import salary_manager
+from sql_etudes_python.manager import snapshot
+from sql_etudes_python.manager import table_cache
+from sql_etudes_python.manager import title_manager
 
 """Main script used to produce the data needed for the analysis and visualize it.
 
+The analyses are run with the ORM (analysis.py), psycopg2 (analysis_psycopg2.py) or snapshot (analysis_snapshot.py)
+backend. Analyses not provided by the selected backend are run with the ORM or psycopg2 backend that provides them
+(the 4. analysis is only provided by the psycopg2 and snapshot backends and the 5. analysis only by the ORM backend).
+The psycopg2 backend prints the results of the 1. analysis instead of returning them, so they are not visualized.
+
+The analyses and visualizations run as nodes of a pipeline (see pipeline.py in the data_analysis package): the inputs
+shared by the analyses (the titles, departments, years and the snapshot) are fetched once by data nodes, the analyses run
+concurrently (at most --workers at the same time) as soon as their inputs are fetched and the visualizations of each
+analysis are rendered in a pool of processes as soon as the analysis is done. With --profile, the nodes run one after
+another and the profiles of the nodes are merged.
+
+The caches (the result cache, see result_cache.py in the data_analysis package, the table cache of the snapshot, see
+table_cache.py in the manager package, and the current employees materialized view, see current_state.py in the manager
+package) are configured with their environment variables unless given with --caches (the given caches are enabled and
+the others disabled). The result cache is disabled unless enabled explicitly. With --clear-caches, the cached results,
+the cached tables and the stored results of the incremental mode are removed before the analyses are run.
+
+The dry run prints the number of queries planned for each analysis (computed from the numbers of titles, departments and
+years, which are queried) without running the analyses. The shared inputs are counted once. The numbers are upper
+bounds, as the cached results, the cached tables of the snapshot and the unchanged years in the incremental mode (see
+incremental.py in the data_analysis package) are not queried. The queries checking whether the materialized views exist
+(once per process) are not counted.
+
 See the README.md in the project root folder for more information.
-    
+
+Examples:
+python -m sql_etudes_python.main
+python -m sql_etudes_python.main 2 3 --jobs 8 --mode3 per_year --workers 2 --output-dir results
+python -m sql_etudes_python.main 4 --mode4 sql --concurrency 16 --instrument queries.json --no-render
+python -m sql_etudes_python.main --backend snapshot --caches table --profile analyses.prof
+python -m sql_etudes_python.main --dry-run --mode3 per_year --mode4 sql
 """
 
+ANALYSES = [1, 2, 3, 4, 5]
+
+# analyses provided by the backends
+BACKEND_TO_ANALYSES = {
+    'orm': {1, 2, 3, 5},
+    'psycopg2': {1, 4},
+    'snapshot': {1, 2, 3, 4},
+}
+
+# environment variables enabling the caches
+CACHE_TO_ENV_VAR = {
+    'result': 'SQL_ETUDES_RESULT_CACHE',
+    'table': 'SQL_ETUDES_TABLE_CACHE',
+    'view': 'SQL_ETUDES_CURRENT_STATE_VIEW',
+}
+
+# functions fetching the inputs shared by the analyses (the snapshot is loaded once for all analyses run with the
+# snapshot backend)
+INPUT_TO_FETCH = {
+    'titles': lambda inputs: title_manager.get_all_distinct_titles(),
+    'departments': lambda inputs: department_manager.get_all_departments(),
+    'years': lambda inputs: salary_manager.get_distinct_years_salaries_asc(),
+    'snapshot': lambda inputs: snapshot.load_snapshot(),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sql_etudes_python.main', description='Obtain and visualize the results of the analyses.')
+    parser.add_argument('analyses', type=int, nargs='*', metavar='ANALYSIS', help='numbers of the analyses to run (1-5, all if not given)')
+    parser.add_argument('--backend', choices=sorted(BACKEND_TO_ANALYSES.keys()), default='orm', help='backend used to run the analyses')
+    parser.add_argument('--mode3', choices=['single_pass', 'per_year', 'employee_year'], default='single_pass', help='mode of the 3. analysis')
+    parser.add_argument('--mode4', choices=['interval_sweep', 'sql', 'employee_year'], default='interval_sweep', help='mode of the 4. analysis')
+    parallelism = parser.add_mutually_exclusive_group()
+    parallelism.add_argument('--jobs', type=int, default=None, help='number of threads executing the queries (2., 3. in the per_year mode and 5. analysis, at most the connection pool size plus overflow)')
+    parallelism.add_argument('--concurrency', type=int, default=None,
+                             help='maximum number of queries executed concurrently using asyncio (2., 3. in the per_year mode and 4. in the sql mode)')
+    parser.add_argument('--workers', type=int, default=None, help='maximum number of analyses and visualizations running at the same time')
+    parser.add_argument('--incremental', action='store_true', help='recompute only the years of the 3. and 4. analyses whose data changed')
+    parser.add_argument('--caches', nargs='*', choices=sorted(CACHE_TO_ENV_VAR.keys()), default=None,
+                        help='caches to enable (the others are disabled, configured with environment variables if not given)')
+    parser.add_argument('--clear-caches', action='store_true', help='remove the cached results and tables and the stored results of the incremental mode')
+    parser.add_argument('--dsn', default=None, help='database URL (configured database if not given)')
+    parser.add_argument('--pool-size', type=int, default=None, help='number of connections kept in each pool')
+    parser.add_argument('--output-dir', default=None, help='directory in which to save the visualizations (results directory of the data_analysis package if not given)')
+    parser.add_argument('--no-render', action='store_true', help='do not produce the visualizations')
+    parser.add_argument('--render-processes', type=int, default=None, help='number of processes producing the visualizations (number of CPUs if not given)')
+    parser.add_argument('--profile', default=None, help='path of a file to which the cProfile statistics of the analyses are written')
+    parser.add_argument('--instrument', default=None, help='path of a JSON file to which the per-query statistics are written')
+    parser.add_argument('--explain-threshold', type=float, default=None, help='minimum execution time in seconds of the instrumented queries that are explained')
+    parser.add_argument('--dry-run', action='store_true', help='print the planned number of queries and exit')
+    args = parser.parse_args(argv)
+
+    if any(a not in ANALYSES for a in args.analyses):
+        parser.error('the numbers of the analyses must be between 1 and 5')
+    if args.explain_threshold is not None and args.instrument is None:
+        parser.error('--explain-threshold requires --instrument')
+
+    configure(dsn=args.dsn, pool_size=args.pool_size)
+    if args.caches is not None:
+        for cache, env_var in CACHE_TO_ENV_VAR.items():
+            os.environ[env_var] = '1' if cache in args.caches else '0'
+    if args.clear_caches:
+        result_cache.clear()
+        table_cache.clear()
+        incremental.clear()
+
+    analyses = sorted(set(args.analyses)) if args.analyses else ANALYSES
+    analysis_to_backend = {a: get_backend(a, args.backend) for a in analyses}
+    if args.dry_run:
+        print(format_query_plan(get_query_plan(analysis_to_backend, args.mode3, args.mode4, args.incremental)))
+        return 0
+
+    render_pool = None
+    if not args.no_render:
+        # the visualization script (matplotlib and pandas) is only imported when the results are visualized
+        from sql_etudes_python.data_analysis import visualization
+        render_pool = visualization.get_render_pool(args.render_processes)
+    nodes = get_nodes(analysis_to_backend, args.mode3, args.mode4, args.concurrency, args.jobs, args.incremental, render_pool, args.output_dir)
+
+    # the nodes are profiled one after another (a profiler only profiles the thread it is enabled in)
+    profiles = []
+    if args.profile is not None:
+        nodes = [pipeline.Node(node.name, _profiled(node.func, profiles), node.deps) for node in nodes]
+
+    with instrumentation.instrument(report_path=args.instrument, explain_threshold=args.explain_threshold) \
+            if args.instrument is not None \
+            else contextlib.nullcontext():
+        try:
+            results = pipeline.run(nodes, workers=1 if args.profile is not None else args.workers)
+        finally:
+            if render_pool is not None:
+                render_pool.shutdown()
+
+    if args.profile is not None:
+        stats = pstats.Stats(*profiles)
+        stats.dump_stats(args.profile)
+        logger.info('Profile written to {0}'.format(args.profile))
+        stats.sort_stats('cumulative').print_stats(20)
+
+    if render_pool is not None:
+        logger.info('Produced {0} visualizations'.format(sum(len(res) for name, res in results.items() if name.startswith('render'))))
+    return 0
+
+
+def get_backend(analysis_number, backend):
+    """Get the backend running an analysis (the ORM or psycopg2 backend if the analysis is not provided by the given backend).
+
+    :param analysis_number: number of the analysis (1-5)
+    :param backend: selected backend ('orm', 'psycopg2' or 'snapshot')
+    :return: backend running the analysis
+    """
+    if analysis_number in BACKEND_TO_ANALYSES[backend]:
+        return backend
+    fallback = 'orm' if analysis_number in BACKEND_TO_ANALYSES['orm'] else 'psycopg2'
+    logger.info('{0}. analysis is not provided by the {1} backend, running it with the {2} backend'.format(analysis_number, backend, fallback))
+    return fallback
+
+
+def get_input_names(analysis_number, backend, mode3, mode4, use_incremental=False):
+    """Get the names of the inputs shared by the analyses (see shared_inputs.py in the manager package) used by an
+    analysis.
+
+    :param analysis_number: number of the analysis (1-5)
+    :param backend: backend running the analysis (see get_backend)
+    :param mode3: mode of the 3. analysis
+    :param mode4: mode of the 4. analysis
+    :param use_incremental: if True, the 3. and 4. analyses are run incrementally
+    :return: list of names of the inputs (keys of INPUT_TO_FETCH)
+    """
+    if backend == 'snapshot':
+        return ['snapshot']
+    if analysis_number == 1:
+        return ['titles', 'departments'] if backend == 'orm' else []
+    if analysis_number == 3:
+        return ['titles', 'departments', 'years']
+    if analysis_number == 4:
+        if mode4 == 'sql':
+            return ['departments', 'years']
+        return ['years'] if mode4 == 'employee_year' or use_incremental else []
+    return ['titles', 'departments']
+
+
+def get_nodes(analysis_to_backend, mode3, mode4, concurrency=None, jobs=None, use_incremental=False, render_pool=None, output_dir=None):
+    """Get the nodes of the pipeline (see pipeline.py in the data_analysis package) running the analyses and their
+    visualizations.
+
+    :param analysis_to_backend: map of the numbers of the analyses to run to their backends (see get_backend)
+    :param mode3: mode of the 3. analysis (see get_data_analysis3 in analysis.py)
+    :param mode4: mode of the 4. analysis (see get_data_analysis4 in analysis_psycopg2.py)
+    :param concurrency: maximum number of queries executed concurrently using asyncio
+    :param jobs: number of threads executing the queries
+    :param use_incremental: if True, recompute only the years of the 3. and 4. analyses whose data changed (ORM and
+    psycopg2 backends)
+    :param render_pool: pool of processes rendering the visualizations (see get_render_pool in visualization.py, the
+    results are not visualized if None)
+    :param output_dir: directory in which to save the visualizations
+    :return: list of Node instances (the analysis nodes are named analysis1-analysis5 and return ResContainer instances,
+    None for the 1. analysis run with the psycopg2 backend, and the visualization nodes are named render1-render5 and
+    return the paths of the produced files)
+    """
+    analysis_number_to_run = {
+        (1, 'orm'): lambda inputs: analysis.get_data_analysis1(),
+        (1, 'psycopg2'): lambda inputs: analysis_psycopg2.get_data_analysis1(),
+        (1, 'snapshot'): lambda inputs: analysis_snapshot.get_data_analysis1(inputs['snapshot']),
+        (2, 'orm'): lambda inputs: analysis.get_data_analysis2(concurrency, jobs),
+        (2, 'snapshot'): lambda inputs: analysis_snapshot.get_data_analysis2(inputs['snapshot']),
+        (3, 'orm'): lambda inputs: incremental.get_data_analysis3(mode3, concurrency, jobs)
+        if use_incremental
+        else analysis.get_data_analysis3(mode3, concurrency, jobs),
+        (3, 'snapshot'): lambda inputs: analysis_snapshot.get_data_analysis3(inputs['snapshot']),
+        (4, 'psycopg2'): lambda inputs: incremental.get_data_analysis4(mode4, concurrency)
+        if use_incremental
+        else analysis_psycopg2.get_data_analysis4(mode4, concurrency),
+        (4, 'snapshot'): lambda inputs: analysis_snapshot.get_data_analysis4(inputs['snapshot']),
+        (5, 'orm'): lambda inputs: analysis.get_data_analysis5(jobs),
+    }
+
+    analysis_to_input_names = {a: get_input_names(a, backend, mode3, mode4, use_incremental) for a, backend in analysis_to_backend.items()}
+    input_names = [name for name in INPUT_TO_FETCH.keys() if any(name in names for names in analysis_to_input_names.values())]
+    nodes = [pipeline.Node(name, INPUT_TO_FETCH[name], []) for name in input_names]
+    for analysis_number, backend in analysis_to_backend.items():
+        analysis_name = 'analysis{0}'.format(analysis_number)
+        nodes.append(pipeline.Node(analysis_name, analysis_number_to_run[analysis_number, backend], analysis_to_input_names[analysis_number]))
+
+        # the psycopg2 backend prints the results of the 1. analysis instead of returning them
+        if render_pool is not None and (analysis_number, backend) != (1, 'psycopg2'):
+            nodes.append(pipeline.Node('render{0}'.format(analysis_number), _get_render(analysis_number, analysis_name, render_pool, output_dir), [analysis_name]))
+    return nodes
+
+
+def _get_render(analysis_number, analysis_name, render_pool, output_dir):
+    from sql_etudes_python.data_analysis import visualization
+
+    def render(inputs):
+        render_jobs = visualization.get_render_jobs(analysis_number, inputs[analysis_name])
+        return list(render_pool.map(visualization.run_render_job, render_jobs, [output_dir] * len(render_jobs)))
+
+    return render
+
+
+def _profiled(func, profiles):
+    def wrapper(inputs):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return func(inputs)
+        finally:
+            profiler.disable()
+            profiles.append(profiler)
+
+    return wrapper
+
+
+def get_query_plan(analysis_to_backend, mode3, mode4, use_incremental=False):
+    """Get the number of queries planned for each shared input and each analysis (upper bounds, see the module
+    description).
+
+    :param analysis_to_backend: map of the numbers of the analyses to their backends (see get_backend)
+    :param mode3: mode of the 3. analysis
+    :param mode4: mode of the 4. analysis
+    :param use_incremental: if True, the 3. and 4. analyses are run incrementally (ORM and psycopg2 backends)
+    :return: list of (name of the input or number of the analysis, backend, mode, number of queries) tuples
+    """
+    n_titles = len(title_manager.get_all_distinct_titles())
+    n_depts = len(department_manager.get_all_departments())
+    n_years = len(salary_manager.get_distinct_years_salaries_asc())
+
+    # the shared inputs are fetched once (the snapshot with its fingerprints, categories and tables and the data
+    # fingerprint of the result cache with one query for each table, one query for the names of the materialized views
+    # and one query for each materialized view)
+    input_to_n_queries = {'titles': 1, 'departments': 1, 'years': 1, 'snapshot': 2 * len(snapshot.TABLE_COLUMNS) + len(snapshot.CATEGORY_QUERIES)}
+    input_names = {name for a, backend in analysis_to_backend.items() for name in get_input_names(a, backend, mode3, mode4, use_incremental)}
+    plan = [(name, 'shared', None, n_queries) for name, n_queries in input_to_n_queries.items() if name in input_names]
+    if result_cache.is_enabled() and any(backend != 'snapshot' for backend in analysis_to_backend.values()):
+        plan.append(('fingerprint', 'shared', None, len(snapshot.TABLE_COLUMNS) + 1 + len(current_state.get_view_names())))
+
+    # number of queries of get_gender_based_data in analysis.py (6 queries for the company, managers and percentiles and
+    # one query for each title and department)
+    n_queries_gender_based_data = 6 + n_titles + n_depts
+
+    for analysis_number, backend in analysis_to_backend.items():
+        mode = None
+        if backend == 'snapshot':
+            n_queries = 0
+        elif analysis_number == 1:
+            # grouping sets query or departments and one query for the company and for each department
+            n_queries = 1 if backend == 'orm' else 2 + n_depts
+        elif analysis_number == 2:
+            n_queries = n_queries_gender_based_data
+        elif analysis_number == 3:
+            # either one query grouped by year for each metric (4 gender counts and 4 for each of the 3 percentiles) or
+            # the queries of get_gender_based_data for each year (the last year is excluded) and the watermarks
+            mode = mode3
+            n_queries = (n_years - 1) * n_queries_gender_based_data if mode3 == 'per_year' else 4 + 4 * 3
+            if use_incremental:
+                n_queries += len(incremental.ANALYSIS3_TABLES)
+        elif analysis_number == 4:
+            # departments and intervals, one query for each year, department and female employees or one query over
+            # the employee_year fact table and the watermarks
+            mode = mode4
+            n_queries = {'interval_sweep': 5, 'sql': n_years * (n_depts + 2), 'employee_year': 1}[mode4]
+            if use_incremental:
+                n_queries += len(incremental.ANALYSIS4_TABLES)
+        else:
+            # mean salaries and for each department the employees, the employees for each title and 5 percentiles
+            n_queries = n_depts + n_depts * (1 + n_titles + 5)
+        plan.append((analysis_number, backend, mode, n_queries))
+    return plan
+
+
+def format_query_plan(plan):
+    """Format the planned numbers of queries as a table."""
+    lines = ['{0:<12} {1:<10} {2:<16} {3:>10}'.format('node', 'backend', 'mode', 'queries')]
+    for name, backend, mode, n_queries in plan:
+        name = 'analysis{0}'.format(name) if isinstance(name, int) else name
+        lines.append('{0:<12} {1:<10} {2:<16} {3:>10}'.format(name, backend, mode if mode is not None else '-', n_queries))
+    lines.append('{0:<40} {1:>10}'.format('total (upper bound)', sum(n_queries for _, _, _, n_queries in plan)))
+    return '\n'.join(lines)
+
+
 if __name__ == '__main__':
-    # get data and perform visualizations for the 1. task
-    # res_container_analysis1 = analysis.get_data_analysis1()
-    # visualization.get_vis_analysis1(res_container_analysis1)
-
-    # # get data and perform visualizations for the 2. task
-    # res_container_analysis2 = analysis.get_data_analysis2()
-    # visualization.get_vis_analysis2(res_container_analysis2)
-
-    # get data and perform visualizations for the 3. task
-    # res_container_analysis3 = analysis.get_data_analysis3()
-    # visualization.get_vis_analysis3(res_container_analysis3)
-    # visualization.get_vis_analysis3(None)
-
-    # get data and perform visualizations for the 4. task
-    res_container_analysis4 = analysis_psycopg2.get_data_analysis4()
-    visualization.get_vis_analysis4(res_container_analysis4)
-
-    # get data and perform visualizations for the 5. task
-    # res_container_analysis5 = analysis.get_data_analysis5()
-    # visualization.get_vis_analysis5(res_container_analysis5)
+    sys.exit(main())
@@ -0,0 +1,86 @@
+import os
+import threading
+
+from sql_etudes_python.manager import get_config
+from sql_etudes_python.manager import pooled_connection
+
+"""
+Current state of the employees in the employees.current_employees materialized view (created by the second migration,
+see versions.py in the migrations package), which has one row per current employee with the gender, the current
+department, title and salary (NULL if the employee has none) and whether the employee currently manages a department.
+
+The manager functions answer the current state queries (year=None) that only read current rows from the view instead of
+joining the tables. The view is used if it exists and is populated (checked once per database) unless the
+SQL_ETUDES_CURRENT_STATE_VIEW environment variable is set to 0. The view is not updated when the tables change and has to
+be refreshed with refresh (or with python -m sql_etudes_python.migrations refresh).
+
+The functions checking for and refreshing materialized views by name are also used for the other materialized views of
+the employees schema (see employee_year_manager.py in the same package).
+"""
+
+VIEW_NAME = 'current_employees'
+
+_dsn_view_to_populated = dict()
+_lock = threading.Lock()
+
+
+def is_enabled():
+    """Check whether the current state queries are answered from the materialized view."""
+    if os.environ.get('SQL_ETUDES_CURRENT_STATE_VIEW', '1') == '0':
+        return False
+    return is_view_populated(VIEW_NAME)
+
+
+def is_view_populated(view_name):
+    """Check whether a materialized view of the employees schema exists and is populated (cached per database).
+
+    :param view_name: name of the materialized view
+    :return: True if the view can be queried
+    """
+    key = get_config()['dsn'], view_name
+    with _lock:
+        if key in _dsn_view_to_populated:
+            return _dsn_view_to_populated[key]
+    with pooled_connection() as conn:
+        with conn.cursor() as curs:
+            curs.execute('SELECT ispopulated FROM pg_matviews WHERE schemaname = %(schema)s AND matviewname = %(name)s',
+                         {'schema': 'employees', 'name': view_name})
+            row = curs.fetchone()
+    with _lock:
+        _dsn_view_to_populated[key] = row is not None and row[0]
+        return _dsn_view_to_populated[key]
+
+
+def get_view_names():
+    """Get the names of the materialized views of the employees schema."""
+    with pooled_connection() as conn:
+        with conn.cursor() as curs:
+            curs.execute('SELECT matviewname FROM pg_matviews WHERE schemaname = %(schema)s ORDER BY matviewname', {'schema': 'employees'})
+            return [row[0] for row in curs.fetchall()]
+
+
+def reset():
+    """Forget whether the materialized views are available (e.g. after they were created or dropped)."""
+    with _lock:
+        _dsn_view_to_populated.clear()
+
+
+def refresh(concurrently=True):
+    """Refresh the current employees materialized view.
+
+    :param concurrently: if True, refresh the view without locking out the queries reading it
+    """
+    refresh_view(VIEW_NAME, concurrently)
+
+
+def refresh_view(view_name, concurrently=True):
+    """Refresh a materialized view of the employees schema.
+
+    :param view_name: name of the materialized view
+    :param concurrently: if True, refresh the view without locking out the queries reading it (the view must have a
+    unique index)
+    """
+    with pooled_connection() as conn:
+        with conn.cursor() as curs:
+            curs.execute('REFRESH MATERIALIZED VIEW {0}employees.{1}'.format('CONCURRENTLY ' if concurrently else '', view_name))
+    reset()
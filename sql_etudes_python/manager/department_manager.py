@@ -1,7 +1,9 @@
 from sql_etudes_python.entities.entities import Department
 from sql_etudes_python.manager import Session
+from sql_etudes_python.manager import shared_inputs
 
 
+@shared_inputs.shared
 def get_all_departments():
     with Session() as session:
         return session.query(Department) \
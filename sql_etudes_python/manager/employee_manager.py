@@ -1,56 +1,100 @@
 import datetime
 
-from sqlalchemy import asc, select, func
+from sqlalchemy import asc, select, func, distinct, cast, String, and_, true, type_coerce, Float
+from sqlalchemy.dialects.postgresql import array, ARRAY
 from sqlalchemy.orm import contains_eager
 
-from sql_etudes_python.entities.entities import Employee, Title, DeptManager, DeptEmp, Salary
+from sql_etudes_python import constants
+from sql_etudes_python.entities.entities import Employee, Title, DeptManager, DeptEmp, Salary, CurrentEmployee
 from sql_etudes_python.manager import Session
+from sql_etudes_python.manager import current_state
+from sql_etudes_python.manager import get_stream_batch_size
+from sql_etudes_python.manager import title_manager
 
 
-def get_all_employees(year=None):
+# In lite mode, only the columns read by the analyses are selected and the employees are returned as compact rows
+# (with emp_no and gender attributes) instead of ORM entities.
+def _get_employee_columns(lite):
+    return (Employee.emp_no, Employee.gender) if lite else (Employee,)
+
+
+# Unlike ORM entities, the compact rows are not de-duplicated by the query, so the lite queries joining the interval
+# tables (in which an employee can match several rows) select distinct rows.
+def _query_employees(session, lite):
+    query = session.query(*_get_employee_columns(lite))
+    return query.distinct() if lite else query
+
+
+# The current state queries (year=None) are answered from the current employees materialized view if it is available
+# (see current_state.py in the same package).
+def _query_current_employees(session, lite, *criteria):
+    if lite:
+        return session.query(CurrentEmployee.emp_no, CurrentEmployee.gender).filter(*criteria)
+    return session.query(Employee) \
+        .join(CurrentEmployee, CurrentEmployee.emp_no == Employee.emp_no) \
+        .filter(*criteria)
+
+
+def get_all_employees(year=None, lite=False):
     year_filter = [Salary.to_date == datetime.date(9999, 1, 1)] \
         if year is None \
         else [Salary.from_date <= datetime.date(year, 12, 31), Salary.to_date >= datetime.date(year, 1, 1)]
 
+    if year is None and current_state.is_enabled():
+        with Session() as session:
+            return _query_current_employees(session, lite, CurrentEmployee.salary.isnot(None)).all()
+
     with Session() as session:
         sbq = select(Employee.emp_no.distinct()) \
             .join(Salary) \
             .filter(*year_filter)
-        return session.query(Employee).filter(Employee.emp_no.in_(sbq)).all()
+        return session.query(*_get_employee_columns(lite)).filter(Employee.emp_no.in_(sbq)).all()
 
 
-def get_employees_for_title(title, year=None):
+def get_employees_for_title(title, year=None, lite=False):
     year_filter = [Title.to_date == datetime.date(9999, 1, 1)] \
         if year is None \
         else [Title.from_date <= datetime.date(year, 12, 31), Title.to_date >= datetime.date(year, 1, 1)]
 
+    if year is None and current_state.is_enabled():
+        with Session() as session:
+            return _query_current_employees(session, lite, CurrentEmployee.title == title_manager.get_title_name(title)).all()
+
     with Session() as session:
-        return session.query(Employee) \
+        return _query_employees(session, lite) \
             .join(Title) \
-            .filter(Title.title == title.title) \
+            .filter(Title.title == title_manager.get_title_name(title)) \
             .filter(*year_filter) \
             .all()
 
 
-def get_employees_managers(year=None):
+def get_employees_managers(year=None, lite=False):
     year_filter = [DeptManager.to_date == datetime.date(9999, 1, 1)] \
         if year is None \
         else [DeptManager.from_date <= datetime.date(year, 12, 31), DeptManager.to_date >= datetime.date(year, 1, 1)]
 
+    if year is None and current_state.is_enabled():
+        with Session() as session:
+            return _query_current_employees(session, lite, CurrentEmployee.is_manager).all()
+
     with Session() as session:
-        return session.query(Employee) \
+        return _query_employees(session, lite) \
             .join(DeptManager) \
             .filter(*year_filter) \
             .all()
 
 
-def get_employees_dept(dept, year=None):
+def get_employees_dept(dept, year=None, lite=False):
     year_filter = [DeptEmp.to_date == datetime.date(9999, 1, 1)] \
         if year is None \
         else [DeptEmp.from_date <= datetime.date(year, 12, 31), DeptEmp.to_date >= datetime.date(year, 1, 1)]
 
+    if year is None and current_state.is_enabled():
+        with Session() as session:
+            return _query_current_employees(session, lite, CurrentEmployee.dept_no == dept.dept_no).all()
+
     with Session() as session:
-        return session.query(Employee) \
+        return _query_employees(session, lite) \
             .join(DeptEmp) \
             .filter(DeptEmp.dept_no == dept.dept_no) \
             .filter(*year_filter) \
@@ -81,7 +125,7 @@ def get_employees_above_salary_percentile_for_title(percentile, title, year=None
         percentile_val = session.query(func.percentile_cont(percentile).within_group(asc(Salary.salary))).join(Employee, Title).filter(*year_filter).one()[0]
         return session.query(Employee) \
             .join(Salary, Title) \
-            .filter(Title.title == title.title) \
+            .filter(Title.title == title_manager.get_title_name(title)) \
             .filter(*year_filter) \
             .filter(Salary.salary > percentile_val) \
             .all()
@@ -122,16 +166,20 @@ def get_employees_above_salary_percentile_for_dept(percentile, dept, year=None):
             .all()
 
 
-def get_employees_for_title_for_department(dept, title, year=None):
+def get_employees_for_title_for_department(dept, title, year=None, lite=False):
     year_filter = [DeptEmp.to_date == datetime.date(9999, 1, 1), Title.to_date == datetime.date(9999, 1, 1)] \
         if year is None \
         else [DeptEmp.from_date <= datetime.date(year, 12, 31), DeptEmp.to_date >= datetime.date(year, 1, 1), DeptEmp.from_date <= datetime.date(year, 12, 31), DeptEmp.to_date >= datetime.date(year, 1, 1)]
 
+    if year is None and current_state.is_enabled():
+        with Session() as session:
+            return _query_current_employees(session, lite, CurrentEmployee.dept_no == dept.dept_no, CurrentEmployee.title == title_manager.get_title_name(title)).all()
+
     with Session() as session:
-        return session.query(Employee) \
+        return _query_employees(session, lite) \
             .join(DeptEmp, Title) \
             .filter(*year_filter) \
-            .filter(DeptEmp.dept_no == dept.dept_no, Title.title == title.title) \
+            .filter(DeptEmp.dept_no == dept.dept_no, Title.title == title_manager.get_title_name(title)) \
             .all()
 
 
@@ -144,3 +192,663 @@ def get_number_employees_earn_more_than_managers(year=None, dept_no=None, gender
             q = q.join(DeptEmp).filter(DeptEmp.dept_no == dept_no)
 
         return q.all()
+
+
+# streaming variants (the employees are fetched in batches using server-side cursors) ###
+
+# The employees are selected by their numbers so that each employee is yielded once (the rows of the joined interval
+# tables can match an employee several times and the de-duplication of ORM entities does not apply with yield_per).
+def _query_employees_in(session, lite, emp_nos):
+    return session.query(*_get_employee_columns(lite)).filter(Employee.emp_no.in_(emp_nos))
+
+
+def iter_all_employees(year=None, lite=False, batch_size=None):
+    year_filter = [Salary.to_date == datetime.date(9999, 1, 1)] \
+        if year is None \
+        else [Salary.from_date <= datetime.date(year, 12, 31), Salary.to_date >= datetime.date(year, 1, 1)]
+
+    if year is None and current_state.is_enabled():
+        with Session() as session:
+            yield from _query_current_employees(session, lite, CurrentEmployee.salary.isnot(None)).yield_per(get_stream_batch_size(batch_size))
+        return
+
+    with Session() as session:
+        sbq = select(Employee.emp_no.distinct()) \
+            .join(Salary) \
+            .filter(*year_filter)
+        yield from _query_employees_in(session, lite, sbq).yield_per(get_stream_batch_size(batch_size))
+
+
+def iter_employees_for_title(title, year=None, lite=False, batch_size=None):
+    year_filter = [Title.to_date == datetime.date(9999, 1, 1)] \
+        if year is None \
+        else [Title.from_date <= datetime.date(year, 12, 31), Title.to_date >= datetime.date(year, 1, 1)]
+
+    if year is None and current_state.is_enabled():
+        with Session() as session:
+            yield from _query_current_employees(session, lite, CurrentEmployee.title == title_manager.get_title_name(title)).yield_per(get_stream_batch_size(batch_size))
+        return
+
+    with Session() as session:
+        sbq = select(Employee.emp_no.distinct()) \
+            .join(Title) \
+            .filter(Title.title == title_manager.get_title_name(title)) \
+            .filter(*year_filter)
+        yield from _query_employees_in(session, lite, sbq).yield_per(get_stream_batch_size(batch_size))
+
+
+def iter_employees_managers(year=None, lite=False, batch_size=None):
+    year_filter = [DeptManager.to_date == datetime.date(9999, 1, 1)] \
+        if year is None \
+        else [DeptManager.from_date <= datetime.date(year, 12, 31), DeptManager.to_date >= datetime.date(year, 1, 1)]
+
+    if year is None and current_state.is_enabled():
+        with Session() as session:
+            yield from _query_current_employees(session, lite, CurrentEmployee.is_manager).yield_per(get_stream_batch_size(batch_size))
+        return
+
+    with Session() as session:
+        sbq = select(Employee.emp_no.distinct()) \
+            .join(DeptManager) \
+            .filter(*year_filter)
+        yield from _query_employees_in(session, lite, sbq).yield_per(get_stream_batch_size(batch_size))
+
+
+def iter_employees_dept(dept, year=None, lite=False, batch_size=None):
+    year_filter = [DeptEmp.to_date == datetime.date(9999, 1, 1)] \
+        if year is None \
+        else [DeptEmp.from_date <= datetime.date(year, 12, 31), DeptEmp.to_date >= datetime.date(year, 1, 1)]
+
+    if year is None and current_state.is_enabled():
+        with Session() as session:
+            yield from _query_current_employees(session, lite, CurrentEmployee.dept_no == dept.dept_no).yield_per(get_stream_batch_size(batch_size))
+        return
+
+    with Session() as session:
+        sbq = select(Employee.emp_no.distinct()) \
+            .join(DeptEmp) \
+            .filter(DeptEmp.dept_no == dept.dept_no) \
+            .filter(*year_filter)
+        yield from _query_employees_in(session, lite, sbq).yield_per(get_stream_batch_size(batch_size))
+
+
+def iter_employees_for_title_for_department(dept, title, year=None, lite=False, batch_size=None):
+    year_filter = [DeptEmp.to_date == datetime.date(9999, 1, 1), Title.to_date == datetime.date(9999, 1, 1)] \
+        if year is None \
+        else [DeptEmp.from_date <= datetime.date(year, 12, 31), DeptEmp.to_date >= datetime.date(year, 1, 1), Title.from_date <= datetime.date(year, 12, 31), Title.to_date >= datetime.date(year, 1, 1)]
+
+    if year is None and current_state.is_enabled():
+        with Session() as session:
+            yield from _query_current_employees(session, lite, CurrentEmployee.dept_no == dept.dept_no, CurrentEmployee.title == title_manager.get_title_name(title)).yield_per(get_stream_batch_size(batch_size))
+        return
+
+    with Session() as session:
+        sbq = select(Employee.emp_no.distinct()) \
+            .join(DeptEmp) \
+            .join(Title) \
+            .filter(*year_filter) \
+            .filter(DeptEmp.dept_no == dept.dept_no, Title.title == title_manager.get_title_name(title))
+        yield from _query_employees_in(session, lite, sbq).yield_per(get_stream_batch_size(batch_size))
+
+# /streaming variants (the employees are fetched in batches using server-side cursors) ###
+
+
+# gender counts (total, female, male) computed server-side ###
+
+# The select_* functions build the statements so that they can also be executed concurrently (see executor.py in the
+# same package). The results of executing them are converted using rows_to_gender_counts.
+
+def _get_gender_counts_columns():
+    # gender is stored as an enum so it is cast to text to compare it with bound string parameters
+    gender = cast(Employee.gender, String)
+    return (func.count(distinct(Employee.emp_no)).label('total'),
+            func.count(distinct(Employee.emp_no)).filter(gender == constants.FEMALE).label('female'),
+            func.count(distinct(Employee.emp_no)).filter(gender == constants.MALE).label('male'))
+
+
+def _get_current_gender_counts_columns():
+    # the current employees materialized view has one row per employee and the gender stored as text
+    return (func.count(CurrentEmployee.emp_no).label('total'),
+            func.count(CurrentEmployee.emp_no).filter(CurrentEmployee.gender == constants.FEMALE).label('female'),
+            func.count(CurrentEmployee.emp_no).filter(CurrentEmployee.gender == constants.MALE).label('male'))
+
+
+def _to_gender_counts(row):
+    return row.total, row.female, row.male
+
+
+def rows_to_gender_counts(rows):
+    return _to_gender_counts(rows[0])
+
+
+def fetch_all(stmt):
+    with Session() as session:
+        return session.execute(stmt).all()
+
+
+def fetch_gender_counts(stmt):
+    return rows_to_gender_counts(fetch_all(stmt))
+
+
+def select_all_employees_gender_counts(year=None):
+    year_filter = [Salary.to_date == datetime.date(9999, 1, 1)] \
+        if year is None \
+        else [Salary.from_date <= datetime.date(year, 12, 31), Salary.to_date >= datetime.date(year, 1, 1)]
+
+    if year is None and current_state.is_enabled():
+        return select(*_get_current_gender_counts_columns()) \
+            .filter(CurrentEmployee.salary.isnot(None))
+
+    return select(*_get_gender_counts_columns()) \
+        .select_from(Employee) \
+        .join(Salary) \
+        .filter(*year_filter)
+
+
+def get_all_employees_gender_counts(year=None):
+    return fetch_gender_counts(select_all_employees_gender_counts(year))
+
+
+def select_employees_for_title_gender_counts(title, year=None):
+    year_filter = [Title.to_date == datetime.date(9999, 1, 1)] \
+        if year is None \
+        else [Title.from_date <= datetime.date(year, 12, 31), Title.to_date >= datetime.date(year, 1, 1)]
+
+    if year is None and current_state.is_enabled():
+        return select(*_get_current_gender_counts_columns()) \
+            .filter(CurrentEmployee.title == title_manager.get_title_name(title))
+
+    return select(*_get_gender_counts_columns()) \
+        .select_from(Employee) \
+        .join(Title) \
+        .filter(Title.title == title_manager.get_title_name(title)) \
+        .filter(*year_filter)
+
+
+def get_employees_for_title_gender_counts(title, year=None):
+    return fetch_gender_counts(select_employees_for_title_gender_counts(title, year))
+
+
+def select_employees_managers_gender_counts(year=None):
+    year_filter = [DeptManager.to_date == datetime.date(9999, 1, 1)] \
+        if year is None \
+        else [DeptManager.from_date <= datetime.date(year, 12, 31), DeptManager.to_date >= datetime.date(year, 1, 1)]
+
+    if year is None and current_state.is_enabled():
+        return select(*_get_current_gender_counts_columns()) \
+            .filter(CurrentEmployee.is_manager)
+
+    return select(*_get_gender_counts_columns()) \
+        .select_from(Employee) \
+        .join(DeptManager) \
+        .filter(*year_filter)
+
+
+def get_employees_managers_gender_counts(year=None):
+    return fetch_gender_counts(select_employees_managers_gender_counts(year))
+
+
+def select_employees_dept_gender_counts(dept, year=None):
+    year_filter = [DeptEmp.to_date == datetime.date(9999, 1, 1)] \
+        if year is None \
+        else [DeptEmp.from_date <= datetime.date(year, 12, 31), DeptEmp.to_date >= datetime.date(year, 1, 1)]
+
+    if year is None and current_state.is_enabled():
+        return select(*_get_current_gender_counts_columns()) \
+            .filter(CurrentEmployee.dept_no == dept.dept_no)
+
+    return select(*_get_gender_counts_columns()) \
+        .select_from(Employee) \
+        .join(DeptEmp) \
+        .filter(DeptEmp.dept_no == dept.dept_no) \
+        .filter(*year_filter)
+
+
+def get_employees_dept_gender_counts(dept, year=None):
+    return fetch_gender_counts(select_employees_dept_gender_counts(dept, year))
+
+
+def select_employees_for_title_for_department_gender_counts(dept, title, year=None):
+    year_filter = [DeptEmp.to_date == datetime.date(9999, 1, 1), Title.to_date == datetime.date(9999, 1, 1)] \
+        if year is None \
+        else [DeptEmp.from_date <= datetime.date(year, 12, 31), DeptEmp.to_date >= datetime.date(year, 1, 1), Title.from_date <= datetime.date(year, 12, 31), Title.to_date >= datetime.date(year, 1, 1)]
+
+    if year is None and current_state.is_enabled():
+        return select(*_get_current_gender_counts_columns()) \
+            .filter(CurrentEmployee.dept_no == dept.dept_no, CurrentEmployee.title == title_manager.get_title_name(title))
+
+    return select(*_get_gender_counts_columns()) \
+        .select_from(Employee) \
+        .join(DeptEmp) \
+        .join(Title) \
+        .filter(DeptEmp.dept_no == dept.dept_no, Title.title == title_manager.get_title_name(title)) \
+        .filter(*year_filter)
+
+
+def get_employees_for_title_for_department_gender_counts(dept, title, year=None):
+    return fetch_gender_counts(select_employees_for_title_for_department_gender_counts(dept, title, year))
+
+
+def select_employees_above_salary_percentile_gender_counts(percentile, year=None):
+    year_filter = [Salary.to_date == datetime.date(9999, 1, 1)] \
+        if year is None \
+        else [Salary.from_date <= datetime.date(year, 12, 31), Salary.to_date >= datetime.date(year, 1, 1)]
+
+    if year is None and current_state.is_enabled():
+        # the percentile ignores the employees without a current salary (NULL)
+        percentile_val = select(func.percentile_disc(percentile).within_group(asc(CurrentEmployee.salary))) \
+            .scalar_subquery()
+        return select(*_get_current_gender_counts_columns()) \
+            .filter(CurrentEmployee.salary > percentile_val)
+
+    percentile_val = select(func.percentile_disc(percentile).within_group(asc(Salary.salary))) \
+        .filter(*year_filter) \
+        .scalar_subquery()
+    return select(*_get_gender_counts_columns()) \
+        .select_from(Employee) \
+        .join(Salary) \
+        .filter(*year_filter) \
+        .filter(Salary.salary > percentile_val)
+
+
+def get_employees_above_salary_percentile_gender_counts(percentile, year=None):
+    return fetch_gender_counts(select_employees_above_salary_percentile_gender_counts(percentile, year))
+
+
+def select_employees_above_salary_percentile_for_title_gender_counts(percentile, title, year=None):
+    year_filter = [Title.to_date == datetime.date(9999, 1, 1)] \
+        if year is None \
+        else [Title.from_date <= datetime.date(year, 12, 31), Title.to_date >= datetime.date(year, 1, 1)]
+
+    percentile_val = select(func.percentile_cont(percentile).within_group(asc(Salary.salary))) \
+        .select_from(Salary) \
+        .join(Employee) \
+        .join(Title) \
+        .filter(*year_filter) \
+        .scalar_subquery()
+    return select(*_get_gender_counts_columns()) \
+        .select_from(Employee) \
+        .join(Salary) \
+        .join(Title) \
+        .filter(Title.title == title_manager.get_title_name(title)) \
+        .filter(*year_filter) \
+        .filter(Salary.salary > percentile_val)
+
+
+def get_employees_above_salary_percentile_for_title_gender_counts(percentile, title, year=None):
+    return fetch_gender_counts(select_employees_above_salary_percentile_for_title_gender_counts(percentile, title, year))
+
+
+def select_employees_above_salary_percentile_for_managers_gender_counts(percentile, year=None):
+    year_filter = [DeptManager.to_date == datetime.date(9999, 1, 1)] \
+        if year is None \
+        else [DeptManager.from_date <= datetime.date(year, 12, 31), DeptManager.to_date >= datetime.date(year, 1, 1)]
+
+    percentile_val = select(func.percentile_cont(percentile).within_group(asc(Salary.salary))) \
+        .select_from(Salary) \
+        .join(Employee) \
+        .join(DeptManager) \
+        .filter(*year_filter) \
+        .scalar_subquery()
+    return select(*_get_gender_counts_columns()) \
+        .select_from(Employee) \
+        .join(DeptManager) \
+        .join(Salary) \
+        .filter(*year_filter) \
+        .filter(Salary.salary > percentile_val)
+
+
+def get_employees_above_salary_percentile_for_managers_gender_counts(percentile, year=None):
+    return fetch_gender_counts(select_employees_above_salary_percentile_for_managers_gender_counts(percentile, year))
+
+
+def select_employees_above_salary_percentile_for_dept_gender_counts(percentile, dept, year=None):
+    year_filter = [DeptEmp.to_date == datetime.date(9999, 1, 1)] \
+        if year is None \
+        else [DeptEmp.from_date <= datetime.date(year, 12, 31), DeptEmp.to_date >= datetime.date(year, 1, 1)]
+
+    percentile_val = select(func.percentile_cont(percentile).within_group(asc(Salary.salary))) \
+        .select_from(Salary) \
+        .join(Employee) \
+        .join(DeptEmp) \
+        .filter(DeptEmp.dept_no == dept.dept_no) \
+        .filter(*year_filter) \
+        .scalar_subquery()
+    return select(*_get_gender_counts_columns()) \
+        .select_from(Employee) \
+        .join(Salary) \
+        .join(DeptEmp) \
+        .filter(DeptEmp.dept_no == dept.dept_no) \
+        .filter(*year_filter) \
+        .filter(Salary.salary > percentile_val)
+
+
+def get_employees_above_salary_percentile_for_dept_gender_counts(percentile, dept, year=None):
+    return fetch_gender_counts(select_employees_above_salary_percentile_for_dept_gender_counts(percentile, dept, year))
+
+# /gender counts (total, female, male) computed server-side ###
+
+
+# gender counts (total, female, male) above several salary percentiles in a single statement ###
+
+# The thresholds for all percentiles are computed at once using percentile_cont/percentile_disc with an array of
+# percentiles and the employees above each threshold are counted in the same statement. The thresholds are computed in
+# the same way as in the corresponding select_employees_above_salary_percentile* functions. The results of executing the
+# statements are converted using rows_to_percentiles_gender_counts.
+
+def _get_gender_counts_above_percentiles_columns(percentile_vals, percentiles):
+    gender = cast(Employee.gender, String)
+    columns = []
+    for i in range(len(percentiles)):
+        above = Salary.salary > percentile_vals.c.percentile_vals[i + 1]
+        columns += [func.count(distinct(Employee.emp_no)).filter(above).label('total_{0}'.format(i)),
+                    func.count(distinct(Employee.emp_no)).filter(and_(above, gender == constants.FEMALE)).label('female_{0}'.format(i)),
+                    func.count(distinct(Employee.emp_no)).filter(and_(above, gender == constants.MALE)).label('male_{0}'.format(i))]
+    return columns
+
+
+def _get_current_gender_counts_above_percentiles_columns(percentile_vals, percentiles):
+    columns = []
+    for i in range(len(percentiles)):
+        above = CurrentEmployee.salary > percentile_vals.c.percentile_vals[i + 1]
+        columns += [func.count(CurrentEmployee.emp_no).filter(above).label('total_{0}'.format(i)),
+                    func.count(CurrentEmployee.emp_no).filter(and_(above, CurrentEmployee.gender == constants.FEMALE)).label('female_{0}'.format(i)),
+                    func.count(CurrentEmployee.emp_no).filter(and_(above, CurrentEmployee.gender == constants.MALE)).label('male_{0}'.format(i))]
+    return columns
+
+
+def _get_percentile_vals_column(percentile_func, percentiles, salary=Salary.salary):
+    # the array of thresholds is typed explicitly so that it can be indexed
+    return type_coerce(percentile_func(array(percentiles)).within_group(asc(salary)), ARRAY(Float)).label('percentile_vals')
+
+
+def rows_to_percentiles_gender_counts(rows, percentiles, group_key=None):
+    def to_percentile_to_gender_counts(row):
+        return {percentile: (getattr(row, 'total_{0}'.format(i)), getattr(row, 'female_{0}'.format(i)), getattr(row, 'male_{0}'.format(i)))
+                for i, percentile in enumerate(percentiles)}
+
+    if group_key is None:
+        return to_percentile_to_gender_counts(rows[0])
+    return {getattr(row, group_key): to_percentile_to_gender_counts(row) for row in rows}
+
+
+def select_employees_above_salary_percentiles_gender_counts(percentiles, year=None):
+    year_filter = [Salary.to_date == datetime.date(9999, 1, 1)] \
+        if year is None \
+        else [Salary.from_date <= datetime.date(year, 12, 31), Salary.to_date >= datetime.date(year, 1, 1)]
+
+    if year is None and current_state.is_enabled():
+        percentile_vals = select(_get_percentile_vals_column(func.percentile_disc, percentiles, CurrentEmployee.salary)) \
+            .cte('percentile_vals')
+        return select(*_get_current_gender_counts_above_percentiles_columns(percentile_vals, percentiles)) \
+            .select_from(CurrentEmployee) \
+            .join(percentile_vals, true())
+
+    percentile_vals = select(_get_percentile_vals_column(func.percentile_disc, percentiles)) \
+        .filter(*year_filter) \
+        .cte('percentile_vals')
+    return select(*_get_gender_counts_above_percentiles_columns(percentile_vals, percentiles)) \
+        .select_from(Employee) \
+        .join(Salary) \
+        .join(percentile_vals, true()) \
+        .filter(*year_filter)
+
+
+def select_employees_above_salary_percentiles_for_titles_gender_counts(percentiles, year=None):
+    year_filter = [Title.to_date == datetime.date(9999, 1, 1)] \
+        if year is None \
+        else [Title.from_date <= datetime.date(year, 12, 31), Title.to_date >= datetime.date(year, 1, 1)]
+
+    # as in select_employees_above_salary_percentile_for_title_gender_counts, the thresholds are computed over all employees having a title
+    percentile_vals = select(_get_percentile_vals_column(func.percentile_cont, percentiles)) \
+        .select_from(Salary) \
+        .join(Employee) \
+        .join(Title) \
+        .filter(*year_filter) \
+        .cte('percentile_vals')
+    return select(Title.title, *_get_gender_counts_above_percentiles_columns(percentile_vals, percentiles)) \
+        .select_from(Employee) \
+        .join(Salary) \
+        .join(Title) \
+        .join(percentile_vals, true()) \
+        .filter(*year_filter) \
+        .group_by(Title.title)
+
+
+def select_employees_above_salary_percentiles_for_managers_gender_counts(percentiles, year=None):
+    year_filter = [DeptManager.to_date == datetime.date(9999, 1, 1)] \
+        if year is None \
+        else [DeptManager.from_date <= datetime.date(year, 12, 31), DeptManager.to_date >= datetime.date(year, 1, 1)]
+
+    percentile_vals = select(_get_percentile_vals_column(func.percentile_cont, percentiles)) \
+        .select_from(Salary) \
+        .join(Employee) \
+        .join(DeptManager) \
+        .filter(*year_filter) \
+        .cte('percentile_vals')
+    return select(*_get_gender_counts_above_percentiles_columns(percentile_vals, percentiles)) \
+        .select_from(Employee) \
+        .join(DeptManager) \
+        .join(Salary) \
+        .join(percentile_vals, true()) \
+        .filter(*year_filter)
+
+
+def select_employees_above_salary_percentiles_for_depts_gender_counts(percentiles, year=None):
+    year_filter = [DeptEmp.to_date == datetime.date(9999, 1, 1)] \
+        if year is None \
+        else [DeptEmp.from_date <= datetime.date(year, 12, 31), DeptEmp.to_date >= datetime.date(year, 1, 1)]
+
+    percentile_vals = select(DeptEmp.dept_no, _get_percentile_vals_column(func.percentile_cont, percentiles)) \
+        .select_from(Salary) \
+        .join(Employee) \
+        .join(DeptEmp) \
+        .filter(*year_filter) \
+        .group_by(DeptEmp.dept_no) \
+        .cte('percentile_vals')
+    return select(DeptEmp.dept_no, *_get_gender_counts_above_percentiles_columns(percentile_vals, percentiles)) \
+        .select_from(Employee) \
+        .join(Salary) \
+        .join(DeptEmp) \
+        .join(percentile_vals, percentile_vals.c.dept_no == DeptEmp.dept_no) \
+        .filter(*year_filter) \
+        .group_by(DeptEmp.dept_no)
+
+
+def get_employees_above_salary_percentiles_gender_counts(percentiles, year=None):
+    return rows_to_percentiles_gender_counts(fetch_all(select_employees_above_salary_percentiles_gender_counts(percentiles, year)), percentiles)
+
+
+def get_employees_above_salary_percentiles_for_titles_gender_counts(percentiles, year=None):
+    return rows_to_percentiles_gender_counts(fetch_all(select_employees_above_salary_percentiles_for_titles_gender_counts(percentiles, year)),
+                                             percentiles, group_key='title')
+
+
+def get_employees_above_salary_percentiles_for_managers_gender_counts(percentiles, year=None):
+    return rows_to_percentiles_gender_counts(fetch_all(select_employees_above_salary_percentiles_for_managers_gender_counts(percentiles, year)), percentiles)
+
+
+def get_employees_above_salary_percentiles_for_depts_gender_counts(percentiles, year=None):
+    return rows_to_percentiles_gender_counts(fetch_all(select_employees_above_salary_percentiles_for_depts_gender_counts(percentiles, year)),
+                                             percentiles, group_key='dept_no')
+
+# /gender counts (total, female, male) above several salary percentiles in a single statement ###
+
+
+# gender counts (total, female, male) for all years in a single pass ###
+
+def _get_year_series(years):
+    # years must not be empty (the functions below return empty results for no years without querying the database)
+    return func.generate_series(min(years), max(years)).table_valued('year').render_derived(name='years')
+
+
+def _get_year_overlap_filter(entity, year):
+    return and_(entity.from_date <= func.make_date(year, 12, 31), entity.to_date >= func.make_date(year, 1, 1))
+
+
+def _to_gender_counts_by_year(rows, years, group_key=None):
+    if group_key is None:
+        year_to_gender_counts = {year: (0, 0, 0) for year in years}
+        for row in rows:
+            if row.year in year_to_gender_counts:
+                year_to_gender_counts[row.year] = _to_gender_counts(row)
+    else:
+        year_to_gender_counts = {year: dict() for year in years}
+        for row in rows:
+            if row.year in year_to_gender_counts:
+                year_to_gender_counts[row.year][getattr(row, group_key)] = _to_gender_counts(row)
+    return year_to_gender_counts
+
+
+def get_all_employees_gender_counts_by_year(years):
+    if len(years) == 0:
+        return dict()
+    year_series = _get_year_series(years)
+
+    with Session() as session:
+        rows = session.query(year_series.c.year, *_get_gender_counts_columns()) \
+            .select_from(year_series) \
+            .join(Salary, _get_year_overlap_filter(Salary, year_series.c.year)) \
+            .join(Employee, Employee.emp_no == Salary.emp_no) \
+            .group_by(year_series.c.year) \
+            .all()
+        return _to_gender_counts_by_year(rows, years)
+
+
+def get_employees_for_titles_gender_counts_by_year(years):
+    if len(years) == 0:
+        return dict()
+    year_series = _get_year_series(years)
+
+    with Session() as session:
+        rows = session.query(year_series.c.year, Title.title, *_get_gender_counts_columns()) \
+            .select_from(year_series) \
+            .join(Title, _get_year_overlap_filter(Title, year_series.c.year)) \
+            .join(Employee, Employee.emp_no == Title.emp_no) \
+            .group_by(year_series.c.year, Title.title) \
+            .all()
+        return _to_gender_counts_by_year(rows, years, group_key='title')
+
+
+def get_employees_managers_gender_counts_by_year(years):
+    if len(years) == 0:
+        return dict()
+    year_series = _get_year_series(years)
+
+    with Session() as session:
+        rows = session.query(year_series.c.year, *_get_gender_counts_columns()) \
+            .select_from(year_series) \
+            .join(DeptManager, _get_year_overlap_filter(DeptManager, year_series.c.year)) \
+            .join(Employee, Employee.emp_no == DeptManager.emp_no) \
+            .group_by(year_series.c.year) \
+            .all()
+        return _to_gender_counts_by_year(rows, years)
+
+
+def get_employees_depts_gender_counts_by_year(years):
+    if len(years) == 0:
+        return dict()
+    year_series = _get_year_series(years)
+
+    with Session() as session:
+        rows = session.query(year_series.c.year, DeptEmp.dept_no, *_get_gender_counts_columns()) \
+            .select_from(year_series) \
+            .join(DeptEmp, _get_year_overlap_filter(DeptEmp, year_series.c.year)) \
+            .join(Employee, Employee.emp_no == DeptEmp.emp_no) \
+            .group_by(year_series.c.year, DeptEmp.dept_no) \
+            .all()
+        return _to_gender_counts_by_year(rows, years, group_key='dept_no')
+
+
+def get_employees_above_salary_percentile_gender_counts_by_year(percentile, years):
+    if len(years) == 0:
+        return dict()
+    year_series = _get_year_series(years)
+
+    with Session() as session:
+        percentile_vals = session.query(year_series.c.year,
+                                        func.percentile_disc(percentile).within_group(asc(Salary.salary)).label('percentile_val')) \
+            .select_from(year_series) \
+            .join(Salary, _get_year_overlap_filter(Salary, year_series.c.year)) \
+            .group_by(year_series.c.year) \
+            .cte('percentile_vals')
+        rows = session.query(percentile_vals.c.year, *_get_gender_counts_columns()) \
+            .select_from(percentile_vals) \
+            .join(Salary, and_(_get_year_overlap_filter(Salary, percentile_vals.c.year), Salary.salary > percentile_vals.c.percentile_val)) \
+            .join(Employee, Employee.emp_no == Salary.emp_no) \
+            .group_by(percentile_vals.c.year) \
+            .all()
+        return _to_gender_counts_by_year(rows, years)
+
+
+def get_employees_above_salary_percentile_for_titles_gender_counts_by_year(percentile, years):
+    if len(years) == 0:
+        return dict()
+    year_series = _get_year_series(years)
+
+    with Session() as session:
+        # as in get_employees_above_salary_percentile_for_title, the percentile is computed over all employees having a title in the year
+        percentile_vals = session.query(year_series.c.year,
+                                        func.percentile_cont(percentile).within_group(asc(Salary.salary)).label('percentile_val')) \
+            .select_from(year_series) \
+            .join(Title, _get_year_overlap_filter(Title, year_series.c.year)) \
+            .join(Salary, Salary.emp_no == Title.emp_no) \
+            .group_by(year_series.c.year) \
+            .cte('percentile_vals')
+        rows = session.query(percentile_vals.c.year, Title.title, *_get_gender_counts_columns()) \
+            .select_from(percentile_vals) \
+            .join(Title, _get_year_overlap_filter(Title, percentile_vals.c.year)) \
+            .join(Salary, and_(Salary.emp_no == Title.emp_no, Salary.salary > percentile_vals.c.percentile_val)) \
+            .join(Employee, Employee.emp_no == Title.emp_no) \
+            .group_by(percentile_vals.c.year, Title.title) \
+            .all()
+        return _to_gender_counts_by_year(rows, years, group_key='title')
+
+
+def get_employees_above_salary_percentile_for_managers_gender_counts_by_year(percentile, years):
+    if len(years) == 0:
+        return dict()
+    year_series = _get_year_series(years)
+
+    with Session() as session:
+        percentile_vals = session.query(year_series.c.year,
+                                        func.percentile_cont(percentile).within_group(asc(Salary.salary)).label('percentile_val')) \
+            .select_from(year_series) \
+            .join(DeptManager, _get_year_overlap_filter(DeptManager, year_series.c.year)) \
+            .join(Salary, Salary.emp_no == DeptManager.emp_no) \
+            .group_by(year_series.c.year) \
+            .cte('percentile_vals')
+        rows = session.query(percentile_vals.c.year, *_get_gender_counts_columns()) \
+            .select_from(percentile_vals) \
+            .join(DeptManager, _get_year_overlap_filter(DeptManager, percentile_vals.c.year)) \
+            .join(Salary, and_(Salary.emp_no == DeptManager.emp_no, Salary.salary > percentile_vals.c.percentile_val)) \
+            .join(Employee, Employee.emp_no == DeptManager.emp_no) \
+            .group_by(percentile_vals.c.year) \
+            .all()
+        return _to_gender_counts_by_year(rows, years)
+
+
+def get_employees_above_salary_percentile_for_depts_gender_counts_by_year(percentile, years):
+    if len(years) == 0:
+        return dict()
+    year_series = _get_year_series(years)
+
+    with Session() as session:
+        percentile_vals = session.query(year_series.c.year,
+                                        DeptEmp.dept_no,
+                                        func.percentile_cont(percentile).within_group(asc(Salary.salary)).label('percentile_val')) \
+            .select_from(year_series) \
+            .join(DeptEmp, _get_year_overlap_filter(DeptEmp, year_series.c.year)) \
+            .join(Salary, Salary.emp_no == DeptEmp.emp_no) \
+            .group_by(year_series.c.year, DeptEmp.dept_no) \
+            .cte('percentile_vals')
+        rows = session.query(percentile_vals.c.year, percentile_vals.c.dept_no, *_get_gender_counts_columns()) \
+            .select_from(percentile_vals) \
+            .join(DeptEmp, and_(DeptEmp.dept_no == percentile_vals.c.dept_no, _get_year_overlap_filter(DeptEmp, percentile_vals.c.year))) \
+            .join(Salary, and_(Salary.emp_no == DeptEmp.emp_no, Salary.salary > percentile_vals.c.percentile_val)) \
+            .join(Employee, Employee.emp_no == DeptEmp.emp_no) \
+            .group_by(percentile_vals.c.year, percentile_vals.c.dept_no) \
+            .all()
+        return _to_gender_counts_by_year(rows, years, group_key='dept_no')
+
+# /gender counts (total, female, male) for all years in a single pass ###
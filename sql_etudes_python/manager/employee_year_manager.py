@@ -0,0 +1,154 @@
+from sqlalchemy import asc, func, and_
+
+from sql_etudes_python import constants
+from sql_etudes_python.entities.entities import EmployeeYear
+from sql_etudes_python.manager import Session
+from sql_etudes_python.manager import current_state
+from sql_etudes_python.manager.employee_manager import _to_gender_counts_by_year
+
+"""
+Yearly data from the employees.employee_year fact table (a materialized view created by the third migration, see
+versions.py in the migrations package), which has one row per employee and year with the employee's gender, highest
+salary in the year, last department and title in the year, whether the employee managed a department in the year and
+the lowest salary in the year of the other managers of the department (manager_salary).
+
+The functions have the same names, parameters and results as the corresponding *_by_year functions in the
+employee_manager.py script in the same package, but compute the results with a single GROUP BY over the fact table
+instead of evaluating the year overlap predicates on the salaries, titles, dept_emp and dept_manager tables. As each
+employee has a single salary, department and title per year in the fact table, the results differ from those functions
+for employees with several salaries, departments or titles in a year.
+
+The fact table is not updated when the tables change and has to be rebuilt with refresh (or with
+python -m sql_etudes_python.migrations refresh employee_year).
+"""
+
+VIEW_NAME = 'employee_year'
+
+
+def is_available():
+    """Check whether the fact table exists and is populated."""
+    return current_state.is_view_populated(VIEW_NAME)
+
+
+def refresh(concurrently=True):
+    """Rebuild the fact table.
+
+    :param concurrently: if True, rebuild the fact table without locking out the queries reading it
+    """
+    current_state.refresh_view(VIEW_NAME, concurrently)
+
+
+def _get_gender_counts_columns(*criteria):
+    # the fact table has one row per employee and year and the gender stored as text
+    return ((func.count().filter(and_(*criteria)) if criteria else func.count()).label('total'),
+            func.count().filter(and_(EmployeeYear.gender == constants.FEMALE, *criteria)).label('female'),
+            func.count().filter(and_(EmployeeYear.gender == constants.MALE, *criteria)).label('male'))
+
+
+def _get_gender_counts_by_year(years, group_key=None, *criteria):
+    if len(years) == 0:
+        return dict()
+    group_by = [EmployeeYear.year] + ([getattr(EmployeeYear, group_key)] if group_key is not None else [])
+    with Session() as session:
+        rows = session.query(*group_by, *_get_gender_counts_columns()) \
+            .filter(EmployeeYear.year.between(min(years), max(years)), *criteria) \
+            .group_by(*group_by) \
+            .all()
+    return _to_gender_counts_by_year(rows, years, group_key)
+
+
+def _get_gender_counts_above_salary_percentile_by_year(percentile_func, percentile, years, group_key=None, *criteria):
+    # the percentile is computed over the employees matching the criteria in the year (and group) once (the CTE is
+    # materialized so that it is not recomputed by each parallel worker)
+    if len(years) == 0:
+        return dict()
+    group_by = [EmployeeYear.year] + ([getattr(EmployeeYear, group_key)] if group_key is not None else [])
+    with Session() as session:
+        percentile_vals = session.query(*group_by, percentile_func(percentile).within_group(asc(EmployeeYear.salary)).label('percentile_val')) \
+            .filter(EmployeeYear.year.between(min(years), max(years)), *criteria) \
+            .group_by(*group_by) \
+            .cte('percentile_vals') \
+            .prefix_with('MATERIALIZED')
+        rows = session.query(*group_by, *_get_gender_counts_columns(EmployeeYear.salary > percentile_vals.c.percentile_val)) \
+            .join(percentile_vals, and_(*(percentile_vals.c[c.key] == c for c in group_by))) \
+            .filter(*criteria) \
+            .group_by(*group_by) \
+            .all()
+    return _to_gender_counts_by_year(rows, years, group_key)
+
+
+def get_all_employees_gender_counts_by_year(years):
+    return _get_gender_counts_by_year(years, None, EmployeeYear.salary.isnot(None))
+
+
+def get_employees_for_titles_gender_counts_by_year(years):
+    return _get_gender_counts_by_year(years, 'title', EmployeeYear.title.isnot(None))
+
+
+def get_employees_managers_gender_counts_by_year(years):
+    return _get_gender_counts_by_year(years, None, EmployeeYear.is_manager)
+
+
+def get_employees_depts_gender_counts_by_year(years):
+    return _get_gender_counts_by_year(years, 'dept_no', EmployeeYear.dept_no.isnot(None))
+
+
+def get_employees_above_salary_percentile_gender_counts_by_year(percentile, years):
+    return _get_gender_counts_above_salary_percentile_by_year(func.percentile_disc, percentile, years, None)
+
+
+def get_employees_above_salary_percentile_for_titles_gender_counts_by_year(percentile, years):
+    # as in employee_manager.py, the percentile is computed over all employees having a title in the year
+    if len(years) == 0:
+        return dict()
+    with Session() as session:
+        percentile_vals = session.query(EmployeeYear.year, func.percentile_cont(percentile).within_group(asc(EmployeeYear.salary)).label('percentile_val')) \
+            .filter(EmployeeYear.year.between(min(years), max(years)), EmployeeYear.title.isnot(None)) \
+            .group_by(EmployeeYear.year) \
+            .cte('percentile_vals') \
+            .prefix_with('MATERIALIZED')
+        rows = session.query(EmployeeYear.year, EmployeeYear.title, *_get_gender_counts_columns(EmployeeYear.salary > percentile_vals.c.percentile_val)) \
+            .join(percentile_vals, percentile_vals.c.year == EmployeeYear.year) \
+            .filter(EmployeeYear.title.isnot(None)) \
+            .group_by(EmployeeYear.year, EmployeeYear.title) \
+            .all()
+    return _to_gender_counts_by_year(rows, years, group_key='title')
+
+
+def get_employees_above_salary_percentile_for_managers_gender_counts_by_year(percentile, years):
+    return _get_gender_counts_above_salary_percentile_by_year(func.percentile_cont, percentile, years, None, EmployeeYear.is_manager)
+
+
+def get_employees_above_salary_percentile_for_depts_gender_counts_by_year(percentile, years):
+    return _get_gender_counts_above_salary_percentile_by_year(func.percentile_cont, percentile, years, 'dept_no', EmployeeYear.dept_no.isnot(None))
+
+
+def get_number_employees_earn_more_than_managers_by_year(years):
+    """Count the employees that earn more than a manager of their department by year, department and gender.
+
+    :param years: list of years
+    :return: tuple of maps of years to the counts, of years to department numbers to the counts and of years to the
+    counts of female employees
+    """
+    if len(years) == 0:
+        return dict(), dict(), dict()
+    earns_more = EmployeeYear.salary > EmployeeYear.manager_salary
+    with Session() as session:
+        rows = session.query(EmployeeYear.year,
+                             EmployeeYear.dept_no,
+                             func.count().filter(earns_more).label('total'),
+                             func.count().filter(and_(earns_more, EmployeeYear.gender == constants.FEMALE)).label('female')) \
+            .filter(EmployeeYear.year.between(min(years), max(years)), EmployeeYear.dept_no.isnot(None)) \
+            .group_by(EmployeeYear.year, EmployeeYear.dept_no) \
+            .all()
+
+    # each employee has a single department in a year, so the counts for years are the sums of the counts for departments
+    year_to_count = {year: 0 for year in years}
+    year_to_dept_no_to_count = {year: dict() for year in years}
+    year_to_count_female = {year: 0 for year in years}
+    for row in rows:
+        if row.year in year_to_count:
+            year_to_count[row.year] += row.total
+            year_to_dept_no_to_count[row.year][row.dept_no] = row.total
+            year_to_count_female[row.year] += row.female
+    return year_to_count, year_to_dept_no_to_count, year_to_count_female
@@ -0,0 +1,154 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import contextvars
+import os
+import re
+import threading
+
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from tqdm import tqdm
+
+from sql_etudes_python.manager import get_config
+from sql_etudes_python.manager import instrumentation
+
+"""
+Concurrent execution of independent queries, so that the wall time of a batch of small queries approaches the time of the
+slowest query rather than the sum of the times of all queries.
+
+The execute_all and execute_all_sql functions use asyncio and the asyncpg driver. The queries are sent over a pool of
+connections with at most a given number of queries in flight. Since asyncpg connections are bound to the event loop they
+were created in, each call creates its own engine (and connection pool) and disposes of it when all queries are done.
+
+The map_threads function calls a function (e.g. a function from one of the manager scripts) for each item using a bounded
+pool of threads. Each call opens its own Session or pooled connection, so the number of threads is limited to the
+capacity of the connection pools (pool size plus overflow, see the __init__.py script in the same package).
+
+Calls running at the same time (e.g. in analyses running concurrently in the pipeline, see pipeline.py in the
+data_analysis package) share these limits: the threads of all map_threads calls together do not exceed the capacity of
+the connection pools and the queries in flight of all execute_all and execute_all_sql calls together do not exceed the
+largest concurrency limit of the running calls. A call waits until a part of the limit is free and runs with the free
+part (at most the requested number of threads or queries in flight).
+
+The default concurrency limit can be set with the SQL_ETUDES_CONCURRENCY environment variable (default 8).
+"""
+
+
+def get_concurrency():
+    return int(os.environ.get('SQL_ETUDES_CONCURRENCY', 8))
+
+
+def get_max_jobs():
+    # threads waiting for a connection beyond the capacity of the pools would time out
+    config = get_config()
+    return max(config['pool_size'] + config['max_overflow'], 1)
+
+
+class _SharedLimit:
+    """Limit shared by the calls running at the same time."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._in_use = 0
+
+    @contextlib.contextmanager
+    def reserve(self, n, limit):
+        """Context manager reserving at most n units (at least one) while the units in use stay within limit.
+
+        :param n: number of units requested
+        :param limit: maximum number of units in use by all calls
+        :return: number of reserved units
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._in_use < limit)
+            reserved = min(n, limit - self._in_use)
+            self._in_use += reserved
+        try:
+            yield reserved
+        finally:
+            with self._condition:
+                self._in_use -= reserved
+                self._condition.notify_all()
+
+
+_thread_limit = _SharedLimit()
+_query_limit = _SharedLimit()
+
+
+def execute_all(statements, concurrency=None):
+    """Execute SQLAlchemy statements concurrently.
+
+    :param statements: list of SQLAlchemy statements (e.g. the ones returned by the select_* functions in employee_manager.py)
+    :param concurrency: maximum number of queries executed at the same time (see get_concurrency if None)
+    :return: list of lists of result rows in the order of the statements
+    """
+    return _run_all([(statement, dict()) for statement in statements], concurrency)
+
+
+def execute_all_sql(queries, concurrency=None):
+    """Execute raw SQL queries written for psycopg2 (using %(name)s placeholders) concurrently.
+
+    :param queries: list of (SQL query, dictionary of parameters) pairs
+    :param concurrency: maximum number of queries executed at the same time (see get_concurrency if None)
+    :return: list of lists of result rows in the order of the queries
+    """
+    return _run_all([(text(_to_named_placeholders(sql_query)), params) for sql_query, params in queries], concurrency)
+
+
+def map_threads(func, items, jobs=None, desc=None):
+    """Call a function for each item using a pool of threads. The results are returned in the order of the items
+    regardless of the order in which the calls finish.
+
+    :param func: function taking one item
+    :param items: items for which to call the function
+    :param jobs: number of threads (the calls are made one after another in the calling thread if None or 1), at most the
+    part of the capacity of the connection pools not used by other calls (see get_max_jobs)
+    :param desc: description shown in the progress bar
+    :return: list of results in the order of the items
+    """
+    items = list(items)
+    if jobs is None or jobs == 1:
+        return [func(item) for item in tqdm(items, colour='green', desc=desc)]
+    if jobs < 1:
+        raise ValueError('jobs must be at least 1')
+    # the calls run in copies of the context of the calling thread (e.g. for the instrumentation of the queries)
+    with instrumentation.pin_callers():
+        context = contextvars.copy_context()
+    with _thread_limit.reserve(jobs, get_max_jobs()) as jobs:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+            return list(tqdm(pool.map(lambda item: context.copy().run(func, item), items), total=len(items), colour='green', desc=desc))
+
+
+def _run_all(statements_with_params, concurrency):
+    concurrency = concurrency if concurrency is not None else get_concurrency()
+    if concurrency < 1:
+        raise ValueError('concurrency must be at least 1')
+    with instrumentation.pin_callers(), _query_limit.reserve(concurrency, concurrency) as concurrency:
+        return asyncio.run(_execute_all(statements_with_params, concurrency))
+
+
+async def _execute_all(statements_with_params, concurrency):
+    engine = create_async_engine(
+        make_url(get_config()['dsn']).set(drivername='postgresql+asyncpg'),
+        pool_size=concurrency,
+        max_overflow=0
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def execute(statement, params):
+        async with semaphore:
+            async with engine.connect() as conn:
+                res = await conn.execute(statement, params)
+                return res.all()
+
+    try:
+        return await asyncio.gather(*[execute(statement, params) for statement, params in statements_with_params])
+    finally:
+        await engine.dispose()
+
+
+def _to_named_placeholders(sql_query):
+    # %(name)s -> :name and the escaped percent signs %% -> % (escaping colons that are not placeholders, e.g. in casts)
+    return re.sub(r'%%|%\((\w+)\)s', lambda m: '%' if m.group(1) is None else ':' + m.group(1), sql_query.replace(':', '\\:'))
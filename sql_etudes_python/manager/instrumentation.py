@@ -0,0 +1,358 @@
+import collections
+import contextlib
+import contextvars
+import datetime
+import json
+import random
+import re
+import sys
+import threading
+import time
+
+import psycopg2.extensions
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import Pool
+from sqlalchemy.sql.expression import ClauseElement
+from sqlalchemy.sql.expression import Executable
+
+from sql_etudes_python.data_analysis import logger
+
+"""
+Per-query instrumentation of the SQLAlchemy (ORM and asyncio) and raw psycopg2 paths. When enabled, the following is
+recorded for each distinct combination of statement, calling manager function and analysis stage:
+n_calls - number of executions
+total_time, max_time - total and maximum execution time in seconds
+n_rows - number of rows returned to the client
+
+The SQLAlchemy statements are timed with the before_cursor_execute and after_cursor_execute engine events and the
+psycopg2 statements (e.g. the ones in analysis_psycopg2.py) with a cursor class set on the pooled psycopg2 connections
+when they are checked out. For named (server-side) cursors, the time is the time of the execution (the rows are fetched
+later) and the rows are counted when the cursor is closed.
+
+The calling manager function is the outermost function of a manager script on the call stack and the analysis stage is
+the name given with the stage context manager or else the outermost function of an analysis script on the call stack.
+Queries executed in other threads or in asyncio tasks (see executor.py in the same package) are attributed to the
+callers pinned with pin_callers when they were submitted.
+
+If an EXPLAIN threshold is given, the read-only statements taking at least that many seconds are sampled (at most once
+per statement) and their EXPLAIN (ANALYZE, BUFFERS) output is added to the report. Note that this executes the sampled
+statements once more.
+
+Example:
+with instrumentation.instrument(report_path='queries.json', top_n=20, explain_threshold=0.5):
+    analysis.get_data_analysis2()
+"""
+
+Callers = collections.namedtuple('Callers', ['manager_function', 'stage'])
+
+_ANALYSIS_MODULES = {
+    'sql_etudes_python.data_analysis.analysis',
+    'sql_etudes_python.data_analysis.analysis_psycopg2',
+    'sql_etudes_python.data_analysis.analysis_snapshot',
+}
+_MANAGER_PACKAGE = 'sql_etudes_python.manager.'
+_INFRASTRUCTURE_MODULES = {__name__, 'sql_etudes_python.manager.executor'}
+
+_READ_ONLY_STATEMENT = re.compile(r'^\s*(SELECT|WITH)\b', re.IGNORECASE)
+_WRITE_KEYWORD = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE|FOR\s+UPDATE)\b', re.IGNORECASE)
+
+_stage = contextvars.ContextVar('sql_etudes_python_stage', default=None)
+_pinned_callers = contextvars.ContextVar('sql_etudes_python_pinned_callers', default=None)
+_suppressed = contextvars.ContextVar('sql_etudes_python_instrumentation_suppressed', default=False)
+
+_lock = threading.Lock()
+_installed = False
+_enabled = False
+_explain_threshold = None
+_explain_sample_rate = 1.0
+_stats = dict()
+
+
+def enable(explain_threshold=None, explain_sample_rate=1.0):
+    """Enable the instrumentation (clearing the statistics recorded so far).
+
+    :param explain_threshold: minimum execution time in seconds of the statements for which EXPLAIN (ANALYZE, BUFFERS)
+    is sampled (no statements are explained if None)
+    :param explain_sample_rate: probability that a statement over the threshold is explained
+    """
+    global _enabled, _explain_threshold, _explain_sample_rate
+    _install()
+    reset()
+    _explain_threshold, _explain_sample_rate = explain_threshold, explain_sample_rate
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Clear the recorded statistics."""
+    with _lock:
+        _stats.clear()
+
+
+@contextlib.contextmanager
+def instrument(report_path=None, top_n=20, explain_threshold=None, explain_sample_rate=1.0):
+    """Context manager enabling the instrumentation and reporting the recorded statistics on exit.
+
+    :param report_path: path of the JSON file to which the report is written (not written if None)
+    :param top_n: number of statements (by total time) logged
+    :param explain_threshold: see enable
+    :param explain_sample_rate: see enable
+    """
+    enable(explain_threshold=explain_threshold, explain_sample_rate=explain_sample_rate)
+    try:
+        yield
+    finally:
+        disable()
+        log_report(top_n=top_n)
+        if report_path is not None:
+            write_report(report_path)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Context manager attributing the queries executed within it to an analysis stage."""
+    token = _stage.set(name)
+    try:
+        yield
+    finally:
+        _stage.reset(token)
+
+
+@contextlib.contextmanager
+def pin_callers():
+    """Context manager pinning the current callers (see get_callers) for the queries executed within it, including the
+    ones executed in other threads (if the context is copied to them) or in asyncio tasks.
+    """
+    token = _pinned_callers.set(get_callers() if _enabled else None)
+    try:
+        yield
+    finally:
+        _pinned_callers.reset(token)
+
+
+def get_callers():
+    """Get the calling manager function and analysis stage of the current query."""
+    manager_function, stage_name = _inspect_stack()
+    pinned = _pinned_callers.get()
+    if pinned is not None:
+        manager_function = manager_function if manager_function is not None else pinned.manager_function
+        stage_name = pinned.stage if pinned.stage is not None else stage_name
+    return Callers(manager_function, _stage.get() or stage_name)
+
+
+def get_report(top_n=None):
+    """Get the recorded statistics ordered by total time.
+
+    :param top_n: number of statements to include (all if None)
+    :return: list of dictionaries (one per statement, manager function and stage)
+    """
+    with _lock:
+        entries = [dict(s, statement=key[0], manager_function=key[1], stage=key[2], explain=[plan for plan in s['explain'] if plan is not None])
+                   for key, s in _stats.items()]
+    entries.sort(key=lambda e: e['total_time'], reverse=True)
+    for e in entries:
+        e['mean_time'] = e['total_time'] / e['n_calls']
+    return entries[:top_n] if top_n is not None else entries
+
+
+def log_report(top_n=20):
+    """Log the statements with the largest total time through the data_analysis logger."""
+    entries = get_report()
+    total_time = sum(e['total_time'] for e in entries)
+    logger.info('Executed {0} queries ({1} distinct) in {2:.3f}s'.format(sum(e['n_calls'] for e in entries), len(entries), total_time))
+    for rank, e in enumerate(entries[:top_n]):
+        logger.info('({0}) {1:.3f}s ({2:.1%}) {3} calls, {4} rows, max {5:.3f}s [{6} / {7}] {8}'.format(
+            rank, e['total_time'], e['total_time'] / total_time if total_time > 0 else 0.0, e['n_calls'], e['n_rows'],
+            e['max_time'], e['stage'], e['manager_function'], _shorten(e['statement'])))
+        for plan in e['explain']:
+            logger.info('EXPLAIN (ANALYZE, BUFFERS):\n{0}'.format(plan))
+
+
+def write_report(path, top_n=None):
+    """Write the recorded statistics ordered by total time to a JSON file."""
+    entries = get_report(top_n=top_n)
+    with open(path, 'w') as f:
+        json.dump({
+            'timestamp': datetime.datetime.now().isoformat(),
+            'n_queries': sum(e['n_calls'] for e in entries),
+            'total_time': sum(e['total_time'] for e in entries),
+            'statements': entries,
+        }, f, indent=2)
+
+
+def _record(statement, callers, elapsed, n_rows):
+    key = (' '.join(statement.split()), callers.manager_function, callers.stage)
+    with _lock:
+        s = _stats.get(key)
+        if s is None:
+            s = _stats[key] = {'n_calls': 0, 'total_time': 0.0, 'max_time': 0.0, 'n_rows': 0, 'explain': []}
+        s['n_calls'] += 1
+        s['total_time'] += elapsed
+        s['max_time'] = max(s['max_time'], elapsed)
+        s['n_rows'] += max(n_rows or 0, 0)
+    return key
+
+
+def _add_rows(key, n_rows):
+    with _lock:
+        if key in _stats:
+            _stats[key]['n_rows'] += max(n_rows or 0, 0)
+
+
+def _should_explain(key, statement, elapsed):
+    if _explain_threshold is None or elapsed < _explain_threshold or random.random() >= _explain_sample_rate:
+        return False
+    if not _READ_ONLY_STATEMENT.match(statement) or _WRITE_KEYWORD.search(statement):
+        return False
+    with _lock:
+        s = _stats.get(key)
+        if s is None or s['explain']:
+            return False
+        # reserve the slot so that concurrent executions do not explain the statement again
+        s['explain'].append(None)
+        return True
+
+
+def _explain(key, execute):
+    token = _suppressed.set(True)
+    try:
+        plan = '\n'.join(row[0] for row in execute())
+    except Exception as e:
+        logger.warning('EXPLAIN failed: {0}'.format(e))
+        plan = 'EXPLAIN failed: {0}'.format(e)
+    finally:
+        _suppressed.reset(token)
+    with _lock:
+        _stats[key]['explain'] = [plan]
+
+
+def _is_active():
+    return _enabled and not _suppressed.get()
+
+
+def _inspect_stack():
+    # the outermost manager function and the outermost analysis function on the call stack
+    manager_function, stage_name = None, None
+    frame = sys._getframe(1)
+    while frame is not None:
+        module_name = frame.f_globals.get('__name__', '')
+        if module_name.startswith(_MANAGER_PACKAGE) and module_name not in _INFRASTRUCTURE_MODULES:
+            manager_function = _get_function_name(module_name, frame)
+        elif module_name in _ANALYSIS_MODULES:
+            stage_name = _get_function_name(module_name, frame)
+        frame = frame.f_back
+    return manager_function, stage_name
+
+
+def _get_function_name(module_name, frame):
+    return '{0}.{1}'.format(module_name.rsplit('.', 1)[1], getattr(frame.f_code, 'co_qualname', frame.f_code.co_name))
+
+
+def _shorten(statement, max_length=160):
+    return statement if len(statement) <= max_length else statement[:max_length - 3] + '...'
+
+
+class _InstrumentedCursor(psycopg2.extensions.cursor):
+    """psycopg2 cursor recording the statements it executes."""
+
+    _instrumentation_key = None
+
+    def execute(self, query, vars=None):
+        if not _is_active():
+            return super().execute(query, vars)
+        callers = get_callers()
+        start = time.perf_counter()
+        res = super().execute(query, vars)
+        elapsed = time.perf_counter() - start
+        statement = query.decode() if isinstance(query, bytes) else str(query)
+        # the rows of named cursors are counted when the cursor is closed
+        key = _record(statement, callers, elapsed, self.rowcount if self.name is None else 0)
+        if self.name is not None:
+            self._instrumentation_key = key
+        if _should_explain(key, statement, elapsed):
+            _explain(key, lambda: self._explain(query, vars))
+        return res
+
+    def close(self):
+        if self._instrumentation_key is not None and not self.closed:
+            _add_rows(self._instrumentation_key, self.rowcount)
+            self._instrumentation_key = None
+        super().close()
+
+    def _explain(self, query, vars):
+        with psycopg2.extensions.cursor(self.connection) as curs:
+            curs.execute(b'EXPLAIN (ANALYZE, BUFFERS) ' + curs.mogrify(query, vars))
+            return curs.fetchall()
+
+
+def _install():
+    global _installed
+    with _lock:
+        if _installed:
+            return
+        event.listen(Pool, 'checkout', _on_checkout)
+        event.listen(Pool, 'checkin', _on_checkin)
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _installed = True
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    # the cursor class of the connection is restored when the connection is returned to the pool
+    if _enabled and isinstance(dbapi_connection, psycopg2.extensions.connection):
+        connection_record.info['instrumentation_cursor_factory'] = dbapi_connection.cursor_factory
+        dbapi_connection.cursor_factory = _InstrumentedCursor
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    if 'instrumentation_cursor_factory' in connection_record.info:
+        cursor_factory = connection_record.info.pop('instrumentation_cursor_factory')
+        if dbapi_connection is not None:
+            dbapi_connection.cursor_factory = cursor_factory
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _is_active():
+        conn.info.setdefault('instrumentation_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('instrumentation_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    # the statements executed with psycopg2 cursors are recorded by _InstrumentedCursor
+    if not _is_active() or isinstance(cursor, _InstrumentedCursor):
+        return
+    key = _record(statement, get_callers(), elapsed, getattr(cursor, 'rowcount', 0))
+    if not executemany and _should_explain(key, statement, elapsed):
+        if context is not None and context.compiled is not None:
+            # the compiled statement is executed again (with the parameters of this execution) so that the dialect sends
+            # the types of the bind parameters as in the original execution (e.g. the pg8000 and asyncpg dialects)
+            _explain(key, lambda: conn.execute(_Explain(context.compiled.statement), context.compiled_parameters[0]).fetchall())
+        else:
+            _explain(key, lambda: conn.exec_driver_sql('EXPLAIN (ANALYZE, BUFFERS) ' + statement, parameters).fetchall())
+
+
+class _Explain(Executable, ClauseElement):
+    """EXPLAIN (ANALYZE, BUFFERS) of a SQLAlchemy statement."""
+
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(_Explain)
+def _compile_explain(element, compiler, **kw):
+    return 'EXPLAIN (ANALYZE, BUFFERS) ' + compiler.process(element.statement, **kw)
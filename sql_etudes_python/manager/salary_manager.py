@@ -1,35 +1,141 @@
 import datetime
 
-from sqlalchemy import select, extract, asc, func
+from sqlalchemy import select, extract, asc, func, tuple_, and_
 
 from sql_etudes_python.manager import Session
-from sql_etudes_python.entities.entities import Employee, Title, DeptEmp, Salary
+from sql_etudes_python.manager import current_state
+from sql_etudes_python.manager import get_stream_batch_size
+from sql_etudes_python.manager import shared_inputs
+from sql_etudes_python.manager import title_manager
+from sql_etudes_python.entities.entities import Employee, Title, DeptEmp, Salary, Department, CurrentEmployee
 
 
-def get_salaries_title(title):
+# In lite mode, only the columns read by the analyses are selected and the salaries are returned as compact rows
+# (with emp_no and salary attributes) instead of ORM entities.
+def _get_salary_columns(lite):
+    return (Salary.emp_no, Salary.salary) if lite else (Salary,)
+
+
+# The current salaries are read from the current employees materialized view if it is available (see current_state.py
+# in the same package).
+def _query_current_salaries(session, lite, *criteria):
+    if lite:
+        return session.query(CurrentEmployee.emp_no, CurrentEmployee.salary) \
+            .filter(CurrentEmployee.salary.isnot(None), *criteria)
+    return session.query(Salary) \
+        .join(CurrentEmployee, CurrentEmployee.emp_no == Salary.emp_no) \
+        .filter(Salary.to_date == datetime.date(9999, 1, 1), *criteria)
+
+
+def get_salaries_title(title, lite=False):
+    if current_state.is_enabled():
+        with Session() as session:
+            return _query_current_salaries(session, lite, CurrentEmployee.title == title_manager.get_title_name(title)).all()
+
     with Session() as session:
         sbq = select(Employee.emp_no) \
             .join(Title) \
-            .filter(Title.title == title.title, Title.to_date == datetime.date(9999, 1, 1))
-        return session.query(Salary) \
+            .filter(Title.title == title_manager.get_title_name(title), Title.to_date == datetime.date(9999, 1, 1))
+        return session.query(*_get_salary_columns(lite)) \
             .filter(Salary.emp_no.in_(sbq), Salary.to_date == datetime.date(9999, 1, 1)) \
             .all()
 
 
-def get_salaries_title_dept(title, dept):
+def get_salaries_title_dept(title, dept, lite=False):
+    if current_state.is_enabled():
+        with Session() as session:
+            return _query_current_salaries(session, lite, CurrentEmployee.title == title_manager.get_title_name(title), CurrentEmployee.dept_no == dept.dept_no).all()
+
     with Session() as session:
         sbq = select(Employee.emp_no) \
             .join(Title) \
             .join(DeptEmp) \
-            .filter(Title.title == title.title,
+            .filter(Title.title == title_manager.get_title_name(title),
                     Title.to_date == datetime.date(9999, 1, 1),
                     DeptEmp.dept_no == dept.dept_no,
                     DeptEmp.to_date == datetime.date(9999, 1, 1))
-        return session.query(Salary) \
+        return session.query(*_get_salary_columns(lite)) \
             .filter(Salary.emp_no.in_(sbq), Salary.to_date == datetime.date(9999, 1, 1)) \
             .all()
 
 
+def iter_salaries_title(title, lite=False, batch_size=None):
+    if current_state.is_enabled():
+        with Session() as session:
+            yield from _query_current_salaries(session, lite, CurrentEmployee.title == title_manager.get_title_name(title)) \
+                .yield_per(get_stream_batch_size(batch_size))
+        return
+
+    with Session() as session:
+        sbq = select(Employee.emp_no) \
+            .join(Title) \
+            .filter(Title.title == title_manager.get_title_name(title), Title.to_date == datetime.date(9999, 1, 1))
+        yield from session.query(*_get_salary_columns(lite)) \
+            .filter(Salary.emp_no.in_(sbq), Salary.to_date == datetime.date(9999, 1, 1)) \
+            .yield_per(get_stream_batch_size(batch_size))
+
+
+def iter_salaries_title_dept(title, dept, lite=False, batch_size=None):
+    if current_state.is_enabled():
+        with Session() as session:
+            yield from _query_current_salaries(session, lite, CurrentEmployee.title == title_manager.get_title_name(title), CurrentEmployee.dept_no == dept.dept_no) \
+                .yield_per(get_stream_batch_size(batch_size))
+        return
+
+    with Session() as session:
+        sbq = select(Employee.emp_no) \
+            .join(Title) \
+            .join(DeptEmp) \
+            .filter(Title.title == title_manager.get_title_name(title),
+                    Title.to_date == datetime.date(9999, 1, 1),
+                    DeptEmp.dept_no == dept.dept_no,
+                    DeptEmp.to_date == datetime.date(9999, 1, 1))
+        yield from session.query(*_get_salary_columns(lite)) \
+            .filter(Salary.emp_no.in_(sbq), Salary.to_date == datetime.date(9999, 1, 1)) \
+            .yield_per(get_stream_batch_size(batch_size))
+
+
+def get_average_salaries_title_dept():
+    """Get average current salaries by title for the whole company and by department in a single grouping sets query.
+
+    :return: tuple of maps (title -> average salary, department name -> title -> average salary)
+    """
+    with Session() as session:
+        if current_state.is_enabled():
+            rows = session.query(Department.dept_name,
+                                 CurrentEmployee.title,
+                                 func.avg(CurrentEmployee.salary).label('average_salary'),
+                                 func.grouping(Department.dept_name).label('is_company')) \
+                .select_from(CurrentEmployee) \
+                .outerjoin(Department, Department.dept_no == CurrentEmployee.dept_no) \
+                .filter(CurrentEmployee.salary.isnot(None), CurrentEmployee.title.isnot(None)) \
+                .group_by(func.grouping_sets(tuple_(Department.dept_name, CurrentEmployee.title), tuple_(CurrentEmployee.title))) \
+                .all()
+        else:
+            rows = session.query(Department.dept_name,
+                                 Title.title,
+                                 func.avg(Salary.salary).label('average_salary'),
+                                 func.grouping(Department.dept_name).label('is_company')) \
+                .select_from(Salary) \
+                .join(Title, and_(Title.emp_no == Salary.emp_no, Title.to_date == datetime.date(9999, 1, 1))) \
+                .outerjoin(DeptEmp, and_(DeptEmp.emp_no == Salary.emp_no, DeptEmp.to_date == datetime.date(9999, 1, 1))) \
+                .outerjoin(Department) \
+                .filter(Salary.to_date == datetime.date(9999, 1, 1)) \
+                .group_by(func.grouping_sets(tuple_(Department.dept_name, Title.title), tuple_(Title.title))) \
+                .all()
+
+    title_to_average_salary_company = dict()
+    dept_to_title_to_average_salary = dict()
+    for row in rows:
+        if row.is_company:
+            title_to_average_salary_company[row.title] = float(row.average_salary)
+        elif row.dept_name is not None:
+            dept_to_title_to_average_salary.setdefault(row.dept_name, dict())[row.title] = float(row.average_salary)
+
+    return title_to_average_salary_company, dept_to_title_to_average_salary
+
+
+@shared_inputs.shared
 def get_distinct_years_salaries_asc():
     with Session() as session:
         return list(
@@ -57,6 +163,13 @@ def get_percentile_value_dept(dept, percentile, year=None):
         else [Salary.from_date <= datetime.date(year, 12, 31), Salary.to_date >= datetime.date(year, 1, 1),
               DeptEmp.from_date <= datetime.date(year, 12, 31), DeptEmp.to_date >= datetime.date(year, 1, 1)]
 
+    if year is None and current_state.is_enabled():
+        with Session() as session:
+            return session.query(func.percentile_cont(percentile).within_group(asc(CurrentEmployee.salary)).label('percentile_val')) \
+                .filter(CurrentEmployee.dept_no == dept.dept_no) \
+                .one() \
+                .percentile_val
+
     with Session() as session:
         return session.query(func.percentile_cont(percentile).within_group(asc(Salary.salary)).label('percentile_val')) \
             .join(Employee, DeptEmp) \
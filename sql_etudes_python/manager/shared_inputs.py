@@ -0,0 +1,75 @@
+import concurrent.futures
+import contextlib
+import contextvars
+import functools
+import inspect
+import threading
+
+"""
+Sharing of the inputs fetched by several analyses (e.g. the lists of titles, departments and years). Within a scope (see
+scope), the result of a function decorated with shared is computed once for each combination of arguments and returned
+to all calls, including concurrent calls and calls in other threads running in copies of the context (e.g. the ones
+started by map_threads in executor.py in the same package). Outside of a scope, the decorated functions are called as
+usual.
+
+The returned values are shared by the callers and must not be modified. The scopes are opened by the pipeline running
+the analyses (see pipeline.py in the data_analysis package).
+"""
+
+_scope = contextvars.ContextVar('sql_etudes_python_shared_inputs', default=None)
+
+
+class _Scope:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.key_to_future = dict()
+
+
+@contextlib.contextmanager
+def scope():
+    """Context manager within which the results of the functions decorated with shared are computed once (nested scopes
+    share the results of the outermost scope).
+    """
+    if _scope.get() is not None:
+        yield
+        return
+    token = _scope.set(_Scope())
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def is_active():
+    """Check whether the calls are made within a scope."""
+    return _scope.get() is not None
+
+
+def shared(func):
+    """Decorator for functions fetching inputs shared by several analyses (see module description)."""
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        current_scope = _scope.get()
+        if current_scope is None:
+            return func(*args, **kwargs)
+
+        bound_args = signature.bind(*args, **kwargs)
+        bound_args.apply_defaults()
+        key = func.__module__, func.__qualname__, tuple(bound_args.arguments.items())
+
+        # the first call computes the result and the other calls wait for it
+        with current_scope.lock:
+            future = current_scope.key_to_future.get(key)
+            is_first = future is None
+            if is_first:
+                future = current_scope.key_to_future[key] = concurrent.futures.Future()
+        if is_first:
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+    return wrapper
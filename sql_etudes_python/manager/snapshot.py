@@ -0,0 +1,326 @@
+import datetime
+import io
+
+import numpy as np
+
+from sql_etudes_python import constants
+from sql_etudes_python.manager import pooled_connection
+from sql_etudes_python.manager import table_cache
+
+"""
+In-memory columnar snapshot of the employees schema. The tables are loaded once into compact NumPy column arrays
+(emp_no and salaries as int32, dates as int32 day numbers since 1970-01-01 and gender, title and dept_no as small-int
+categorical codes) and cached on disk (see table_cache.py in the same package). The functions in this module provide the filter, join, group and percentile primitives used to
+perform the analyses against the snapshot instead of the database (see analysis_snapshot.py in the data_analysis package).
+"""
+
+# column specifications for the snapshot tables (column name, column kind)
+TABLE_COLUMNS = {
+    'departments': [('dept_no', 'category'), ('dept_name', 'str')],
+    'employees': [('emp_no', 'int'), ('birth_date', 'date'), ('gender', 'category'), ('hire_date', 'date')],
+    'salaries': [('emp_no', 'int'), ('salary', 'int'), ('from_date', 'date'), ('to_date', 'date')],
+    'titles': [('emp_no', 'int'), ('title', 'category'), ('from_date', 'date'), ('to_date', 'date')],
+    'dept_emp': [('emp_no', 'int'), ('dept_no', 'category'), ('from_date', 'date'), ('to_date', 'date')],
+    'dept_manager': [('emp_no', 'int'), ('dept_no', 'category'), ('from_date', 'date'), ('to_date', 'date')],
+}
+
+# queries for the categories of the categorical columns (codes are indices into these lists)
+CATEGORY_QUERIES = {
+    'dept_no': 'SELECT dept_no FROM employees.departments ORDER BY dept_no',
+    'gender': 'SELECT DISTINCT gender::text FROM employees.employees WHERE gender IS NOT NULL ORDER BY 1',
+    'title': 'SELECT DISTINCT title FROM employees.titles ORDER BY title',
+}
+
+# tables from which the categories of the categorical columns are obtained
+CATEGORY_SOURCES = {
+    'dept_no': 'departments',
+    'gender': 'employees',
+    'title': 'titles',
+}
+
+_EPOCH = datetime.date(1970, 1, 1)
+
+
+def to_day_number(date):
+    """Convert a date to its day number (number of days since 1970-01-01)."""
+    return (date - _EPOCH).days
+
+
+# day number of the to_date of current rows
+CURRENT_DAY = to_day_number(datetime.date(9999, 1, 1))
+
+
+class Table:
+    """Table of the snapshot stored as a dictionary of equally long NumPy column arrays."""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def __len__(self):
+        return len(next(iter(self.columns.values())))
+
+    def take(self, idx):
+        """Get table containing the rows selected by a boolean mask or an array of row indices."""
+        return Table({name: col[idx] for name, col in self.columns.items()})
+
+
+class Snapshot:
+    """Snapshot of the employees schema.
+
+    The tables containing an emp_no column also contain an emp_idx column with the index of the employee in the
+    employees table (sorted by emp_no), which is used for joins and lookups.
+    """
+
+    def __init__(self, tables, categories):
+        self.tables = tables
+        self.categories = categories
+        for name, table in tables.items():
+            if name != 'employees' and 'emp_no' in table.columns:
+                table.columns['emp_idx'] = np.searchsorted(tables['employees']['emp_no'], table['emp_no']).astype(np.int32)
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['tables'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def code(self, category, value):
+        """Get the code of a value of a categorical column (-1 if the value is not a category)."""
+        matches = np.flatnonzero(self.categories[category] == value)
+        return int(matches[0]) if len(matches) > 0 else -1
+
+    def is_female(self):
+        """Get boolean array indicating for each employee (by emp_idx) whether the employee is female."""
+        return self.employees['gender'] == self.code('gender', constants.FEMALE)
+
+
+def load_snapshot():
+    """Load the snapshot of the employees schema from the database or from the table cache (see table_cache.py in the
+    same package) if the cached tables match the fingerprints of the tables in the database.
+
+    :return: Snapshot instance
+    """
+    with pooled_connection() as conn:
+        with conn.cursor() as curs:
+            fingerprints = {name: get_table_fingerprint(curs, name) for name in TABLE_COLUMNS.keys()} \
+                if table_cache.is_enabled() \
+                else dict.fromkeys(TABLE_COLUMNS.keys())
+
+            categories = dict()
+            for category, sql_query in CATEGORY_QUERIES.items():
+                categories[category] = table_cache.get_or_fetch(
+                    'category-{0}'.format(category),
+                    fingerprints[CATEGORY_SOURCES[category]],
+                    lambda: {'categories': fetch_categories(curs, sql_query)}
+                )['categories']
+
+            tables = dict()
+            for name, columns in TABLE_COLUMNS.items():
+                # the codes of categorical columns also depend on the tables defining the categories
+                fingerprint = '-'.join([fingerprints[name]] + [fingerprints[CATEGORY_SOURCES[c]] for c, kind in columns if kind == 'category']) \
+                    if table_cache.is_enabled() \
+                    else None
+                tables[name] = Table(table_cache.get_or_fetch(name, fingerprint, lambda: fetch_table(curs, name, categories).columns))
+
+    return Snapshot(tables, categories)
+
+
+def get_table_fingerprint(curs, table_name):
+    """Get the fingerprint of a table used to validate its cached copy.
+
+    :param curs: psycopg2 cursor
+    :param table_name: name of the table (key of TABLE_COLUMNS)
+    :return: fingerprint string
+    """
+    return table_cache.get_table_fingerprint(curs, table_name, checksum=table_name == 'departments')
+
+
+def get_data_fingerprint(curs):
+    """Get a fingerprint of all tables of the employees schema (the data version).
+
+    :param curs: psycopg2 cursor
+    :return: fingerprint string
+    """
+    return '-'.join(get_table_fingerprint(curs, name) for name in TABLE_COLUMNS.keys())
+
+
+def fetch_categories(curs, sql_query):
+    """Fetch the categories of a categorical column.
+
+    :param curs: psycopg2 cursor
+    :param sql_query: query returning the categories
+    :return: array of categories
+    """
+    curs.execute(sql_query)
+    return np.array([r[0] for r in curs.fetchall()], dtype=str)
+
+
+def fetch_table(curs, table_name, categories):
+    """Fetch a table of the employees schema as a dictionary of NumPy column arrays.
+
+    :param curs: psycopg2 cursor
+    :param table_name: name of the table (key of TABLE_COLUMNS)
+    :param categories: dictionary mapping categorical column names to arrays of categories
+    :return: Table instance
+    """
+    columns = TABLE_COLUMNS[table_name]
+    order_by = 'emp_no' if table_name == 'employees' else columns[0][0]
+
+    # fetch str columns separately, encode all other columns as integers in the query
+    str_columns = [name for name, kind in columns if kind == 'str']
+    str_values = []
+    if str_columns:
+        curs.execute('SELECT {0} FROM employees.{1} ORDER BY {2}'.format(', '.join(str_columns), table_name, order_by))
+        str_values = list(zip(*curs.fetchall())) or [()] * len(str_columns)
+    int_columns = [(name, kind) for name, kind in columns if kind != 'str']
+    select_list = []
+    for name, kind in int_columns:
+        if kind == 'date':
+            select_list.append("({0} - DATE '1970-01-01')".format(name))
+        elif kind == 'category':
+            select_list.append(curs.mogrify('coalesce(array_position(%s::text[], {0}::text) - 1, -1)'.format(name),
+                                            (categories[name].tolist(),)).decode())
+        else:
+            select_list.append(name)
+    int_values = fetch_int_columns(
+        curs,
+        'SELECT {0} FROM employees.{1} ORDER BY {2}'.format(', '.join(select_list), table_name, order_by),
+        len(select_list)
+    )
+
+    table_columns = dict()
+    for (name, kind), values in zip(int_columns, int_values):
+        table_columns[name] = values.astype(np.int8 if kind == 'category' else np.int32)
+    for name, values in zip(str_columns, str_values):
+        table_columns[name] = np.array(values, dtype=str)
+    return Table({name: table_columns[name] for name, _ in columns})
+
+
+def fetch_int_columns(curs, sql_query, n_columns):
+    """Fetch the results of a query with integer columns as NumPy arrays using COPY.
+
+    :param curs: psycopg2 cursor
+    :param sql_query: query with integer result columns
+    :param n_columns: number of result columns
+    :return: 2-dimensional int64 array with one row per result column
+    """
+    buf = io.StringIO()
+    curs.copy_expert('COPY ({0}) TO STDOUT'.format(sql_query), buf)
+    return np.fromstring(buf.getvalue(), dtype=np.int64, sep=' ').reshape(-1, n_columns).T
+
+
+# filters ###
+
+def period_mask(table, year=None):
+    """Get mask of rows that are current (year is None) or that overlap the specified year."""
+    if year is None:
+        return table['to_date'] == CURRENT_DAY
+    return (table['from_date'] <= to_day_number(datetime.date(year, 12, 31))) & (table['to_date'] >= to_day_number(datetime.date(year, 1, 1)))
+
+
+def years_of(day_numbers):
+    """Get the years of an array of day numbers."""
+    return day_numbers.astype('datetime64[D]').astype('datetime64[Y]').astype(np.int32) + 1970
+
+# /filters ###
+
+
+# joins ###
+
+def join(left_keys, right_keys):
+    """Inner join of two key arrays.
+
+    :return: tuple of arrays of left and right row indices of the joined rows
+    """
+    order = np.argsort(right_keys, kind='stable')
+    sorted_keys = right_keys[order]
+    lo = np.searchsorted(sorted_keys, left_keys, side='left')
+    n = np.searchsorted(sorted_keys, left_keys, side='right') - lo
+    left = np.repeat(np.arange(len(left_keys)), n)
+    offset = np.arange(len(left)) - np.repeat(np.cumsum(n) - n, n)
+    return left, order[np.repeat(lo, n) + offset]
+
+
+def isin(keys, key_set):
+    """Get mask of keys contained in the key set."""
+    return np.isin(keys, key_set)
+
+# /joins ###
+
+
+# groups ###
+
+def gender_counts(emp_idx, is_female):
+    """Get the (total, female, male) counts of the distinct employees in an array of employee indices."""
+    emp_idx = np.unique(emp_idx)
+    female = int(np.count_nonzero(is_female[emp_idx]))
+    return len(emp_idx), female, len(emp_idx) - female
+
+
+def group_gender_counts(codes, emp_idx, is_female, n_groups):
+    """Get the (total, female, male) counts of the distinct employees for each group code in [0, n_groups)."""
+    codes_emps = np.unique(codes.astype(np.int64) * len(is_female) + emp_idx)
+    codes, emp_idx = np.divmod(codes_emps, len(is_female))
+    total = np.bincount(codes, minlength=n_groups)
+    female = np.bincount(codes[is_female[emp_idx]], minlength=n_groups)
+    return [(int(t), int(f), int(t - f)) for t, f in zip(total, female)]
+
+
+def group_max(codes, values, n_groups, fill=-1):
+    """Get the highest value for each group code in [0, n_groups) (fill for empty groups)."""
+    res = np.full(n_groups, fill, dtype=values.dtype)
+    order = np.argsort(codes, kind='stable')
+    codes, values = codes[order], values[order]
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) > 0 else np.array([], dtype=np.int64)
+    if len(starts) > 0:
+        res[codes[starts]] = np.maximum.reduceat(values, starts)
+    return res
+
+
+def group_mean(codes, values, n_groups):
+    """Get the mean value for each group code in [0, n_groups) (NaN for empty groups)."""
+    counts = np.bincount(codes, minlength=n_groups)
+    sums = np.bincount(codes, weights=values, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+# /groups ###
+
+
+# percentiles ###
+
+def percentile(values, q, method='cont'):
+    """Compute a percentile with the semantics of PostgreSQL's percentile_cont/percentile_disc (None for no values)."""
+    return group_percentile(np.zeros(len(values), dtype=np.int64), values, q, 1, method)[0]
+
+
+def group_percentile(codes, values, q, n_groups, method='cont'):
+    """Compute a percentile of values for each group code in [0, n_groups) with the semantics of PostgreSQL's
+    percentile_cont/percentile_disc (None for empty groups).
+    """
+    order = np.lexsort((values, codes))
+    values = values[order].astype(np.float64)
+    counts = np.bincount(codes, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+    nonempty = np.flatnonzero(counts)
+    counts, starts = counts[nonempty], starts[nonempty]
+
+    if method == 'cont':
+        pos = q * (counts - 1)
+        lo, hi = np.floor(pos).astype(np.int64), np.ceil(pos).astype(np.int64)
+        lo_val, hi_val = values[starts + lo], values[starts + hi]
+        percentile_vals = (lo_val + (pos - lo) * (hi_val - lo_val)).tolist()
+    elif method == 'disc':
+        percentile_vals = values[starts + np.maximum(np.ceil(q * counts).astype(np.int64) - 1, 0)].astype(np.int64).tolist()
+    else:
+        raise ValueError('Unknown method {0}'.format(method))
+
+    res = [None] * n_groups
+    for g, percentile_val in zip(nonempty, percentile_vals):
+        res[g] = percentile_val
+    return res
+
+# /percentiles ###
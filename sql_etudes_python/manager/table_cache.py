@@ -0,0 +1,101 @@
+import hashlib
+import os
+import shutil
+import uuid
+
+import numpy as np
+
+"""
+On-disk cache of tables fetched from the database as NumPy column arrays. Each cache entry is a directory containing
+one .npy file per array that is loaded back zero-copy using memory mapping, so that repeated runs skip the transfer
+from the database and several processes can share one page-cached copy of the data. Entries are keyed by a fingerprint
+of the contents of the source table (row count and sum of the hashes of the rows or a checksum of the whole table) and
+replaced when the fingerprint changes.
+
+The cache directory can be set with the SQL_ETUDES_CACHE_DIR environment variable and the cache can be disabled by
+setting the SQL_ETUDES_TABLE_CACHE environment variable to 0.
+"""
+
+
+def is_enabled():
+    return os.environ.get('SQL_ETUDES_TABLE_CACHE', '1') != '0'
+
+
+def get_cache_dir():
+    return os.path.join(os.environ.get('SQL_ETUDES_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'sql_etudes_python')), 'tables')
+
+
+def get_table_fingerprint(curs, table_name, checksum=False):
+    """Get a fingerprint of a table in the employees schema.
+
+    :param curs: psycopg2 cursor
+    :param table_name: name of the table
+    :param checksum: if True, use an exact checksum of the ordered rows of the whole table (only suitable for small
+    tables) instead of the sum of the hashes of the rows
+    :return: fingerprint string
+    """
+    # the hashes of the rows include all columns, so in-place updates of existing rows change the fingerprint
+    select_list = ['count(*)', "md5(string_agg(t::text, ',' ORDER BY t::text))" if checksum else 'sum(hashtext(t::text)::bigint)']
+    curs.execute('SELECT {0} FROM employees.{1} t'.format(', '.join(select_list), table_name))
+    return hashlib.sha1(repr(curs.fetchone()).encode()).hexdigest()[:16]
+
+
+def get_or_fetch(name, fingerprint, fetch):
+    """Get the arrays cached for a name and fingerprint or fetch and cache them.
+
+    :param name: name of the cached data (e.g. table name)
+    :param fingerprint: fingerprint of the source data
+    :param fetch: function returning a dictionary mapping array names to NumPy arrays
+    :return: dictionary mapping array names to (memory mapped) NumPy arrays
+    """
+    if not is_enabled():
+        return fetch()
+    arrays = load_arrays(name, fingerprint)
+    if arrays is None:
+        store_arrays(name, fingerprint, fetch())
+        arrays = load_arrays(name, fingerprint)
+    return arrays
+
+
+def load_arrays(name, fingerprint):
+    """Load the arrays cached for a name and fingerprint using memory mapping (None if not cached)."""
+    entry_dir = _get_entry_dir(name, fingerprint)
+    if not os.path.isdir(entry_dir):
+        return None
+    return {file_name[:-len('.npy')]: np.load(os.path.join(entry_dir, file_name), mmap_mode='r')
+            for file_name in sorted(os.listdir(entry_dir)) if file_name.endswith('.npy')}
+
+
+def store_arrays(name, fingerprint, arrays):
+    """Store arrays for a name and fingerprint and remove entries for the same name with other fingerprints.
+
+    The arrays are written to a temporary directory that is then renamed, so concurrent readers never see partially
+    written entries.
+    """
+    cache_dir = get_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = os.path.join(cache_dir, '.tmp-{0}'.format(uuid.uuid4().hex))
+    os.makedirs(tmp_dir)
+    try:
+        for array_name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, '{0}.npy'.format(array_name)), np.ascontiguousarray(array))
+        os.rename(tmp_dir, _get_entry_dir(name, fingerprint))
+    except OSError:
+        # entry already stored by another process
+        if not os.path.isdir(_get_entry_dir(name, fingerprint)):
+            raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    for entry in os.listdir(cache_dir):
+        if entry.startswith(name + '-') and entry != os.path.basename(_get_entry_dir(name, fingerprint)):
+            shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
+
+
+def clear():
+    """Remove all cached tables."""
+    shutil.rmtree(get_cache_dir(), ignore_errors=True)
+
+
+def _get_entry_dir(name, fingerprint):
+    return os.path.join(get_cache_dir(), '{0}-{1}'.format(name, fingerprint))
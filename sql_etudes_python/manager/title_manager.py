@@ -1,12 +1,20 @@
 from sql_etudes_python.manager import Session
+from sql_etudes_python.manager import shared_inputs
 from sql_etudes_python.entities.entities import Title
 
-# TODO modify to return list of strings
-def get_all_distinct_titles():
+@shared_inputs.shared
+def get_all_distinct_titles(lite=False):
     with Session() as session:
-        return session.query(Title.title) \
+        titles = session.query(Title.title) \
             .distinct() \
             .all()
+        # in lite mode, return the titles as plain strings
+        return [t.title for t in titles] if lite else titles
+
+
+def get_title_name(title):
+    # the manager functions accept titles as plain strings (lite mode) or as rows with a title attribute
+    return title if isinstance(title, str) else title.title
 
 
 if __name__ == '__main__':
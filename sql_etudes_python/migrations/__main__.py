@@ -0,0 +1,62 @@
+import argparse
+import json
+import sys
+
+from sql_etudes_python.manager import current_state
+from sql_etudes_python.migrations import logger
+from sql_etudes_python.migrations import migrate
+from sql_etudes_python.migrations import report
+
+"""
+Command line interface of the migrations of the configured database (see the __init__.py script in the manager package).
+
+Examples:
+python -m sql_etudes_python.migrations status
+python -m sql_etudes_python.migrations upgrade --report --report-output migration_report.json
+python -m sql_etudes_python.migrations downgrade 0
+python -m sql_etudes_python.migrations refresh
+python -m sql_etudes_python.migrations refresh employee_year --blocking
+"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sql_etudes_python.migrations', description='Migrate the employees schema.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('status', help='list the migrations and whether they are applied')
+    refresh_parser = subparsers.add_parser('refresh', help='refresh the materialized views')
+    refresh_parser.add_argument('views', nargs='*', help='names of the materialized views to refresh (all if not given)')
+    refresh_parser.add_argument('--blocking', action='store_true', help='lock out the queries reading the views while refreshing them')
+    for command, help_text in (('upgrade', 'apply the migrations'), ('downgrade', 'revert the migrations')):
+        subparser = subparsers.add_parser(command, help=help_text)
+        subparser.add_argument('version', type=int, nargs='?' if command == 'upgrade' else None,
+                               help='version to migrate to' + (' (latest if not given)' if command == 'upgrade' else ''))
+        subparser.add_argument('--report', action='store_true', help='measure the hot paths before and after the migration')
+        subparser.add_argument('--report-cases', nargs='+', default=None, help='shell-style patterns of the benchmark cases measured')
+        subparser.add_argument('--report-repeat', type=int, default=3, help='number of timed runs of each measured case')
+        subparser.add_argument('--report-output', default=None, help='path of a JSON file to which the measurements are written')
+    args = parser.parse_args(argv)
+
+    if args.command == 'status':
+        for version, name, applied_at in migrate.get_status():
+            print('{0:>4}  {1:<40} {2}'.format(version, name, applied_at.isoformat() if applied_at is not None else 'not applied'))
+        return 0
+    if args.command == 'refresh':
+        for view_name in args.views or current_state.get_view_names():
+            current_state.refresh_view(view_name, concurrently=not args.blocking)
+            logger.info('Refreshed employees.{0}'.format(view_name))
+        return 0
+
+    before = report.measure(args.report_cases, args.report_repeat) if args.report else None
+    version = migrate.upgrade(args.version) if args.command == 'upgrade' else migrate.downgrade(args.version)
+    logger.info('Schema at version {0}'.format(version))
+    if args.report:
+        after = report.measure(args.report_cases, args.report_repeat)
+        report.log_report(before, after)
+        if args.report_output is not None:
+            with open(args.report_output, 'w') as f:
+                json.dump({'version': version, 'before': before, 'after': after}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+from sql_etudes_python.manager import current_state
+from sql_etudes_python.manager import pooled_connection
+from sql_etudes_python.migrations import logger
+from sql_etudes_python.migrations.versions import MIGRATIONS, get_latest_version
+
+"""
+Application of the migrations (see versions.py in the same package) to the configured database (see the __init__.py
+script in the manager package). Each migration is applied (or reverted) in its own transaction together with the
+update of the employees.schema_migrations table, so that an interrupted run leaves the schema at a recorded version.
+
+The indexes are not built concurrently, so the tables are locked for writes while a migration is applied.
+"""
+
+
+def get_current_version():
+    """Get the version of the schema (0 if no migrations were applied)."""
+    with pooled_connection() as conn:
+        with conn.cursor() as curs:
+            _create_migrations_table(curs)
+            curs.execute('SELECT coalesce(max(version), 0) FROM employees.schema_migrations')
+            return curs.fetchone()[0]
+
+
+def get_status():
+    """Get the migrations and whether they are applied.
+
+    :return: list of (version, name, time applied or None) triplets
+    """
+    with pooled_connection() as conn:
+        with conn.cursor() as curs:
+            _create_migrations_table(curs)
+            curs.execute('SELECT version, applied_at FROM employees.schema_migrations')
+            version_to_applied_at = dict(curs.fetchall())
+    return [(m.version, m.name, version_to_applied_at.get(m.version)) for m in MIGRATIONS]
+
+
+def upgrade(target_version=None):
+    """Apply the migrations up to a version.
+
+    :param target_version: version to upgrade to (the latest version if None)
+    :return: version of the schema after the upgrade
+    """
+    target_version = target_version if target_version is not None else get_latest_version()
+    current_version = get_current_version()
+    for migration in MIGRATIONS:
+        if current_version < migration.version <= target_version:
+            logger.info('Applying migration {0} ({1})'.format(migration.version, migration.name))
+            with pooled_connection() as conn:
+                with conn.cursor() as curs:
+                    for statement in migration.upgrade:
+                        curs.execute(statement)
+                    curs.execute('INSERT INTO employees.schema_migrations (version, name) VALUES (%(version)s, %(name)s)',
+                                 {'version': migration.version, 'name': migration.name})
+            current_version = migration.version
+    current_state.reset()
+    return current_version
+
+
+def downgrade(target_version):
+    """Revert the migrations down to a version.
+
+    :param target_version: version to downgrade to (0 reverts all migrations)
+    :return: version of the schema after the downgrade
+    """
+    current_version = get_current_version()
+    for migration in reversed(MIGRATIONS):
+        if target_version < migration.version <= current_version:
+            logger.info('Reverting migration {0} ({1})'.format(migration.version, migration.name))
+            with pooled_connection() as conn:
+                with conn.cursor() as curs:
+                    for statement in migration.downgrade:
+                        curs.execute(statement)
+                    curs.execute('DELETE FROM employees.schema_migrations WHERE version = %(version)s', {'version': migration.version})
+    current_state.reset()
+    return get_current_version()
+
+
+def _create_migrations_table(curs):
+    curs.execute("""CREATE TABLE IF NOT EXISTS employees.schema_migrations (
+                        version INT NOT NULL PRIMARY KEY,
+                        name VARCHAR(100) NOT NULL,
+                        applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now())""")
@@ -0,0 +1,73 @@
+import collections
+import fnmatch
+import re
+import time
+
+from sql_etudes_python.manager import instrumentation
+from sql_etudes_python.migrations import logger
+
+"""
+Before/after report of the query times of the hot paths (by default the query functions of the manager scripts called
+with sample arguments, see cases.py in the benchmark package) for a schema change. For each case, the minimum wall time
+of several runs and the tables that the plans of its queries scan sequentially (from the EXPLAIN (ANALYZE, BUFFERS)
+output sampled by the instrumentation, see instrumentation.py in the manager package) are recorded.
+"""
+
+DEFAULT_CASES = ['employee_manager.*', 'salary_manager.*']
+
+_SEQ_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+
+def measure(case_patterns=None, repeat=3):
+    """Measure the hot paths against the configured database.
+
+    :param case_patterns: shell-style patterns of the names of the benchmark cases to run (DEFAULT_CASES if None)
+    :param repeat: number of timed runs of each case
+    :return: map of case names to dictionaries with the wall_time and seq_scans keys
+    """
+    from sql_etudes_python.benchmark import cases
+
+    patterns = case_patterns if case_patterns is not None else DEFAULT_CASES
+    selected = [case for name, case in cases.get_cases().items() if any(fnmatch.fnmatchcase(name, p) for p in patterns)]
+    inputs = {case.name: case.prepare() for case in selected}
+
+    # the first run of each case samples the plans of its queries
+    instrumentation.enable(explain_threshold=0.0)
+    try:
+        case_to_seq_scans = dict()
+        for case in selected:
+            with instrumentation.stage(case.name):
+                case.run(inputs[case.name])
+        for e in instrumentation.get_report():
+            scanned = case_to_seq_scans.setdefault(e['stage'], set())
+            for plan in e['explain']:
+                scanned.update(_SEQ_SCAN.findall(plan))
+    finally:
+        instrumentation.disable()
+
+    res = collections.OrderedDict()
+    for case in selected:
+        wall_times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            case.run(inputs[case.name])
+            wall_times.append(time.perf_counter() - start)
+        res[case.name] = {'wall_time': min(wall_times), 'seq_scans': sorted(case_to_seq_scans.get(case.name, set()))}
+    return res
+
+
+def format_report(before, after):
+    """Format the measurements before and after a schema change as a table."""
+    lines = ['{0:<70} {1:>10} {2:>10} {3:>7}  {4}'.format('case', 'before', 'after', 'ratio', 'sequential scans (before -> after)')]
+    for case_name, b in before.items():
+        a = after.get(case_name)
+        if a is None:
+            continue
+        lines.append('{0:<70} {1:>10.4f} {2:>10.4f} {3:>7.2f}  {4} -> {5}'.format(
+            case_name, b['wall_time'], a['wall_time'], a['wall_time'] / b['wall_time'] if b['wall_time'] > 0 else float('inf'),
+            ', '.join(b['seq_scans']) or '-', ', '.join(a['seq_scans']) or '-'))
+    return '\n'.join(lines)
+
+
+def log_report(before, after):
+    logger.info('Query times before and after the migration:\n{0}'.format(format_report(before, after)))
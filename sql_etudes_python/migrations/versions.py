@@ -0,0 +1,165 @@
+import collections
+
+"""
+Versioned migrations of the employees schema (see db-init/build-scripts/employees.sql). Each migration has a version
+number (the migrations are applied in the order of their versions), a name and the lists of statements upgrading the
+schema to the version and downgrading it to the previous version. The applied migrations are recorded in the
+employees.schema_migrations table (see migrate.py in the same package).
+
+Add new migrations to the end of the MIGRATIONS list and never change a migration that may have been applied.
+"""
+
+Migration = collections.namedtuple('Migration', ['version', 'name', 'upgrade', 'downgrade'])
+
+MIGRATIONS = [
+    Migration(
+        1,
+        'temporal_indexes',
+        [
+            # current rows (to_date = '9999-01-01'), looked up by employee with the salary read from the index
+            "CREATE INDEX salaries_current_emp_no_idx ON employees.salaries (emp_no) INCLUDE (salary) WHERE to_date = '9999-01-01'",
+            "CREATE INDEX titles_current_emp_no_idx ON employees.titles (emp_no) INCLUDE (title) WHERE to_date = '9999-01-01'",
+            "CREATE INDEX dept_emp_current_dept_no_idx ON employees.dept_emp (dept_no) INCLUDE (emp_no) WHERE to_date = '9999-01-01'",
+            "CREATE INDEX dept_emp_current_emp_no_idx ON employees.dept_emp (emp_no) INCLUDE (dept_no) WHERE to_date = '9999-01-01'",
+            "CREATE INDEX dept_manager_current_emp_no_idx ON employees.dept_manager (emp_no) INCLUDE (dept_no) WHERE to_date = '9999-01-01'",
+            # employees currently having a title (a full (title, to_date) index is also picked for the per-year queries, which
+            # it slows down)
+            "CREATE INDEX titles_current_title_idx ON employees.titles (title) INCLUDE (emp_no) WHERE to_date = '9999-01-01'",
+            'ANALYZE employees.salaries',
+            'ANALYZE employees.titles',
+            'ANALYZE employees.dept_emp',
+            'ANALYZE employees.dept_manager',
+        ],
+        [
+            'DROP INDEX employees.salaries_current_emp_no_idx',
+            'DROP INDEX employees.titles_current_emp_no_idx',
+            'DROP INDEX employees.dept_emp_current_dept_no_idx',
+            'DROP INDEX employees.dept_emp_current_emp_no_idx',
+            'DROP INDEX employees.dept_manager_current_emp_no_idx',
+            'DROP INDEX employees.titles_current_title_idx',
+        ]
+    ),
+    Migration(
+        2,
+        'current_employees_view',
+        [
+            # one row per current employee (an employee with a current department, title, salary or managed department)
+            # with the current values (NULL if the employee has no current row in the table), see the current_state.py
+            # script in the manager package
+            """CREATE MATERIALIZED VIEW employees.current_employees AS
+               SELECT employees.emp_no,
+                      employees.gender::text AS gender,
+                      dept_emp.dept_no,
+                      titles.title,
+                      salaries.salary,
+                      dept_manager.emp_no IS NOT NULL AS is_manager
+               FROM employees.employees
+               LEFT JOIN employees.dept_emp ON dept_emp.emp_no = employees.emp_no AND dept_emp.to_date = '9999-01-01'
+               LEFT JOIN employees.titles ON titles.emp_no = employees.emp_no AND titles.to_date = '9999-01-01'
+               LEFT JOIN employees.salaries ON salaries.emp_no = employees.emp_no AND salaries.to_date = '9999-01-01'
+               LEFT JOIN employees.dept_manager ON dept_manager.emp_no = employees.emp_no AND dept_manager.to_date = '9999-01-01'
+               WHERE dept_emp.emp_no IS NOT NULL
+               OR titles.emp_no IS NOT NULL
+               OR salaries.emp_no IS NOT NULL
+               OR dept_manager.emp_no IS NOT NULL""",
+            # the unique index fails the migration (and the refreshes) if an employee has several current rows in a table
+            # and allows refreshing the view concurrently
+            'CREATE UNIQUE INDEX current_employees_emp_no_idx ON employees.current_employees (emp_no)',
+            'CREATE INDEX current_employees_dept_no_idx ON employees.current_employees (dept_no)',
+            'CREATE INDEX current_employees_title_idx ON employees.current_employees (title)',
+            'CREATE INDEX current_employees_is_manager_idx ON employees.current_employees (emp_no) WHERE is_manager',
+            'ANALYZE employees.current_employees',
+        ],
+        [
+            'DROP MATERIALIZED VIEW employees.current_employees',
+        ]
+    ),
+    Migration(
+        3,
+        'employee_year_fact_table',
+        [
+            # one row per employee and year (from the first to the last year in which salaries start) in which the employee
+            # has a salary, department, title or managed department, see employee_year_manager.py in the manager package
+            """CREATE MATERIALIZED VIEW employees.employee_year AS
+               WITH bounds AS (
+                   SELECT min(EXTRACT(YEAR FROM from_date))::int AS first_year, max(EXTRACT(YEAR FROM from_date))::int AS last_year
+                   FROM employees.salaries
+               ),
+               salary_years AS (
+                   SELECT salaries.emp_no, years.year, max(salaries.salary) AS salary, min(salaries.salary) AS min_salary
+                   FROM employees.salaries
+                   CROSS JOIN bounds
+                   CROSS JOIN LATERAL generate_series(greatest(EXTRACT(YEAR FROM salaries.from_date)::int, bounds.first_year),
+                                                      least(EXTRACT(YEAR FROM salaries.to_date)::int, bounds.last_year)) AS years(year)
+                   GROUP BY salaries.emp_no, years.year
+               ),
+               dept_years AS (
+                   SELECT DISTINCT ON (dept_emp.emp_no, years.year) dept_emp.emp_no, years.year, dept_emp.dept_no
+                   FROM employees.dept_emp
+                   CROSS JOIN bounds
+                   CROSS JOIN LATERAL generate_series(greatest(EXTRACT(YEAR FROM dept_emp.from_date)::int, bounds.first_year),
+                                                      least(EXTRACT(YEAR FROM dept_emp.to_date)::int, bounds.last_year)) AS years(year)
+                   ORDER BY dept_emp.emp_no, years.year, dept_emp.from_date DESC, dept_emp.dept_no
+               ),
+               title_years AS (
+                   SELECT DISTINCT ON (titles.emp_no, years.year) titles.emp_no, years.year, titles.title
+                   FROM employees.titles
+                   CROSS JOIN bounds
+                   CROSS JOIN LATERAL generate_series(greatest(EXTRACT(YEAR FROM titles.from_date)::int, bounds.first_year),
+                                                      least(EXTRACT(YEAR FROM titles.to_date)::int, bounds.last_year)) AS years(year)
+                   ORDER BY titles.emp_no, years.year, titles.from_date DESC, titles.title
+               ),
+               manager_years AS (
+                   SELECT DISTINCT dept_manager.emp_no, years.year, dept_manager.dept_no
+                   FROM employees.dept_manager
+                   CROSS JOIN bounds
+                   CROSS JOIN LATERAL generate_series(greatest(EXTRACT(YEAR FROM dept_manager.from_date)::int, bounds.first_year),
+                                                      least(EXTRACT(YEAR FROM dept_manager.to_date)::int, bounds.last_year)) AS years(year)
+               ),
+               dept_manager_salaries AS (
+                   SELECT manager_years.dept_no,
+                          manager_years.year,
+                          (array_agg(manager_years.emp_no ORDER BY salary_years.min_salary))[1] AS lowest_emp_no,
+                          (array_agg(salary_years.min_salary ORDER BY salary_years.min_salary))[1] AS lowest_salary,
+                          (array_agg(salary_years.min_salary ORDER BY salary_years.min_salary))[2] AS second_lowest_salary
+                   FROM manager_years
+                   JOIN salary_years ON salary_years.emp_no = manager_years.emp_no AND salary_years.year = manager_years.year
+                   GROUP BY manager_years.dept_no, manager_years.year
+               ),
+               keys AS (
+                   SELECT emp_no, year FROM salary_years
+                   UNION SELECT emp_no, year FROM dept_years
+                   UNION SELECT emp_no, year FROM title_years
+                   UNION SELECT emp_no, year FROM manager_years
+               )
+               SELECT keys.emp_no,
+                      keys.year,
+                      employees.gender::text AS gender,
+                      dept_years.dept_no,
+                      title_years.title,
+                      salary_years.salary,
+                      EXISTS (SELECT 1 FROM manager_years WHERE manager_years.emp_no = keys.emp_no AND manager_years.year = keys.year) AS is_manager,
+                      CASE WHEN dept_manager_salaries.lowest_emp_no = keys.emp_no
+                           THEN dept_manager_salaries.second_lowest_salary
+                           ELSE dept_manager_salaries.lowest_salary
+                      END AS manager_salary
+               FROM keys
+               JOIN employees.employees ON employees.emp_no = keys.emp_no
+               LEFT JOIN salary_years ON salary_years.emp_no = keys.emp_no AND salary_years.year = keys.year
+               LEFT JOIN dept_years ON dept_years.emp_no = keys.emp_no AND dept_years.year = keys.year
+               LEFT JOIN title_years ON title_years.emp_no = keys.emp_no AND title_years.year = keys.year
+               LEFT JOIN dept_manager_salaries ON dept_manager_salaries.dept_no = dept_years.dept_no AND dept_manager_salaries.year = keys.year""",
+            # the unique index allows refreshing the view concurrently
+            'CREATE UNIQUE INDEX employee_year_emp_no_year_idx ON employees.employee_year (emp_no, year)',
+            'CREATE INDEX employee_year_year_dept_no_idx ON employees.employee_year (year, dept_no)',
+            'ANALYZE employees.employee_year',
+        ],
+        [
+            'DROP MATERIALIZED VIEW employees.employee_year',
+        ]
+    ),
+]
+
+
+def get_latest_version():
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
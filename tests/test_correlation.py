@@ -0,0 +1,96 @@
+import unittest
+import warnings
+
+import numpy as np
+import scipy.stats as stats
+
+from sql_etudes_python.data_analysis import correlation
+
+"""
+Tests comparing the vectorized correlation analysis (see correlation.py in the data_analysis package) with the
+corresponding functions of scipy.stats.
+"""
+
+N_RESAMPLES = 4000
+
+
+def get_data():
+    """Get features (a correlated, an uncorrelated and a constant feature) and a target for 9 samples."""
+    rng = np.random.default_rng(1)
+    target = rng.normal(size=9)
+    features = np.vstack([target + rng.normal(size=9), rng.normal(size=9), np.ones(9)])
+    return ['correlated', 'uncorrelated', 'constant'], features, target
+
+
+def pearson(x, y, axis):
+    """Compute the Pearson correlation coefficients of x and y along an axis (the vectorized statistic used with the
+    resampling functions of scipy.stats, scipy.stats.pearsonr only accepts an axis as of scipy 1.13).
+    """
+    x, y = np.broadcast_arrays(x, y)
+    x = x - x.mean(axis=axis, keepdims=True)
+    y = y - y.mean(axis=axis, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (x * y).sum(axis=axis) / np.sqrt((x ** 2).sum(axis=axis) * (y ** 2).sum(axis=axis))
+
+
+class TestGetCorrelations(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.feature_names, cls.features, cls.target = get_data()
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            cls.correlations = correlation.get_correlations(cls.feature_names, cls.features, cls.target, n_resamples=N_RESAMPLES, seed=0)
+
+    def test_dims(self):
+        self.assertEqual(self.correlations.dims, ('feature', 'method', 'statistic'))
+        self.assertEqual(self.correlations.coords['feature'], self.feature_names)
+        self.assertEqual(self.correlations.coords['method'], correlation.METHODS)
+        self.assertEqual(self.correlations.coords['statistic'], correlation.STATISTICS)
+
+    def test_reproducible(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            correlations = correlation.get_correlations(self.feature_names, self.features, self.target, n_resamples=N_RESAMPLES, seed=0)
+        np.testing.assert_array_equal(correlations.values, self.correlations.values)
+
+    def test_analytic(self):
+        for name, x in zip(self.feature_names[:2], self.features):
+            for method, func in (('pearson', stats.pearsonr), ('spearman', stats.spearmanr)):
+                r, p_value = func(x, self.target)
+                self.assertAlmostEqual(self.correlations.sel(feature=name, method=method, statistic='r'), r)
+                self.assertAlmostEqual(self.correlations.sel(feature=name, method=method, statistic='p_value'), p_value)
+
+    def test_permutation_p_values(self):
+        for name, x in zip(self.feature_names[:2], self.features):
+            for method, rank in (('pearson', False), ('spearman', True)):
+                # the p-values are the portions of the permutations with an absolute coefficient at least as large (the
+                # Spearman coefficients are the Pearson coefficients of the ranks)
+                y = stats.rankdata(self.target) if rank else self.target
+                res = stats.permutation_test((stats.rankdata(x) if rank else x,), lambda x, axis: np.abs(pearson(x, y, axis)),
+                                             permutation_type='pairings', alternative='greater', n_resamples=N_RESAMPLES, random_state=0)
+                self.assertAlmostEqual(self.correlations.sel(feature=name, method=method, statistic='permutation_p_value'), res.pvalue, delta=0.03)
+
+    def test_bootstrap_ci(self):
+        def get_statistic(rank):
+            def statistic(x, y, axis):
+                if rank:
+                    x, y = stats.rankdata(x, axis=axis), stats.rankdata(y, axis=axis)
+                return pearson(x, y, axis)
+            return statistic
+
+        for name, x in zip(self.feature_names[:2], self.features):
+            for method, rank in (('pearson', False), ('spearman', True)):
+                with warnings.catch_warnings():
+                    # the coefficients of the resamples in which the feature or the target is constant are NaN
+                    warnings.simplefilter('ignore')
+                    res = stats.bootstrap((x, self.target), get_statistic(rank), paired=True, method='percentile', n_resamples=N_RESAMPLES, random_state=0)
+                self.assertAlmostEqual(self.correlations.sel(feature=name, method=method, statistic='ci_low'), res.confidence_interval.low, delta=0.05)
+                self.assertAlmostEqual(self.correlations.sel(feature=name, method=method, statistic='ci_high'), res.confidence_interval.high, delta=0.05)
+
+    def test_constant_feature(self):
+        self.assertTrue(np.all(np.isnan(self.correlations.sel(feature='constant').values)))
+
+
+if __name__ == '__main__':
+    unittest.main()
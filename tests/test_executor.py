@@ -0,0 +1,26 @@
+import unittest
+
+from sql_etudes_python.manager import executor
+
+"""
+Tests for the conversion of the SQL queries written for psycopg2 executed by executor.execute_all_sql (see executor.py
+in the manager package).
+"""
+
+
+class TestToNamedPlaceholders(unittest.TestCase):
+
+    def test_placeholders(self):
+        self.assertEqual(executor._to_named_placeholders('SELECT * FROM t WHERE a = %(a)s AND b = %(b)s'), 'SELECT * FROM t WHERE a = :a AND b = :b')
+
+    def test_escaped_percent_signs(self):
+        self.assertEqual(executor._to_named_placeholders("SELECT * FROM t WHERE dept_no LIKE 'd%%' AND a = %(a)s"),
+                         "SELECT * FROM t WHERE dept_no LIKE 'd%' AND a = :a")
+        self.assertEqual(executor._to_named_placeholders("SELECT '%%(a)s'"), "SELECT '%(a)s'")
+
+    def test_colons(self):
+        self.assertEqual(executor._to_named_placeholders('SELECT %(a)s::int'), 'SELECT :a\\:\\:int')
+
+
+if __name__ == '__main__':
+    unittest.main()
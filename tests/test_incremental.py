@@ -0,0 +1,96 @@
+import unittest
+
+import numpy as np
+
+from sql_etudes_python.data_analysis import incremental
+from sql_etudes_python.data_analysis.res_container import ArrayResContainer
+
+"""
+Tests for the change detection and the merging of the results of the incremental recomputation of the yearly analyses
+(see incremental.py in the data_analysis package).
+"""
+
+YEARS = [2000, 2001]
+
+
+def get_watermarks(**changes):
+    """Get watermarks (in the layout returned by incremental.get_watermarks) for the years 2000 and 2001 and the
+    departments d001 and d002.
+
+    :param changes: map of table names to the keys (years or (year, department number) pairs) whose watermarks are
+    changed ('departments' to change the checksum of the departments table)
+    :return: map of table names to watermarks
+    """
+    watermarks = {
+        'departments': (2, 100),
+        'salaries': {year: (10, '{0}-06-01'.format(year), year) for year in YEARS},
+        'dept_emp': {(year, dept_no): (5, '{0}-03-01'.format(year), year) for year in YEARS for dept_no in ['d001', 'd002']},
+    }
+    for table_name, keys in changes.items():
+        if table_name == 'departments':
+            watermarks[table_name] = (2, 101)
+            continue
+        for key in keys:
+            n_rows, max_from_date, checksum = watermarks[table_name].get(key, (0, '', 0))
+            watermarks[table_name][key] = (n_rows, max_from_date, checksum + 1)
+    return watermarks
+
+
+def get_res_container(years, value, dept_names=('Finance', 'Marketing')):
+    """Get results (in the layout of the 4. analysis) for years with all counts set to value."""
+    res_container = ArrayResContainer()
+    res_container.add_array_with_desc('n_employees_earn_more_than_managers', np.full(len(years), value), ['year'], {'year': years}, 'by year')
+    res_container.add_array_with_desc('n_employees_earn_more_than_managers_by_dept', np.full((len(years), len(dept_names)), value),
+                                      ['year', 'dept'], {'year': years, 'dept': list(dept_names)}, 'by year and department')
+    return res_container
+
+
+class TestGetYearsToRecompute(unittest.TestCase):
+
+    def test_unchanged(self):
+        self.assertEqual(incremental._get_years_to_recompute(get_watermarks(), get_watermarks(), YEARS, set(YEARS)), dict())
+
+    def test_no_stored_watermarks(self):
+        self.assertEqual(incremental._get_years_to_recompute(None, get_watermarks(), YEARS, set()), {2000: None, 2001: None})
+
+    def test_new_year(self):
+        watermarks = get_watermarks(salaries=[2002])
+        years_to_recompute = incremental._get_years_to_recompute(get_watermarks(), watermarks, YEARS + [2002], set(YEARS))
+        self.assertEqual(years_to_recompute, {2002: None})
+
+    def test_department_only_change(self):
+        watermarks = get_watermarks(dept_emp=[(2001, 'd002')])
+        self.assertEqual(incremental._get_years_to_recompute(get_watermarks(), watermarks, YEARS, set(YEARS)), {2001: {'d002'}})
+
+    def test_department_and_year_change(self):
+        # a change of a table with watermarks for each year recomputes all departments of the year
+        watermarks = get_watermarks(dept_emp=[(2001, 'd002')], salaries=[2001])
+        self.assertEqual(incremental._get_years_to_recompute(get_watermarks(), watermarks, YEARS, set(YEARS)), {2001: None})
+
+    def test_global_table_change(self):
+        watermarks = get_watermarks(departments=True)
+        self.assertEqual(incremental._get_years_to_recompute(get_watermarks(), watermarks, YEARS, set(YEARS)), {2000: None, 2001: None})
+
+
+class TestMerge(unittest.TestCase):
+
+    def test_merge_by_year_keeps_untouched_years(self):
+        res_container = incremental._merge_by_year([2000, 2001, 2002], get_res_container([2001, 2002], 2), get_res_container(YEARS, 1))
+        counts = res_container.get_res('n_employees_earn_more_than_managers')
+        self.assertEqual(counts.coords['year'], [2000, 2001, 2002])
+        np.testing.assert_array_equal(counts.values, [1, 2, 2])
+        np.testing.assert_array_equal(res_container.get_res('n_employees_earn_more_than_managers_by_dept').values, [[1, 1], [2, 2], [2, 2]])
+
+    def test_merge_by_year_drops_removed_years(self):
+        res_container = incremental._merge_by_year([2001], None, get_res_container(YEARS, 1))
+        self.assertEqual(res_container.get_res('n_employees_earn_more_than_managers').coords['year'], [2001])
+
+    def test_merge_by_dept(self):
+        res_container = incremental._merge_by_year(YEARS, get_res_container([2001], 2), get_res_container(YEARS, 1))
+        incremental._merge_by_dept(res_container, get_res_container(YEARS, 1), {2001: ['d002']}, set(YEARS), {'d001': 'Finance', 'd002': 'Marketing'})
+        counts = res_container.get_res('n_employees_earn_more_than_managers_by_dept')
+        np.testing.assert_array_equal(counts.values, [[1, 1], [1, 2]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+import numpy as np
+
+from sql_etudes_python.data_analysis import interval_sweep
+
+"""
+Tests for the in-process engine for finding the employees that earn more than their managers (see interval_sweep.py in
+the data_analysis package).
+"""
+
+
+def get_intervals(with_managers=True):
+    """Get intervals (in the layout returned by interval_sweep.load_intervals) of two departments in which employee 1
+    manages department 0 and employees 2 and 3 work in departments 0 and 1.
+
+    :param with_managers: if False, the intervals contain no managers
+    :return: dictionary mapping interval names to NumPy arrays
+    """
+    dm = ([1], [0], [2000], [2001]) if with_managers else ([], [], [], [])
+    return {
+        'dept_nos': np.array(['d001', 'd002']),
+        'dept_names': np.array(['Marketing', 'Finance']),
+        'emp_nos': np.array([1, 2, 3], dtype=np.int64),
+        'emp_is_female': np.array([False, True, False]),
+        'sal_emp_no': np.array([1, 2, 3], dtype=np.int64),
+        'sal_salary': np.array([50000, 60000, 40000], dtype=np.int64),
+        'sal_from_year': np.array([2000, 2000, 2000], dtype=np.int64),
+        'sal_to_year': np.array([2001, 2001, 2001], dtype=np.int64),
+        'de_emp_no': np.array([1, 2, 3], dtype=np.int64),
+        'de_dept': np.array([0, 0, 1], dtype=np.int64),
+        'de_from_year': np.array([2000, 2000, 2000], dtype=np.int64),
+        'de_to_year': np.array([2001, 2001, 2001], dtype=np.int64),
+        'dm_emp_no': np.array(dm[0], dtype=np.int64),
+        'dm_dept': np.array(dm[1], dtype=np.int64),
+        'dm_from_year': np.array(dm[2], dtype=np.int64),
+        'dm_to_year': np.array(dm[3], dtype=np.int64),
+    }
+
+
+class TestCountEmployeesEarnMoreThanManagers(unittest.TestCase):
+
+    def test_counts(self):
+        counts_year, counts_dept_year, counts_female_year = interval_sweep.count_employees_earn_more_than_managers(get_intervals(), [2000, 2001])
+        np.testing.assert_array_equal(counts_year, [1, 1])
+        np.testing.assert_array_equal(counts_dept_year, [[1, 1], [0, 0]])
+        np.testing.assert_array_equal(counts_female_year, [1, 1])
+
+    def test_no_managers(self):
+        counts_year, counts_dept_year, counts_female_year = interval_sweep.count_employees_earn_more_than_managers(get_intervals(False), [2000, 2001])
+        np.testing.assert_array_equal(counts_year, [0, 0])
+        np.testing.assert_array_equal(counts_dept_year, np.zeros((2, 2)))
+        np.testing.assert_array_equal(counts_female_year, [0, 0])
+
+    def test_no_years(self):
+        counts_year, counts_dept_year, counts_female_year = interval_sweep.count_employees_earn_more_than_managers(get_intervals(), [])
+        self.assertEqual(counts_year.shape, (0,))
+        self.assertEqual(counts_dept_year.shape, (2, 0))
+        self.assertEqual(counts_female_year.shape, (0,))
+
+    def test_res_container_no_years(self):
+        res_container = interval_sweep.get_res_container(get_intervals(), [])
+        self.assertEqual(res_container.get_res('n_employees_earn_more_than_managers_by_dept').shape, (0, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
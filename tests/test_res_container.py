@@ -0,0 +1,117 @@
+import unittest
+
+import numpy as np
+
+from sql_etudes_python.data_analysis.res_container import ArrayResContainer
+from sql_etudes_python.data_analysis.res_container import LabeledArray
+from sql_etudes_python.data_analysis.res_container import concat
+
+"""
+Tests for the containers of results indexed by several dimensions (see res_container.py in the data_analysis package).
+"""
+
+
+def get_array():
+    """Get a LabeledArray instance with dimensions year (2000-2002) and dept (Finance, Marketing)."""
+    return LabeledArray(np.arange(6).reshape(3, 2), ['year', 'dept'], {'year': [2000, 2001, 2002], 'dept': ['Finance', 'Marketing']})
+
+
+class TestLabeledArray(unittest.TestCase):
+
+    def test_invalid_coords(self):
+        with self.assertRaises(ValueError):
+            LabeledArray(np.zeros((2, 2)), ['year'], {'year': [2000, 2001]})
+        with self.assertRaises(ValueError):
+            LabeledArray(np.zeros((2, 2)), ['year', 'dept'], {'year': [2000], 'dept': ['Finance', 'Marketing']})
+
+    def test_from_dict(self):
+        array = LabeledArray.from_dict({2001: {'Marketing': 1.0}, 2000: {'Finance': 2.0, 'Marketing': 3.0}}, ['year', 'dept'])
+        self.assertEqual(array.coords, {'year': [2000, 2001], 'dept': ['Finance', 'Marketing']})
+        np.testing.assert_array_equal(array.values, [[2.0, 3.0], [np.nan, 1.0]])
+
+    def test_sel(self):
+        array = get_array()
+        self.assertEqual(array.sel(year=2001, dept='Marketing'), 3)
+        row = array.sel(year=2001)
+        self.assertEqual(row.dims, ('dept',))
+        np.testing.assert_array_equal(row.values, [2, 3])
+        self.assertTrue(np.shares_memory(row.values, array.values))
+
+    def test_sel_slice_includes_both_ends(self):
+        selected = get_array().sel(year=slice(2001, 2002))
+        self.assertEqual(selected.coords['year'], [2001, 2002])
+        np.testing.assert_array_equal(selected.values, [[2, 3], [4, 5]])
+
+    def test_sel_list(self):
+        selected = get_array().sel(year=[2002, 2000], dept=['Marketing'])
+        self.assertEqual(selected.coords, {'year': [2002, 2000], 'dept': ['Marketing']})
+        np.testing.assert_array_equal(selected.values, [[5], [1]])
+
+    def test_isel(self):
+        array = get_array()
+        self.assertEqual(array.isel(year=-1, dept=0), 4)
+        selected = array.isel(year=slice(0, 2), dept=[1])
+        self.assertEqual(selected.coords, {'year': [2000, 2001], 'dept': ['Marketing']})
+        np.testing.assert_array_equal(selected.values, [[1], [3]])
+
+    def test_unknown_dim_and_label(self):
+        with self.assertRaises(KeyError):
+            get_array().sel(gender='F')
+        with self.assertRaises(KeyError):
+            get_array().sel(year=1999)
+
+    def test_reindex(self):
+        array = get_array()
+        self.assertIs(array.reindex(year=[2000, 2001, 2002]), array)
+        reindexed = array.reindex(year=[2001, 2003], dept=['Marketing', 'Sales'])
+        self.assertEqual(reindexed.coords, {'year': [2001, 2003], 'dept': ['Marketing', 'Sales']})
+        np.testing.assert_array_equal(reindexed.values, [[3, np.nan], [np.nan, np.nan]])
+
+    def test_transpose(self):
+        transposed = get_array().transpose('dept', 'year')
+        self.assertEqual(transposed.dims, ('dept', 'year'))
+        self.assertEqual(transposed.sel(dept='Finance', year=2002), 4)
+        with self.assertRaises(ValueError):
+            get_array().transpose('dept')
+
+
+class TestConcat(unittest.TestCase):
+
+    def test_concat(self):
+        array = get_array()
+        concatenated = concat([array.sel(year=[2002]), array.sel(year=slice(2000, 2001))], 'year')
+        self.assertEqual(concatenated.coords['year'], [2002, 2000, 2001])
+        np.testing.assert_array_equal(concatenated.sel(year=[2000, 2001, 2002]).values, array.values)
+
+    def test_concat_aligns_other_dims(self):
+        other = LabeledArray([[7, 8]], ['dept', 'year'], {'dept': ['Sales'], 'year': [2003, 2004]})
+        concatenated = concat([get_array(), other], 'year')
+        self.assertEqual(concatenated.coords, {'year': [2000, 2001, 2002, 2003, 2004], 'dept': ['Finance', 'Marketing', 'Sales']})
+        self.assertTrue(np.isnan(concatenated.sel(year=2000, dept='Sales')))
+        self.assertEqual(concatenated.sel(year=2004, dept='Sales'), 8)
+
+
+class TestArrayResContainer(unittest.TestCase):
+
+    def test_rejects_other_results(self):
+        with self.assertRaises(TypeError):
+            ArrayResContainer().add_res_with_desc('counts', [1, 2], 'counts')
+
+    def test_bytes_round_trip(self):
+        res_container = ArrayResContainer()
+        res_container.add_res_with_desc('counts', get_array(), 'counts by year and department')
+        res_container.add_array_with_desc('portions', np.array([0.5, np.nan]), ['percentile'], {'percentile': [0.5, 0.9]}, 'portions')
+        res_container.add_array_with_desc('empty', np.zeros((0, 2), dtype=np.int64), ['year', 'dept'], {'year': [], 'dept': ['a', 'b']}, 'empty')
+
+        loaded = ArrayResContainer.from_bytes(res_container.to_bytes())
+        self.assertEqual([key for key, _, _ in loaded.items()], ['counts', 'portions', 'empty'])
+        for key, res, desc in res_container.items():
+            self.assertEqual(loaded.get_desc(key), desc)
+            self.assertEqual(loaded.get_res(key).dims, res.dims)
+            self.assertEqual(loaded.get_res(key).coords, res.coords)
+            self.assertEqual(loaded.get_res(key).values.dtype, res.values.dtype)
+            np.testing.assert_array_equal(loaded.get_res(key).values, res.values)
+
+
+if __name__ == '__main__':
+    unittest.main()